@@ -47,7 +47,6 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
@@ -58,13 +57,17 @@ setup(
     packages=find_packages('src'),
     package_dir={'': 'src'},
     include_package_data=True,
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         'blinker==1.*',
+        'cryptography>=3.1',
         'flask==1.*',
         'flask-migrate==2.*',
         'flask-restful==0.*',
         'flask-sqlalchemy==2.*',
         'jwcrypto==0.*',
     ],
+    extras_require={
+        'argon2': ['argon2-cffi'],
+    },
 )
@@ -0,0 +1,101 @@
+"""Ampho Core CLI Commands
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sys
+import json
+import click
+import subprocess
+from typing import List, Tuple
+from time import perf_counter
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_ampho.util import secho_error
+
+
+def parse_import_times(output: str) -> List[Tuple[str, float, float]]:
+    """Parse ``-X importtime`` output into top-level modules with self and cumulative times in seconds
+    """
+    r = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        parts = line[12:].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+
+        name = parts[2]
+        if len(name) - len(name.lstrip()) > 1:
+            # Nested import
+            continue
+
+        r.append((name.strip(), int(parts[0]) / 1e6, int(parts[1]) / 1e6))
+
+    return r
+
+
+def program_args() -> List[str]:
+    """Get arguments starting the current CLI program by a fresh interpreter
+
+    Programs run as ``python -m module`` are started the same way, while others, i. e. ``flask`` or custom scripts made
+    with ``FlaskGroup``, are started by their script path.
+    """
+    spec = getattr(sys.modules['__main__'], '__spec__', None)
+    if spec is not None:
+        name = spec.name[:-9] if spec.name.endswith('.__main__') else spec.name
+        return [sys.executable, '-X', 'importtime', '-m', name]
+
+    return [sys.executable, '-X', 'importtime', sys.argv[0]]
+
+
+def _echo_time(name: str, seconds: float):
+    click.echo(f'  {name:<40} {seconds * 1000:>10.1f} ms')
+
+
+@click.command()
+@click.option('-n', '--limit', default=20, help='Number of slowest imports to show')
+@click.option('--child', is_flag=True, hidden=True)
+@click.pass_context
+@with_appcontext
+def startup_profile(ctx: click.Context, limit: int, child: bool):
+    """Report time spent per initialization phase and per import
+    """
+    ampho = current_app.extensions['ampho']
+
+    if child:
+        # Subsystems not initialized yet are initialized now, so all phases are measured
+        ampho.init_subsystems()
+        click.echo(json.dumps(ampho.startup_profile))
+        return
+
+    # Modules are already imported by this process, so the application is loaded again by a fresh interpreter
+    started = perf_counter()
+    names = []
+    while ctx.parent:
+        names.insert(0, ctx.info_name)
+        ctx = ctx.parent
+    args = program_args() + names + ['--child']
+    proc = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    total = perf_counter() - started
+
+    try:
+        phases = json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        secho_error('Cannot profile application startup:')
+        click.echo(proc.stderr[-2000:], err=True)
+        sys.exit(1)
+
+    click.echo('Initialization phases:')
+    for name, seconds in phases:
+        _echo_time(name, seconds)
+
+    imports = parse_import_times(proc.stderr)
+    imports.sort(key=lambda x: x[2], reverse=True)
+    click.echo('Slowest imports (cumulative):')
+    for name, _, cumulative in imports[:limit]:
+        _echo_time(name, cumulative)
+
+    click.echo(f'Total startup time: {total * 1000:.1f} ms')
@@ -5,44 +5,205 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import os
+import atexit
 import logging
-import json
-from typing import Any
+import threading
+import click
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from time import perf_counter
+from contextlib import contextmanager
 from os import path
 from socket import gethostname
 from getpass import getuser
 from logging.handlers import TimedRotatingFileHandler
 from blinker import Namespace as BlinkerNamespace
-from flask import Flask
+from flask import Flask, Config
 from flask.cli import AppGroup
 from flask_ampho import __version__
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from .error import ConfigurationError
+from .settings import Settings, declare, compile_settings, as_bool, as_list
+from .json_codec import JsonCodec, get_codec
+from .log import AsyncLogging, BufferedTimedRotatingFileHandler, DedupFilter, JsonFormatter, RequestContextFilter
+from . import settings as _settings
+
+if TYPE_CHECKING:
+    from flask_sqlalchemy import SQLAlchemy
+    from flask_migrate import Migrate
+
+# Subsystems in initialization order
+SUBSYSTEMS = ('db', 'cache', 'security', 'metrics', 'http_cache', 'tasks')
+
+# Prefixes of subsystems' CLI commands
+_CLI_PREFIXES = {
+    'db': ('db-',),
+    'security': ('sec-', 'auth-'),
+    'tasks': ('worker',),
+}
+
+_MISSING = object()
+
+declare('AMPHO_SUBSYSTEMS', as_list, SUBSYSTEMS, lambda v: set(v) <= set(SUBSYSTEMS))
+declare('AMPHO_LAZY', as_bool)
+declare('AMPHO_CONFIG', as_bool, True)
+declare('AMPHO_CONFIG_DIR')
+declare('AMPHO_CONFIG_WATCH', as_bool, False)
+declare('AMPHO_CONFIG_WATCH_BACKEND', str, 'auto', lambda v: v in ('auto', 'inotify', 'poll'))
+declare('AMPHO_CONFIG_WATCH_INTERVAL', float, 2.0, lambda v: v > 0)
+declare('AMPHO_JSON_BACKEND', str, 'auto', lambda v: v in ('auto', 'orjson', 'ujson', 'json'))
+declare('AMPHO_LOG', as_bool, True)
+declare('AMPHO_LOG_DIR')
+declare('AMPHO_LOG_LEVEL', str, None, lambda v: isinstance(logging.getLevelName(v.upper()), int))
+declare('AMPHO_LOG_FORMAT')
+declare('AMPHO_LOG_ROTATE_WHEN', str, 'midnight')
+declare('AMPHO_LOG_BACKUP_COUNT', int, 30, lambda v: v >= 0)
+declare('AMPHO_LOG_ASYNC', as_bool, False)
+declare('AMPHO_LOG_QUEUE_SIZE', int, 10000, lambda v: v > 0)
+declare('AMPHO_LOG_OVERFLOW', str, 'drop_count', lambda v: v in ('block', 'drop', 'drop_count'))
+declare('AMPHO_LOG_BATCH_SIZE', int, 100, lambda v: v > 0)
+declare('AMPHO_LOG_JSON', as_bool, False)
+declare('AMPHO_LOG_DEDUP_WINDOW', float, 0.0, lambda v: v >= 0)
+
+
+def _import_subsystems():
+    from . import db, cache, security, metrics, http_cache, tasks
+
+
+_settings.add_loader(_import_subsystems, SUBSYSTEMS + ('auth', 'migration'))
+
+
+def _add_auth_migrations(sender: Flask, packages: List[str]):
+    packages.append('flask_ampho.auth')
+
+
+def _add_tasks_migrations(sender: Flask, packages: List[str]):
+    if sender.extensions['ampho'].settings.tasks_db:
+        packages.append('flask_ampho.tasks')
+
+
+class LazyAppGroup(AppGroup):
+    """Command group which loads commands on demand
+    """
+
+    def __init__(self, name: str, loader: Callable[[Optional[str]], Any], **attrs):
+        """Init
+
+        :param loader: callable receiving a command name, or ``None`` if all commands are required.
+        """
+        super().__init__(name, **attrs)
+        self.loader = loader
+
+    def get_command(self, ctx, cmd_name: str):
+        """Get a command, loading it if necessary
+        """
+        cmd = super().get_command(ctx, cmd_name)
+        if cmd is None:
+            self.loader(cmd_name)
+            cmd = super().get_command(ctx, cmd_name)
+
+        return cmd
+
+    def list_commands(self, ctx) -> List[str]:
+        """Load and list all commands
+        """
+        self.loader(None)
+
+        return super().list_commands(ctx)
+
+
+class _Subsystem:
+    """Attribute initializing a subsystem on first access
+    """
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, obj: 'Ampho', owner=None):
+        if obj is None:
+            return self
+
+        return obj.get_subsystem(self.name)
+
+    def __set__(self, obj: 'Ampho', value: Any):
+        obj._subsystems[self.name] = value
 
 
 class Ampho:
-    def __init__(self, app: Flask = None, sqlalchemy: SQLAlchemy = None, migrate: Migrate = None):
+    db = _Subsystem()
+    cache = _Subsystem()
+    security = _Subsystem()
+    metrics = _Subsystem()
+    http_cache = _Subsystem()
+    tasks = _Subsystem()
+
+    def __init__(self, app: Flask = None, sqlalchemy: 'SQLAlchemy' = None, migrate: 'Migrate' = None):
         """Init
         """
         self.root_path = path.dirname(__file__)
         self.app = app
         self.signals = BlinkerNamespace()
-        self.cli = AppGroup('ampho')
+        self.on_config_changed = self.signals.signal('config-changed')
+        self.on_config_reloaded = self.signals.signal('config-reloaded')
+        self.cli = LazyAppGroup('ampho', self._load_commands)
+
+        self._settings = None  # type: Optional[Settings]
+        self._settings_version = -1
 
-        self.db = None
-        self.security = None
+        self.startup_profile = []  # type: List[Tuple[str, float]]
+        self._subsystems = {}  # type: Dict[str, Any]
+        self._subsystems_lock = threading.RLock()
+        self._subsystems_ready = False
+        self._sqlalchemy = sqlalchemy
+        self._migrate = migrate
+
+        self.config_watcher = None
+        self.log_handler = None  # type: Optional[logging.Handler]
+        self.async_logging = None
+        self.log_dedup_filter = None
 
         default_config_dir = path.abspath(path.join(app.root_path, path.pardir, 'config'))
-        self.config_dir: str = self.get_config('AMPHO_CONFIG_DIR', default_config_dir)
+        self.config_dir: str = self.settings.config_dir or default_config_dir
+        self._config_file_keys = {}  # type: Dict[str, Set[str]]
+        self._config_base = {}  # type: Dict[str, Any]
 
         default_log_dir = path.abspath(path.join(self.app.root_path, path.pardir, 'log'))
-        self.log_dir = self.get_config('AMPHO_LOG_DIR', default_log_dir)
+        self.log_dir = self.settings.log_dir or default_log_dir
 
+        from ._cli import startup_profile
+        self.cli.add_command(startup_profile)
         app.cli.add_command(self.cli)
 
         if app:
             self.init_app(app, sqlalchemy, migrate)
 
+    @property
+    def settings(self) -> Settings:
+        """Compiled settings snapshot getter
+
+        The snapshot is resolved once from declared settings and recompiled only after configuration change.
+        """
+        s = self._settings
+        if s is None or self._settings_version != _settings.version():
+            version = _settings.version()
+            s = self._settings = compile_settings(self.get_config)
+            self._settings_version = version
+
+        return s
+
+    def config_changed(self, keys: Optional[Iterable[str]] = None):
+        """Notify subscribers about configuration change
+
+        The settings snapshot is dropped before the ``config-changed`` signal is sent, so receivers always see new
+        values. ``None`` keys mean that any configuration value may be changed.
+        """
+        self._settings = None
+        self.on_config_changed.send(self.app, keys=keys)
+
+    def set_config(self, key: str, value: Any):
+        """Set config value and notify subscribers
+        """
+        self.app.config[key] = value
+        self.config_changed([key])
+
     def get_config(self, key: str, default: Any = None) -> Any:
         """Get config value
         """
@@ -53,6 +214,12 @@ class Ampho:
         """
         return int(self.get_config(key, default))
 
+    @property
+    def json(self) -> JsonCodec:
+        """JSON codec
+        """
+        return get_codec(self.settings.json_backend)
+
     def get_config_bool(self, key: str, default: str = '1') -> bool:
         """Get boolean config value
         """
@@ -63,10 +230,42 @@ class Ampho:
         """
         v = self.get_config(key, default)
         if isinstance(v, str):
-            v = json.loads(v)
+            v = self.json.loads(v)
 
         return v
 
+    @property
+    def config_files(self) -> List[str]:
+        """Paths of configuration files in loading order, including non-existent ones
+        """
+        r = []
+        for config_name in ('default', os.getenv('FLASK_ENV', 'production'), f'{getuser()}@{gethostname()}'):
+            for ext in ('.py', '.json'):
+                r.append(path.join(self.config_dir, config_name) + ext)
+
+        return r
+
+    def _read_config_dir(self, config: Config) -> Dict[str, Set[str]]:
+        r = {}
+        for config_path in self.config_files:
+            if not path.isfile(config_path):
+                continue
+            part = Config(self.app.root_path)
+            if config_path.endswith('.json'):
+                part.from_json(config_path)
+            else:
+                part.from_pyfile(config_path)
+            config.update(part)
+            r[config_path] = set(part)
+
+        return r
+
+    def _remember_config_base(self, keys: Iterable[str]):
+        # Values which keys had before they were loaded from files are restored when keys are removed from files
+        for k in keys:
+            if k not in self._config_base:
+                self._config_base[k] = self.app.config.get(k, _MISSING)
+
     def load_config_dir(self):
         """Load configuration
         """
@@ -74,21 +273,74 @@ class Ampho:
             logging.warning(f'Configuration directory is not found at {self.config_dir}')
             return
 
-        for config_name in ('default', os.getenv('FLASK_ENV', 'production'), f'{getuser()}@{gethostname()}'):
-            for ext in ('.py', '.json'):
-                config_path = path.join(self.config_dir, config_name) + ext
-                if not path.isfile(config_path):
-                    continue
-                if ext == '.json':
-                    self.app.config.from_json(config_path)
-                else:
-                    self.app.config.from_pyfile(config_path)
+        staged = Config(self.app.root_path)
+        self._config_file_keys = self._read_config_dir(staged)
+        self._remember_config_base(staged)
+        self.app.config.update(staged)
+        self.config_changed()
+
+    def reload_config_dir(self) -> List[str]:
+        """Reload configuration files and apply changed values at once
+
+        New values are validated before applying. Keys removed from files get values they had before being loaded, or
+        are removed from the config. Returns list of changed keys.
+        """
+        staged = Config(self.app.root_path)
+        file_keys = self._read_config_dir(staged)
+        self._remember_config_base(staged)
+
+        changed = {k: v for k, v in staged.items() if self.app.config.get(k, _MISSING) != v}
+        removed = set().union(*self._config_file_keys.values()) - set(staged)
+        for k in removed:
+            base = self._config_base[k]
+            if self.app.config.get(k, _MISSING) != base:
+                changed[k] = base
+
+        if not changed:
+            self._config_file_keys = file_keys
+            return []
+
+        def get_staged(k: str, d: Any) -> Any:
+            if k not in changed:
+                return self.get_config(k, d)
+            v = changed[k]
+            return os.getenv(k, d) if v is _MISSING else v
+
+        version = _settings.version()
+        try:
+            settings = compile_settings(get_staged)
+        except ConfigurationError as e:
+            logging.error('Configuration is not reloaded: %s', e)
+            return []
+
+        # Readers see either the previous or the new snapshot
+        self.app.config.update({k: v for k, v in changed.items() if v is not _MISSING})
+        for k, v in changed.items():
+            if v is _MISSING:
+                self.app.config.pop(k, None)
+        self._settings, self._settings_version = settings, version
+        self._config_file_keys = file_keys
+        for k in removed:
+            del self._config_base[k]
+
+        keys = list(changed)
+        self.on_config_changed.send(self.app, keys=keys)
+        self.on_config_reloaded.send(self.app, keys=keys)
+        logging.info('Configuration reloaded: %s', ', '.join(keys))
+
+        return keys
+
+    def _on_config_changed(self, sender: Flask, keys: Optional[Iterable[str]] = None):
+        if (keys is None or 'AMPHO_LOG_LEVEL' in keys) and self.settings.log_level:
+            logging.getLogger().setLevel(self.settings.log_level.upper())
 
     def init_logging(self):
         """Init logging
         """
-        # Set default log leve;
-        if self.app.debug:
+        # Set default log level
+        if self.settings.log_level:
+            logging.getLogger().setLevel(self.settings.log_level.upper())
+        elif self.app.debug:
             logging.getLogger().setLevel(logging.DEBUG)
 
         # Ensure log directory
@@ -102,36 +354,190 @@ class Ampho:
 
         # Other parameters
         log_path = path.join(self.log_dir, self.app.name + '.log')
-        rotate_when = self.get_config('AMPHO_LOG_ROTATE_WHEN', 'midnight')
-        backup_count = int(self.get_config('AMPHO_LOG_BACKUP_COUNT', 30))
+        rotate_when = self.settings.log_rotate_when
+        backup_count = self.settings.log_backup_count
 
         # Setup handler
-        handler = TimedRotatingFileHandler(log_path, rotate_when, backupCount=backup_count)
-        handler.setFormatter(logging.Formatter(self.get_config('AMPHO_LOG_FORMAT', fmt)))
+        if self.settings.log_async:
+            handler = BufferedTimedRotatingFileHandler(log_path, rotate_when, backupCount=backup_count)
+        else:
+            handler = TimedRotatingFileHandler(log_path, rotate_when, backupCount=backup_count)
+        if self.settings.log_json:
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter(self.settings.log_format or fmt))
+        self.log_handler = handler
+
+        # File I/O and rotation are performed by a background listener, request threads only enqueue records
+        if self.settings.log_async:
+            self.async_logging = AsyncLogging(handler, self.settings.log_queue_size, self.settings.log_overflow,
+                                              self.settings.log_batch_size)
+            self.async_logging.start()
+            atexit.register(self.shutdown_logging)
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self.async_logging.after_fork)
+            handler = self.async_logging.queue_handler
+
+        # Filters are applied by the emitting thread, so suppressed records never reach the queue
+        if self.settings.log_dedup_window:
+            self.log_dedup_filter = DedupFilter(self.settings.log_dedup_window)
+            handler.addFilter(self.log_dedup_filter)
+            self.log_dedup_filter.start(handler)
+            if not self.async_logging:
+                atexit.register(self.shutdown_logging)
+        handler.addFilter(RequestContextFilter())
+
         logging.getLogger().addHandler(handler)
 
-    def init_app(self, app: Flask, sqlalchemy: SQLAlchemy = None, migrate: Migrate = None):
+    def shutdown_logging(self):
+        """Write pending log records and close the log handler
+        """
+        # Counts of suppressed messages are reported before the handler is gone
+        if self.log_dedup_filter:
+            self.log_dedup_filter.stop()
+            self.log_dedup_filter = None
+
+        if self.async_logging:
+            logging.getLogger().removeHandler(self.async_logging.queue_handler)
+            self.async_logging.stop()
+            self.async_logging = None
+        elif self.log_handler:
+            logging.getLogger().removeHandler(self.log_handler)
+
+        if self.log_handler:
+            self.log_handler.close()
+            self.log_handler = None
+
+    @contextmanager
+    def _profile(self, phase: str) -> Iterator[None]:
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_profile.append((phase, perf_counter() - started))
+
+    def init_app(self, app: Flask, sqlalchemy: 'SQLAlchemy' = None, migrate: 'Migrate' = None):
         """Initialize Ampho
+
+        Subsystems are initialized right away if ``AMPHO_LAZY`` is ``0``. Otherwise each subsystem is initialized on
+        first access to it, on invocation of its CLI command or before the first request.
         """
         self.app = app
         app.extensions['ampho'] = self
+        self._sqlalchemy = sqlalchemy or self._sqlalchemy
+        self._migrate = migrate or self._migrate
 
         # Configuration
-        if self.get_config_bool('AMPHO_CONFIG'):
-            self.load_config_dir()
+        if self.settings.config:
+            with self._profile('config'):
+                self.load_config_dir()
 
         # Logging
-        if self.get_config_bool('AMPHO_LOG'):
-            self.init_logging()
+        if self.settings.log:
+            with self._profile('logging'):
+                self.init_logging()
+                self.on_config_changed.connect(self._on_config_changed)
 
-        # Database
-        from .db import Db
-        if not sqlalchemy:
-            sqlalchemy = SQLAlchemy(app)
-        self.db = Db(self, sqlalchemy, migrate or Migrate(app, sqlalchemy))
+        # Configuration hot reload
+        if self.settings.config and self.settings.config_watch:
+            with self._profile('config_watcher'):
+                from .config_watcher import ConfigWatcher
+                self.config_watcher = ConfigWatcher(self, self.settings.config_watch_interval,
+                                                    self.settings.config_watch_backend)
+                self.config_watcher.start()
+
+        # Security and tasks migrations must be found even if these subsystems are not initialized
+        if 'security' in self.settings.subsystems:
+            self.signals.signal('get-migration-packages').connect(_add_auth_migrations, app)
+        if 'tasks' in self.settings.subsystems:
+            self.signals.signal('get-migration-packages').connect(_add_tasks_migrations, app)
+
+        lazy = self.settings.lazy
+        if lazy is None:
+            # CLI commands pay only for subsystems they use, while servers, which may fork workers after loading the
+            # application, get subsystems initialized before forking
+            lazy = click.get_current_context(silent=True) is not None
 
-        if not self.security:
-            from .security import Security
-            self.security = Security(self)
+        if lazy:
+            # Subsystems register routes and request hooks, so they must be ready before the first request is routed
+            wsgi_app = app.wsgi_app
+
+            def _wsgi_app(environ, start_response):
+                if not self._subsystems_ready:
+                    self.init_subsystems()
+                return wsgi_app(environ, start_response)
+
+            app.wsgi_app = _wsgi_app
+        else:
+            self.init_subsystems()
 
         logging.info('Ampho %s initialized', __version__)
+
+    def get_subsystem(self, name: str) -> Any:
+        """Get a subsystem, initializing it if necessary
+
+        Returns ``None`` if the subsystem is disabled.
+        """
+        try:
+            return self._subsystems[name]
+        except KeyError:
+            pass
+
+        with self._subsystems_lock:
+            if name not in self._subsystems:
+                obj = None
+                if name in self.settings.subsystems:
+                    with self._profile(name):
+                        obj = getattr(self, f'_init_{name}')()
+                self._subsystems[name] = obj
+
+            return self._subsystems[name]
+
+    def init_subsystems(self):
+        """Initialize all enabled subsystems
+
+        Call it explicitly to initialize subsystems before forking workers of a pre-forking server.
+        """
+        for name in SUBSYSTEMS:
+            self.get_subsystem(name)
+
+        self._subsystems_ready = True
+
+    def _load_commands(self, cmd_name: Optional[str]):
+        for name, prefixes in _CLI_PREFIXES.items():
+            if cmd_name is None or cmd_name.startswith(prefixes):
+                self.get_subsystem(name)
+
+    def _init_db(self):
+        from flask_sqlalchemy import SQLAlchemy
+        from flask_migrate import Migrate
+        from .db import Db
+
+        sqlalchemy = self._sqlalchemy or SQLAlchemy(self.app)
+
+        return Db(self, sqlalchemy, self._migrate or Migrate(self.app, sqlalchemy))
+
+    def _init_cache(self):
+        from .cache import make_cache
+
+        return make_cache(self) if self.settings.cache else None
+
+    def _init_security(self):
+        from .security import Security
+
+        return Security(self)
+
+    def _init_metrics(self):
+        from .metrics import Metrics
+
+        return Metrics(self) if self.settings.metrics else None
+
+    def _init_http_cache(self):
+        from .http_cache import HttpCache
+
+        return HttpCache(self) if self.settings.http_cache else None
+
+    def _init_tasks(self):
+        from .tasks import Tasks
+
+        return Tasks(self)
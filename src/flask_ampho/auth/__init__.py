@@ -0,0 +1,5 @@
+"""Ampho Auth
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
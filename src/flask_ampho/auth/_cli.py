@@ -0,0 +1,39 @@
+"""Ampho Auth CLI Commands
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import click
+from flask import current_app
+from flask_ampho import Ampho
+from flask_ampho.util import secho_success, secho_error
+from .error import AuthError
+
+ampho = current_app.extensions['ampho']  # type: Ampho
+
+
+@ampho.cli.command()
+@click.argument('login')
+@click.password_option()
+def auth_user_add(login: str, password: str):
+    """Create a user
+    """
+    try:
+        current_app.extensions['ampho'].security.users.create(login, password)
+        secho_success(f'User created: {login}')
+    except AuthError as e:
+        secho_error(str(e))
+
+
+@ampho.cli.command()
+@click.argument('login')
+@click.password_option()
+def auth_user_passwd(login: str, password: str):
+    """Change user's password
+    """
+    try:
+        current_app.extensions['ampho'].security.users.set_password(login, password)
+        secho_success(f'Password changed: {login}')
+    except AuthError as e:
+        secho_error(str(e))
@@ -0,0 +1,27 @@
+"""Ampho Auth Exceptions
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from flask_ampho.error import AmphoError
+
+
+class AuthError(AmphoError):
+    pass
+
+
+class UserExistsError(AuthError):
+    pass
+
+
+class UserNotFoundError(AuthError):
+    pass
+
+
+class UnsupportedHashError(AuthError):
+    pass
+
+
+class HashingPoolBusyError(AuthError):
+    pass
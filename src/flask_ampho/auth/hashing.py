@@ -0,0 +1,103 @@
+"""Ampho Password Hashing
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import hmac
+import hashlib
+from typing import Optional
+from os import urandom
+from base64 import b64encode, b64decode
+from .error import UnsupportedHashError
+
+try:
+    import argon2
+except ImportError:  # pragma: no cover
+    argon2 = None
+
+DEFAULT_PARAMS = {
+    'pbkdf2_sha256': {'iterations': 260000},
+    'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+    'argon2': {'time_cost': 2, 'memory_cost': 102400, 'parallelism': 8},
+}
+
+
+def _argon2_hasher(params: dict):
+    if argon2 is None:
+        raise UnsupportedHashError("Argon2 hashing requires the 'argon2-cffi' package")
+
+    return argon2.PasswordHasher(**params)
+
+
+def hash_password(password: str, scheme: str = 'pbkdf2_sha256', params: Optional[dict] = None) -> str:
+    """Hash a password
+    """
+    if scheme not in DEFAULT_PARAMS:
+        raise UnsupportedHashError(f'Unsupported password hashing scheme: {scheme}')
+
+    params = dict(DEFAULT_PARAMS[scheme], **(params or {}))
+    salt = urandom(16)
+
+    if scheme == 'pbkdf2_sha256':
+        dk = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['iterations'])
+        return f"pbkdf2_sha256${params['iterations']}${b64encode(salt).decode()}${b64encode(dk).decode()}"
+
+    if scheme == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        dk = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20)
+        return f'scrypt${n}${r}${p}${b64encode(salt).decode()}${b64encode(dk).decode()}'
+
+    return _argon2_hasher(params).hash(password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    """Verify a password against a hash
+    """
+    if hashed.startswith('$argon2'):
+        hasher = _argon2_hasher({})
+        try:
+            return hasher.verify(hashed, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHash):
+            return False
+
+    parts = hashed.split('$')
+
+    # binascii.Error of malformed base64 is a ValueError too
+    try:
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            salt, expected = b64decode(parts[2], validate=True), b64decode(parts[3], validate=True)
+            dk = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, int(parts[1]))
+            return hmac.compare_digest(dk, expected)
+
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = b64decode(parts[4], validate=True), b64decode(parts[5], validate=True)
+            dk = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20,
+                                dklen=len(expected))
+            return hmac.compare_digest(dk, expected)
+    except (ValueError, OverflowError) as e:
+        raise UnsupportedHashError(f'Malformed password hash: {e}') from e
+
+    raise UnsupportedHashError('Unsupported password hash format')
+
+
+def needs_rehash(hashed: str, scheme: str = 'pbkdf2_sha256', params: Optional[dict] = None) -> bool:
+    """Check whether a hash was made using another scheme or weaker parameters
+    """
+    params = dict(DEFAULT_PARAMS.get(scheme, {}), **(params or {}))
+
+    if scheme == 'argon2':
+        return not hashed.startswith('$argon2') or _argon2_hasher(params).check_needs_rehash(hashed)
+
+    parts = hashed.split('$')
+    if parts[0] != scheme:
+        return True
+
+    try:
+        if scheme == 'pbkdf2_sha256':
+            return int(parts[1]) < params['iterations']
+
+        return (int(parts[1]), int(parts[2]), int(parts[3])) != (params['n'], params['r'], params['p'])
+    except (IndexError, ValueError) as e:
+        raise UnsupportedHashError(f'Malformed password hash: {e}') from e
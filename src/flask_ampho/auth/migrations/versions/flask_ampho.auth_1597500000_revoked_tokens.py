@@ -0,0 +1,31 @@
+"""Revoked tokens
+
+Revision ID: flask_ampho.auth_1597500000
+Revises:
+Create Date: 2020-08-15 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'flask_ampho.auth_1597500000'
+down_revision = None
+branch_labels = ('flask_ampho.auth',)
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ampho_revoked_tokens',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('jti', sa.String(64), nullable=False, unique=True),
+        sa.Column('exp', sa.Integer, nullable=False),
+    )
+    op.create_index('ix_ampho_revoked_tokens_exp', 'ampho_revoked_tokens', ['exp'])
+
+
+def downgrade():
+    op.drop_index('ix_ampho_revoked_tokens_exp', 'ampho_revoked_tokens')
+    op.drop_table('ampho_revoked_tokens')
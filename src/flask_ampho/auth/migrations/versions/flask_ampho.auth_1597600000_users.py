@@ -0,0 +1,29 @@
+"""Users
+
+Revision ID: flask_ampho.auth_1597600000
+Revises: flask_ampho.auth_1597500000
+Create Date: 2020-08-16 17:46:40.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'flask_ampho.auth_1597600000'
+down_revision = 'flask_ampho.auth_1597500000'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ampho_users',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('login', sa.String(255), nullable=False, unique=True),
+        sa.Column('password', sa.String(255), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('ampho_users')
@@ -0,0 +1,67 @@
+"""Ampho Password Hashing Pool
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, Optional
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from flask_ampho.error import ConfigurationError
+from .error import HashingPoolBusyError
+
+
+class HashingPool:
+    """Bounded pool to run password hashing off request threads
+
+    Not more than ``concurrency`` hashing operations run at the same time. A caller waits for a free slot not longer
+    than ``timeout`` seconds, after that :class:`HashingPoolBusyError` is raised, so slow hashing cannot tie up all the
+    request threads during a login storm.
+    """
+
+    def __init__(self, concurrency: int = 2, timeout: float = 5.0, kind: str = 'thread'):
+        """Init
+        """
+        if kind not in ('thread', 'process'):
+            raise ConfigurationError(f'Unknown hashing pool kind: {kind}')
+
+        self.concurrency = max(concurrency, 1)
+        self.timeout = timeout
+        self.kind = kind
+
+        self._slots = BoundedSemaphore(self.concurrency)
+        self._executor = None  # type: Optional[Executor]
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> Executor:
+        """Executor getter
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(self.concurrency)
+                    else:
+                        self._executor = ThreadPoolExecutor(self.concurrency, 'ampho-hashing')
+
+        return self._executor
+
+    def run(self, fn: Callable, *args):
+        """Run a function in the pool and wait for its result
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingPoolBusyError('Password hashing pool is busy')
+
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """Shutdown the pool
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
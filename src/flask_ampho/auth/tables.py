@@ -0,0 +1,23 @@
+"""Ampho Auth Tables
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sqlalchemy as sa
+
+metadata = sa.MetaData()
+
+revoked_tokens = sa.Table(
+    'ampho_revoked_tokens', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('jti', sa.String(64), nullable=False, unique=True),
+    sa.Column('exp', sa.Integer, nullable=False, index=True),
+)
+
+users = sa.Table(
+    'ampho_users', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('login', sa.String(255), nullable=False, unique=True),
+    sa.Column('password', sa.String(255), nullable=False),
+)
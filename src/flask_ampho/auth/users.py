@@ -0,0 +1,115 @@
+"""Ampho User Credentials Store
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+from typing import Optional
+from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_json
+from .tables import users
+from .hashing import hash_password, verify_password, needs_rehash
+from .pool import HashingPool
+from .error import UserExistsError, UserNotFoundError
+
+declare('AMPHO_AUTH_HASH_SCHEME', str, 'pbkdf2_sha256', lambda v: v in ('pbkdf2_sha256', 'scrypt', 'argon2'))
+declare('AMPHO_AUTH_HASH_PARAMS', as_json, {}, lambda v: isinstance(v, dict))
+declare('AMPHO_AUTH_HASH_POOL', str, 'thread', lambda v: v in ('thread', 'process'))
+declare('AMPHO_AUTH_HASH_CONCURRENCY', int, os.cpu_count() or 1, lambda v: v > 0)
+declare('AMPHO_AUTH_HASH_TIMEOUT', float, 5.0, lambda v: v >= 0)
+
+
+class UserStore:
+    """User credentials store
+
+    Password hashing and verification run in a bounded :class:`HashingPool`.
+    """
+
+    def __init__(self, ampho: Ampho):
+        """Init
+        """
+        self.ampho = ampho
+        self.table = users
+        settings = ampho.settings
+        self.pool = HashingPool(
+            settings.auth_hash_concurrency,
+            settings.auth_hash_timeout,
+            settings.auth_hash_pool,
+        )
+        self._dummy_hash = None  # type: Optional[str]
+
+    @property
+    def engine(self):
+        """Database engine getter
+        """
+        return self.ampho.db.sqlalchemy.get_engine(self.ampho.app)
+
+    @property
+    def hash_scheme(self) -> str:
+        """Password hashing scheme getter
+        """
+        return self.ampho.settings.auth_hash_scheme
+
+    @property
+    def hash_params(self) -> dict:
+        """Password hashing parameters getter
+        """
+        return self.ampho.settings.auth_hash_params
+
+    def hash_password(self, password: str) -> str:
+        """Hash a password using configured scheme
+        """
+        return self.pool.run(hash_password, password, self.hash_scheme, self.hash_params)
+
+    def get(self, login: str) -> Optional[dict]:
+        """Get a user by login
+        """
+        t = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(t.select().where(t.c.login == login)).first()
+
+        return dict(row) if row else None
+
+    def create(self, login: str, password: str) -> dict:
+        """Create a user
+        """
+        if self.get(login):
+            raise UserExistsError(f'User already exists: {login}')
+
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert().values(login=login, password=self.hash_password(password)))
+
+        return self.get(login)
+
+    def set_password(self, login: str, password: str):
+        """Set user's password
+        """
+        t = self.table
+        hashed = self.hash_password(password)
+        with self.engine.begin() as conn:
+            if not conn.execute(t.update().where(t.c.login == login).values(password=hashed)).rowcount:
+                raise UserNotFoundError(f'User not found: {login}')
+
+    def authenticate(self, login: str, password: str) -> Optional[dict]:
+        """Verify user's credentials
+
+        Returns the user on success. If the password hash is outdated, the password is rehashed using current
+        configuration.
+        """
+        user = self.get(login) if login else None
+
+        if not user:
+            # Spend the same time as for an existing user to not disclose which logins exist
+            if self._dummy_hash is None:
+                self._dummy_hash = self.hash_password(os.urandom(16).hex())
+            self.pool.run(verify_password, password or '', self._dummy_hash)
+            return None
+
+        if not self.pool.run(verify_password, password or '', user['password']):
+            return None
+
+        if needs_rehash(user['password'], self.hash_scheme, self.hash_params):
+            self.set_password(login, password)
+
+        return user
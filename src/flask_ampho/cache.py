@@ -0,0 +1,448 @@
+"""Ampho Cache
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List
+from time import time
+from hashlib import sha1
+from functools import wraps
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Query, Session, scoped_session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import find_tables
+from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_bool
+
+declare('AMPHO_CACHE', as_bool, True)
+declare('AMPHO_CACHE_BACKEND', str, 'memory', lambda v: v in ('memory', 'sqlite'))
+declare('AMPHO_CACHE_FILE')
+declare('AMPHO_CACHE_SIZE', int, 10000, lambda v: v > 0)
+declare('AMPHO_CACHE_TTL', float, 300.0, lambda v: v > 0)
+
+MISSING = object()
+
+
+class CacheBackend:
+    """Base class of cache backends
+    """
+
+    def __init__(self):
+        """Init
+        """
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        """Get a value or :data:`MISSING`
+        """
+        raise NotImplementedError()
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Set a value
+        """
+        raise NotImplementedError()
+
+    def delete(self, key: str):
+        """Delete a value
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        """Delete all values
+        """
+        raise NotImplementedError()
+
+    def generations(self, tables: Iterable[str]) -> List[int]:
+        """Get generations of tables
+        """
+        raise NotImplementedError()
+
+    def bump(self, tables: Iterable[str]):
+        """Increment generations of tables, invalidating values depending on them
+        """
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU backend with per-entry expiration
+    """
+
+    def __init__(self, max_size: int = 10000):
+        """Init
+        """
+        super().__init__()
+        self.max_size = max_size
+        self._data = OrderedDict()  # type: OrderedDict
+        self._generations = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Any:
+        """Get a value or :data:`MISSING`
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+
+            if entry[1] <= time():
+                del self._data[key]
+                return MISSING
+
+            self._data.move_to_end(key)
+
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Set a value
+        """
+        with self._lock:
+            self._data[key] = (value, time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        """Delete a value
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Delete all values
+        """
+        with self._lock:
+            self._data.clear()
+
+    def generations(self, tables: Iterable[str]) -> List[int]:
+        """Get generations of tables
+        """
+        g = self._generations
+
+        return [g.get(t, 0) for t in tables]
+
+    def bump(self, tables: Iterable[str]):
+        """Increment generations of tables
+        """
+        with self._lock:
+            for t in tables:
+                self._generations[t] = self._generations.get(t, 0) + 1
+
+
+class SqliteBackend(CacheBackend):
+    """SQLite backend shared by all processes on a host
+
+    Values are pickled. Expired entries and entries above the size limit are removed periodically, least recently
+    stored first.
+    """
+
+    def __init__(self, file_path: str, max_size: int = 10000, prune_interval: int = 100):
+        """Init
+        """
+        super().__init__()
+        self.file_path = file_path
+        self.max_size = max_size
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._sets = 0
+        os.makedirs(os.path.dirname(file_path), 0o755, True)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Get a connection of the current thread and process
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            conn.execute('CREATE TABLE IF NOT EXISTS generations (name TEXT PRIMARY KEY, gen INTEGER)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def get(self, key: str) -> Any:
+        """Get a value or :data:`MISSING`
+        """
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time())).fetchone()
+
+        return pickle.loads(row[0]) if row else MISSING
+
+    def set(self, key: str, value: Any, ttl: float):
+        """Set a value
+        """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        conn = self.connection
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', (key, data, time() + ttl))
+
+        self._sets += 1
+        if self._sets % self.prune_interval == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove expired entries and entries above the size limit
+        """
+        conn = self.connection
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (time(),))
+        excess = len(self) - self.max_size
+        if excess > 0:
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)', (excess,))
+            self.evictions += excess
+
+    def delete(self, key: str):
+        """Delete a value
+        """
+        self.connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        """Delete all values
+        """
+        self.connection.execute('DELETE FROM cache')
+
+    def generations(self, tables: Iterable[str]) -> List[int]:
+        """Get generations of tables
+        """
+        tables = list(tables)
+        if not tables:
+            return []
+
+        q = f'SELECT name, gen FROM generations WHERE name IN ({",".join("?" * len(tables))})'
+        found = dict(self.connection.execute(q, tables).fetchall())
+
+        return [found.get(t, 0) for t in tables]
+
+    def bump(self, tables: Iterable[str]):
+        """Increment generations of tables
+        """
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for t in tables:
+                conn.execute('INSERT OR IGNORE INTO generations (name, gen) VALUES (?, 0)', (t,))
+                conn.execute('UPDATE generations SET gen = gen + 1 WHERE name = ?', (t,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def _touched_tables(session: Session) -> List[str]:
+    r = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for t in inspect(obj).mapper.tables:
+            r.add(t.name)
+
+    return list(r)
+
+
+def _bulk_tables(bulk_context) -> List[str]:
+    mapper = bulk_context.mapper
+    if mapper is not None:
+        return [t.name for t in mapper.tables]
+
+    return [bulk_context.primary_table.name]
+
+
+class Cache:
+    """Cache
+
+    Cached values may depend on database tables. Each table has a generation number, which is a part of keys of
+    values depending on the table, and which is incremented after a session commit changing the table. So values are
+    never read after their tables are changed and expire later.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = 300.0):
+        """Init
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        # Several caches may track the same session
+        self._touched_key = ('ampho_touched', id(self))
+
+    def _key(self, key: str, tables: Iterable[str]) -> str:
+        tables = sorted(tables)
+        if not tables:
+            return key
+
+        gens = self.backend.generations(tables)
+
+        return key + '@' + ','.join(f'{t}:{g}' for t, g in zip(tables, gens))
+
+    def get(self, key: str, tables: Iterable[str] = ()) -> Any:
+        """Get a value or :data:`MISSING`
+        """
+        value = self.backend.get(self._key(key, tables))
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return value
+
+    def set(self, key: str, value: Any, tables: Iterable[str] = (), ttl: float = None):
+        """Set a value
+        """
+        self.backend.set(self._key(key, tables), value, ttl or self.ttl)
+
+    def get_or_set(self, key: str, fn: Callable[[], Any], tables: Iterable[str] = (), ttl: float = None) -> Any:
+        """Get a value, computing and storing it on miss
+        """
+        full_key = self._key(key, tables)
+        value = self.backend.get(full_key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = fn()
+        self.backend.set(full_key, value, ttl or self.ttl)
+
+        return value
+
+    def delete(self, key: str, tables: Iterable[str] = ()):
+        """Delete a value
+        """
+        self.backend.delete(self._key(key, tables))
+
+    def clear(self):
+        """Delete all values
+        """
+        self.backend.clear()
+
+    def invalidate(self, *tables: str):
+        """Invalidate values depending on tables
+        """
+        if tables:
+            self.backend.bump(tables)
+            self.invalidations += 1
+
+    def cached(self, ttl: float = None, tables: Iterable[str] = (), key: Callable[..., str] = None) -> Callable:
+        """Decorator caching function results
+
+        By default the cache key is made of function's qualified name and ``repr()`` of its arguments.
+        """
+        tables = tuple(tables)
+
+        def decorator(f: Callable):
+            prefix = f'{f.__module__}.{f.__qualname__}'
+
+            @wraps(f)
+            def deco(*args, **kwargs):
+                if key:
+                    k = key(*args, **kwargs)
+                else:
+                    k = sha1(repr((args, sorted(kwargs.items()))).encode()).hexdigest()
+
+                return self.get_or_set(f'{prefix}:{k}', lambda: f(*args, **kwargs), tables, ttl)
+
+            deco.cache_clear = lambda: self.invalidate(*tables)
+
+            return deco
+
+        return decorator
+
+    def query(self, q: Query, ttl: float = None, method: str = 'all') -> Any:
+        """Get results of a query
+
+        Tables the query depends on are detected automatically.
+
+        :param method: name of the query method to get results by, i. e. ``all``, ``first``, ``count``.
+        """
+        stmt = q.statement
+        compiled = stmt.compile()
+        tables = {t.name for t in find_tables(stmt, include_joins=True, include_aliases=True) if hasattr(t, 'name')}
+        k = sha1(f'{method}:{compiled}:{sorted(compiled.params.items())!r}'.encode()).hexdigest()
+
+        return self.get_or_set(f'query:{k}', getattr(q, method), tables, ttl)
+
+    def track(self, session: scoped_session):
+        """Invalidate values depending on tables changed by sessions after commits
+
+        Tables are collected from flushed objects, from ``Query.update()`` and ``Query.delete()``, and from
+        ``INSERT``, ``UPDATE`` and ``DELETE`` statements executed by the session. Tables changed by textual SQL are
+        not detected, they must be invalidated explicitly.
+        """
+        event.listen(session, 'after_begin', self._after_begin)
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_bulk_update', self._after_bulk)
+        event.listen(session, 'after_bulk_delete', self._after_bulk)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+
+    def _touched(self, session: Session) -> set:
+        return session.info.setdefault(self._touched_key, set())
+
+    def _after_begin(self, session: Session, transaction, connection: Connection):
+        # Connections are listened to while they are used by the session only, see _after_execute()
+        connection.info[self._touched_key] = self._touched(session)
+        if not event.contains(connection, 'after_execute', self._after_execute):
+            event.listen(connection, 'after_execute', self._after_execute)
+
+    def _after_execute(self, conn: Connection, clause_element, multiparams, params, result):
+        touched = conn.info.get(self._touched_key)
+        if touched is not None and isinstance(clause_element, UpdateBase):
+            touched.add(clause_element.table.name)
+
+    def _after_flush(self, session: Session, flush_context):
+        self._touched(session).update(_touched_tables(session))
+
+    def _after_bulk(self, bulk_context):
+        self._touched(bulk_context.session).update(_bulk_tables(bulk_context))
+
+    def _after_commit(self, session: Session):
+        touched = session.info.pop(self._touched_key, None)
+        if touched:
+            self.invalidate(*touched)
+
+    def _after_rollback(self, session: Session):
+        session.info.pop(self._touched_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get statistics
+        """
+        return {
+            'size': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+def make_cache(ampho: Ampho) -> Cache:
+    """Create a cache from configuration
+    """
+    settings = ampho.settings
+    if settings.cache_backend == 'sqlite':
+        default_path = os.path.join(ampho.app.instance_path, 'ampho', 'cache.sqlite')
+        backend = SqliteBackend(settings.cache_file or default_path, settings.cache_size)
+    else:
+        backend = MemoryBackend(settings.cache_size)
+
+    cache = Cache(backend, settings.cache_ttl)
+    cache.track(ampho.db.sqlalchemy.session)
+
+    return cache
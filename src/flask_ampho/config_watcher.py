@@ -0,0 +1,158 @@
+"""Ampho Configuration Watcher
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import sys
+import select
+import ctypes
+import ctypes.util
+import logging
+from typing import Optional, Tuple
+from threading import Thread, Event
+from flask_ampho import Ampho
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+def _inotify_init(dir_path: str) -> Optional[int]:
+    """Start watching a directory using inotify
+
+    Returns inotify file descriptor or ``None`` if inotify is not available.
+    """
+    if not sys.platform.startswith('linux') or not os.path.isdir(dir_path):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+
+        if libc.inotify_add_watch(fd, os.fsencode(dir_path), _IN_MASK) < 0:
+            os.close(fd)
+            return None
+
+        return fd
+
+    except (OSError, AttributeError):
+        return None
+
+
+class ConfigWatcher:
+    """Configuration directory watcher
+
+    Watches configuration files in a background thread using inotify, if available, or polling files modification
+    times otherwise, and reloads configuration on change.
+    """
+
+    def __init__(self, ampho: Ampho, interval: float = 2.0, backend: str = 'auto'):
+        """Init
+        """
+        self.ampho = ampho
+        self.interval = interval
+        self.backend = backend
+
+        self._thread = None  # type: Optional[Thread]
+        self._stop = Event()
+        self._fd = None  # type: Optional[int]
+        self._at_fork_registered = False
+
+    @property
+    def is_running(self) -> bool:
+        """Check whether the watcher is running
+        """
+        return bool(self._thread and self._thread.is_alive())
+
+    def _signature(self) -> Tuple:
+        r = []
+        for file_path in self.ampho.config_files:
+            try:
+                st = os.stat(file_path)
+                r.append((file_path, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                r.append((file_path, None, None))
+
+        return tuple(r)
+
+    def start(self):
+        """Start watching
+        """
+        if self.is_running:
+            return
+
+        self._stop.clear()
+        self._fd = _inotify_init(self.ampho.config_dir) if self.backend in ('auto', 'inotify') else None
+        if self._fd is None and self.backend == 'inotify':
+            logging.warning('inotify is not available, configuration changes will be polled')
+
+        self._thread = Thread(target=self._run, args=(self._signature(),), name='ampho-config-watcher', daemon=True)
+        self._thread.start()
+
+        # Threads do not survive fork, so restart watching in child processes
+        if not self._at_fork_registered and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._at_fork_registered = True
+
+    def stop(self):
+        """Stop watching
+        """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _after_fork(self):
+        if self._thread is not None:
+            self._thread = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self.start()
+
+    def _reload(self):
+        try:
+            self.ampho.reload_config_dir()
+        except Exception as e:
+            logging.error('Configuration reload failed: %s', e)
+
+    def _run(self, signature: Tuple):
+        if self._fd is not None:
+            self._run_inotify()
+        else:
+            self._run_poll(signature)
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 1.0)
+            if not ready:
+                continue
+
+            # Let writers finish and coalesce bursts of events into a single reload
+            self._stop.wait(0.1)
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+            self._reload()
+
+    def _run_poll(self, signature: Tuple):
+        while not self._stop.wait(self.interval):
+            new_signature = self._signature()
+            if new_signature != signature:
+                signature = new_signature
+                self._reload()
@@ -5,3 +5,4 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 from ._db import Db
+from .replicas import primary, use_primary
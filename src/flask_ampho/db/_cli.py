@@ -4,14 +4,19 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import sys
 import click
 import flask_migrate
+from typing import List, Optional, Tuple
 from time import time
 from os import path
-from shutil import rmtree
+from shutil import copy2
 from flask import current_app
 from flask_ampho import Ampho
-from flask_ampho.util import package_path, is_dir_empty, secho_error
+from flask_ampho.util import package_path, is_dir_empty, secho_error, secho_success
+from ._db import BindResult
+from .revision_index import Revision, RevisionIndex
+from .sql_output import SPLIT_MODES
 
 ampho = current_app.extensions['ampho']  # type: Ampho
 
@@ -21,7 +26,11 @@ ampho = current_app.extensions['ampho']  # type: Ampho
 def db_init(package: str):
     """Initialize a migration environment
     """
-    flask_migrate.init(package_path(package, 'migrations'))
+    m_dir = package_path(package, 'migrations')
+    flask_migrate.init(m_dir)
+
+    # Revision scripts are rendered from Ampho's template exposing migration helpers
+    copy2(package_path(__package__.split('.')[0], ['db', 'alembic_skel', 'script.py.mako']), m_dir)
 
 
 @ampho.cli.command()
@@ -41,43 +50,165 @@ def db_rev(package: str, message: str, head: str):
     flask_migrate.revision(m_dir, message, False, None, head, branch_label=branch, rev_id=f'{package}_{int(time())}')
 
 
+def _output_options(f):
+    """Offline SQL output options
+    """
+    f = click.option('--batch-separator', help='Separator written after each SQL statement, i. e. GO')(f)
+    f = click.option('--split', type=click.Choice(SPLIT_MODES), help='Write a file per package or per revision')(f)
+    f = click.option('-o', '--output', type=click.Path(), help='Write SQL to a file, or a directory with --split')(f)
+
+    return f
+
+
+def _output_x_arg(output: Optional[str], split: Optional[str], batch_separator: Optional[str]) -> List[str]:
+    """Make migration environment arguments from output options
+    """
+    if not output:
+        if split or batch_separator:
+            raise click.BadParameter('--split and --batch-separator require --output', param_hint='--output')
+        return []
+
+    r = [f'output={path.abspath(output)}']
+    if split:
+        r.append(f'split={split}')
+    if batch_separator:
+        r.append(f'separator={batch_separator}')
+
+    return r
+
+
 @ampho.cli.command()
 @click.option('-s/-S', '--sql/--no-sql', default=False)
+@click.option('--no-cache', is_flag=True, help='Do not use cached migrations structure')
+@click.option('-b', '--bind', 'binds', multiple=True, help='Database bind to upgrade, may be used multiple times')
+@click.option('-a', '--all-binds', is_flag=True, help='Upgrade the default database and all binds')
+@click.option('-p', '--parallel', default=1, type=click.IntRange(1), help='Number of binds to upgrade concurrently')
+@_output_options
 @click.argument('rev', default='heads')
-def db_up(rev: str, sql: bool):
+def db_up(rev: str, sql: bool, no_cache: bool, binds: Tuple[str, ...], all_binds: bool, parallel: int,
+          output: Optional[str], split: Optional[str], batch_separator: Optional[str]):
     """Upgrade database schema
     """
-    m_dir = ampho.db.make_migrations_struct()
-    flask_migrate.upgrade(m_dir, rev, sql)
-    rmtree(m_dir)
+    db = current_app.extensions['ampho'].db
+    x_arg = _output_x_arg(output, split, batch_separator)
+    sql = sql or bool(output)
+    if not (binds or all_binds):
+        if parallel > 1:
+            raise click.BadParameter('Parallel upgrade requires --bind or --all-binds', param_hint='--parallel')
+        with db.migrations_dir(False if no_cache else None) as m_dir:
+            flask_migrate.upgrade(m_dir, rev, sql, x_arg=x_arg)
+        return
+
+    if output and (all_binds or len(binds) > 1):
+        raise click.BadParameter('Output of multiple binds cannot be written to the same location',
+                                 param_hint='--output')
+
+    available = db.get_binds()
+    unknown = [b for b in binds if b not in available]
+    if unknown:
+        raise click.BadParameter(f'Unknown binds: {", ".join(unknown)}', param_hint='--bind')
+
+    def on_progress(bind: Optional[str], result: Optional[BindResult]):
+        name = bind or '<default>'
+        if result is None:
+            click.echo(f'[{name}] upgrading', err=sql)
+        elif result.ok:
+            secho_success(f'[{name}] done in {result.duration:.2f}s', err=sql)
+        else:
+            secho_error(f'[{name}] failed: {result.error}')
+
+    started = time()
+    results = db.upgrade(available if all_binds else binds, rev, sql, parallel, False if no_cache else None,
+                         on_progress, x_arg)
+
+    failed = [r for r in results if not r.ok]
+    msg = f'{len(results) - len(failed)} of {len(results)} binds upgraded in {time() - started:.2f}s'
+    if failed:
+        secho_error(f'{msg}, failed: {", ".join(r.bind or "<default>" for r in failed)}')
+        sys.exit(1)
+
+    secho_success(msg, err=sql)
 
 
 @ampho.cli.command()
 @click.option('-s/-S', '--sql/--no-sql', default=False)
+@click.option('--no-cache', is_flag=True, help='Do not use cached migrations structure')
+@_output_options
 @click.argument('rev', default='-1')
-def db_down(rev: str, sql: bool):
+def db_down(rev: str, sql: bool, no_cache: bool, output: Optional[str], split: Optional[str],
+            batch_separator: Optional[str]):
     """Downgrade database schema
     """
-    m_dir = ampho.db.make_migrations_struct()
-    flask_migrate.downgrade(m_dir, rev, sql)
-    rmtree(m_dir)
+    x_arg = _output_x_arg(output, split, batch_separator)
+    with current_app.extensions['ampho'].db.migrations_dir(False if no_cache else None) as m_dir:
+        flask_migrate.downgrade(m_dir, rev, sql or bool(output), x_arg=x_arg)
+
+
+def _echo_revision(index: RevisionIndex, r: Revision, verbose: bool = False):
+    """Print revision information
+    """
+    is_head = not index.descendants([r.revision]) - {r.revision}
+    click.echo(f'{r.revision}{" (head)" if is_head else ""}')
+    if verbose:
+        click.echo(f'Package: {r.package}')
+        click.echo(f'Parent: {", ".join(r.down_revisions) or "<base>"}')
+        if r.branch_labels:
+            click.echo(f'Branch names: {", ".join(r.branch_labels)}')
+        if r.depends_on:
+            click.echo(f'Depends on: {", ".join(r.depends_on)}')
+        click.echo(f'Path: {r.path}')
+        click.echo(f'\n    {r.doc}\n')
 
 
 @ampho.cli.command()
 @click.option('-v/-V', '--verbose/--no-verbose', default=False)
-def db_current(verbose: bool):
+@click.option('--no-cache', is_flag=True, help='Do not use cached revisions index')
+def db_current(verbose: bool, no_cache: bool):
     """Show current revision
     """
-    m_dir = ampho.db.make_migrations_struct()
-    flask_migrate.current(m_dir, verbose)
-    rmtree(m_dir)
+    db = current_app.extensions['ampho'].db
+    index = db.get_revision_index(False if no_cache else None)
+    for rev in db.get_current_revisions():
+        r = index.get(rev)
+        if r:
+            _echo_revision(index, r, verbose)
+        else:
+            click.echo(f'{rev} (unknown)')
 
 
 @ampho.cli.command()
+@click.option('--no-cache', is_flag=True, help='Do not use cached migrations structure')
 @click.argument('rev', default="heads")
-def db_show(rev: str = None):
+def db_show(rev: str = None, no_cache: bool = False):
     """Show the revision denoted by the given symbol
     """
-    m_dir = ampho.db.make_migrations_struct()
-    flask_migrate.show(m_dir, rev)
-    rmtree(m_dir)
+    db = current_app.extensions['ampho'].db
+    index = db.get_revision_index(False if no_cache else None)
+    revisions = index.resolve(rev)
+
+    # Complex specifiers are resolved by Alembic
+    if revisions is None:
+        with db.migrations_dir(False if no_cache else None) as m_dir:
+            flask_migrate.show(m_dir, rev)
+        return
+
+    for r in revisions:
+        _echo_revision(index, r, True)
+
+
+@ampho.cli.command()
+@click.option('-q/-Q', '--quiet/--no-quiet', default=False)
+@click.option('--no-cache', is_flag=True, help='Do not use cached revisions index')
+def db_pending(quiet: bool, no_cache: bool):
+    """Check whether there are non-applied migrations
+
+    Exits with status 1 if there are any.
+    """
+    db = current_app.extensions['ampho'].db
+    pending = db.get_pending_revisions(cache=False if no_cache else None)
+    if not quiet:
+        for r in pending:
+            click.echo(f'{r.revision} ({r.package}) {r.doc}')
+
+    if pending:
+        sys.exit(1)
@@ -4,15 +4,125 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import os
+import json
 import logging
-from typing import Dict, List
+import multiprocessing
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from os import path
-from shutil import copytree
+from hashlib import sha1
+from shutil import copy2, copytree, rmtree
 from tempfile import mkdtemp
+from contextlib import contextmanager
+from functools import partial
+from weakref import WeakSet, ref
+import sqlalchemy as sa
+import flask_migrate
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_bool, as_list
 from flask_ampho.util import package_path, secho_warning
+from .bulk import BulkResult, as_table, bulk_delete, bulk_insert, bulk_upsert
+from .instrumentation import QueryStats
+from .pool import apply_pool_settings, pool_stats
+from .replicas import ReplicaRouter, make_routing_session, primary, use_primary
+from .revision_index import Revision, RevisionIndex
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+declare('AMPHO_MIGRATION_PACKAGES', as_list, ())
+declare('AMPHO_MIGRATION_CACHE', as_bool, True)
+
+
+def _dir_signature(dir_path: str) -> Tuple[str, List[str]]:
+    """Get digest of directory's files names and contents, and list of file names
+    """
+    files = sorted(e.name for e in os.scandir(dir_path) if e.is_file() and not e.name.startswith('.'))
+
+    h = sha1()
+    for name in files:
+        h.update(name.encode() + b'\0')
+        with open(path.join(dir_path, name), 'rb') as f:
+            h.update(sha1(f.read()).digest())
+
+    return h.hexdigest(), files
+
+
+def _link(src: str, dst: str):
+    """Link a file, falling back to hard link and copying
+    """
+    if path.lexists(dst):
+        os.unlink(dst)
+
+    try:
+        os.symlink(src, dst)
+    except OSError:
+        try:
+            os.link(src, dst)
+        except OSError:
+            copy2(src, dst)
+
+
+_worker_app = None  # type: Optional[Flask]
+
+
+def _upgrade_bind(bind: Optional[str], m_dir: str, revision: str, sql: bool, x_arg: List[str]) -> float:
+    """Upgrade a single database bind
+
+    Runs both in the current process and in forked pool workers. Returns duration in seconds.
+    """
+    started = time()
+    with _worker_app.app_context():
+        flask_migrate.upgrade(m_dir, revision, sql, x_arg=x_arg + [f'bind={bind}'] if bind else x_arg)
+
+    return time() - started
+
+
+def _error_message(e: BaseException) -> str:
+    # Flask-Migrate reports errors itself and exits
+    if isinstance(e, SystemExit):
+        return f'exited with status {e.code}'
+
+    return str(e) or e.__class__.__name__
+
+
+class BindResult:
+    """Result of a bind migration
+    """
+    __slots__ = ('bind', 'duration', 'error')
+
+    def __init__(self, bind: Optional[str], duration: float = 0.0, error: Optional[str] = None):
+        """Init
+        """
+        self.bind = bind
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        """Whether the migration succeeded
+        """
+        return self.error is None
+
+
+def _unlink(file_path: str):
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def _dispose_engines(db_ref: ref):
+    db = db_ref()
+    if db:
+        db.dispose_engines()
 
 
 class Db:
@@ -27,15 +137,61 @@ class Db:
         self.migrate = migrate
 
         self.on_get_migrations_packages = ampho.signals.signal('get-migration-packages')
+        self.on_engine_created = ampho.signals.signal('db-engine-created')
+
+        self.engines = WeakSet()  # type: WeakSet
+
+        # Configure and announce engines, which Flask-SQLAlchemy creates lazily
+        create_engine = sqlalchemy.create_engine
+
+        def _create_engine(sa_url, engine_opts):
+            engine = create_engine(sa_url, apply_pool_settings(self.ampho.settings, sa_url, engine_opts))
+            self.engines.add(engine)
+            self.on_engine_created.send(self.ampho.app, engine=engine)
+            return engine
+
+        sqlalchemy.create_engine = _create_engine
+
+        # Query statistics
+        self.query_stats = None  # type: Optional[QueryStats]
+        if ampho.settings.db_stats:
+            self.query_stats = QueryStats(ampho)
+            self.on_engine_created.connect(lambda sender, engine: self.query_stats.instrument(engine),
+                                           ampho.app, weak=False)
+
+        # Read replicas, created at once and announced like the primary engine, so they are instrumented as well
+        self.replicas = None  # type: Optional[ReplicaRouter]
+        if ampho.settings.db_replicas:
+            engine_opts = ampho.get_config('SQLALCHEMY_ENGINE_OPTIONS') or {}
+            engines = [sqlalchemy.create_engine(sa.engine.url.make_url(url), dict(engine_opts))
+                       for url in ampho.settings.db_replicas]
+            self.replicas = ReplicaRouter(engines, ampho.settings.db_replica_policy)
+            sqlalchemy.session = make_routing_session(sqlalchemy, self.replicas)
+
+        # Connections must not be shared with forked processes, i. e. workers of a pre-forking server
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=partial(_dispose_engines, ref(self)))
 
         # Register CLI commands
         with ampho.app.app_context():
             from . import _cli
 
+    primary = staticmethod(primary)
+    use_primary = staticmethod(use_primary)
+
+    def dispose_engines(self):
+        """Close pooled connections of all engines
+        """
+        for engine in list(self.engines):
+            engine.dispose()
+
+    def pool_stats(self) -> Dict[str, Dict]:
+        """Get connection pools statistics by database URLs with masked passwords
+        """
+        return {repr(engine.url): pool_stats(engine.pool) for engine in list(self.engines)}
+
     def get_migration_packages(self) -> Dict[str, str]:
-        cfg: List[str] = self.ampho.get_config('AMPHO_MIGRATION_PACKAGES', [])
-        if isinstance(cfg, str):
-            cfg = list(filter(bool, map(lambda x: x.strip(), cfg.split(','))))
+        cfg: List[str] = list(self.ampho.settings.migration_packages)
 
         self.on_get_migrations_packages.send(self.ampho.app, packages=cfg)
 
@@ -43,12 +199,229 @@ class Db:
         for pkg_name in cfg:
             subdir = 'migrations'
             if ':' in pkg_name:
-                pkg_name, subdir = pkg_name.split()
+                pkg_name, subdir = pkg_name.split(':')
 
             r[pkg_name] = package_path(pkg_name, subdir)
 
         return r
 
+    @property
+    def migrations_cache_dir(self) -> str:
+        """Location of the cached migrations structure
+        """
+        return path.join(self.ampho.app.instance_path, 'ampho', 'migrations')
+
+    @contextmanager
+    def migrations_dir(self, cache: bool = None) -> Iterator[str]:
+        """Get Alembic's migrations structure assembled from all registered packages
+
+        By default the structure is cached under the instance path and updated only for packages which files were
+        changed. Otherwise a temporary structure is built and removed on exit.
+        """
+        if cache is None:
+            cache = self.ampho.settings.migration_cache
+
+        if not cache:
+            m_dir = self._make_migrations_struct()
+            try:
+                yield m_dir
+            finally:
+                rmtree(m_dir)
+            return
+
+        root = self.migrations_cache_dir
+        os.makedirs(root, 0o755, True)
+        with open(path.join(root, '.lock'), 'w') as lock:
+            # The structure is used under the same exclusive lock it is updated under, because flock() cannot
+            # downgrade a lock atomically, so another process could update the structure in between
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield self._sync_migrations_struct(root)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _sync_migrations_struct(self, root: str) -> str:
+        m_dir = path.join(root, 'tree')
+        v_dir = path.join(m_dir, 'versions')
+        os.makedirs(v_dir, 0o755, True)
+
+        manifest_path = path.join(root, 'manifest.json')
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)  # type: Dict[str, Dict]
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+
+        # Skeleton files go to the root of the structure, versions of each package to the versions directory
+        sources = [('', package_path(__package__.split('.')[0], ['db', 'alembic_skel']), m_dir)]
+        for pkg_name, dir_path in self.get_migration_packages().items():
+            src = path.join(dir_path, 'versions')
+            if not path.isdir(src):
+                secho_warning(f'Not found: {src}')
+                continue
+            sources.append((pkg_name, src, v_dir))
+
+        new_manifest = {}
+        changed = False
+        for name, src, dst in sources:
+            digest, files = _dir_signature(src)
+            entry = {'src': src, 'digest': digest, 'files': files}
+            prev = manifest.pop(name, None)
+            new_manifest[name] = entry
+            if prev == entry:
+                continue
+
+            changed = True
+            if prev:
+                for fn in set(prev['files']) - set(files):
+                    _unlink(path.join(dst, fn))
+            for fn in files:
+                _link(path.join(src, fn), path.join(dst, fn))
+            logging.debug(f'Migrations structure updated: {src}')
+
+        # Packages which are not registered anymore
+        for name, prev in manifest.items():
+            changed = True
+            for fn in prev['files']:
+                _unlink(path.join(m_dir if name == '' else v_dir, fn))
+
+        if changed:
+            tmp_path = manifest_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(new_manifest, f)
+            os.replace(tmp_path, manifest_path)
+
+        return m_dir
+
+    def get_revision_index(self, cache: bool = None) -> RevisionIndex:
+        """Get index of revisions from all registered packages
+
+        Revision scripts are parsed, not imported. The index is persisted next to the cached migrations structure.
+        """
+        if cache is None:
+            cache = self.ampho.settings.migration_cache
+
+        sources = {pkg: path.join(d, 'versions') for pkg, d in self.get_migration_packages().items()}
+        index_path = path.join(self.migrations_cache_dir, 'index.json') if cache else None
+
+        return RevisionIndex.build(sources, index_path)
+
+    def get_current_revisions(self, engine=None) -> List[str]:
+        """Get revisions applied to a database
+
+        The version table is queried directly, without loading Alembic's environment.
+        """
+        engine = engine or self.sqlalchemy.engine
+        configure_args = self.ampho.app.extensions['migrate'].configure_args
+        table = configure_args.get('version_table', 'alembic_version')
+        schema = configure_args.get('version_table_schema')
+
+        with engine.connect() as conn:
+            if not engine.dialect.has_table(conn, table, schema):
+                return []
+            t = sa.table(table, sa.column('version_num'), schema=schema)
+            return [row[0] for row in conn.execute(sa.select([t.c.version_num]))]
+
+    def get_pending_revisions(self, engine=None, cache: bool = None) -> List[Revision]:
+        """Get revisions which are not applied to a database yet
+        """
+        return self.get_revision_index(cache).pending(self.get_current_revisions(engine))
+
+    def _bulk(self, op, bind: Optional[str], table, items, chunk_size: Optional[int], **kwargs) -> BulkResult:
+        engine = self.sqlalchemy.get_engine(self.ampho.app, bind)
+        try:
+            result = op(engine, table, items, chunk_size=chunk_size or self.ampho.settings.db_bulk_chunk_size,
+                        **kwargs)
+        finally:
+            # Bulk operations bypass the session, so caches tracking it do not notice changes. Chunks committed
+            # before a failure are changes as well.
+            for cache in (self.ampho.cache, self.ampho.http_cache and self.ampho.http_cache.cache):
+                if cache:
+                    cache.invalidate(as_table(table).name)
+
+        logging.info('%s %s: %d rows in %.3fs (%.0f rows/s)', op.__name__, getattr(table, '__tablename__', table),
+                     result.rows, result.duration, result.rows_per_second)
+
+        return result
+
+    def bulk_insert(self, table, rows: Iterable[Dict], chunk_size: int = None, bind: str = None,
+                    on_progress=None) -> BulkResult:
+        """Insert rows into a table or a model's table in chunks, each in its own transaction
+
+        Rows are consumed lazily, so they may be produced by a generator.
+        """
+        return self._bulk(bulk_insert, bind, table, rows, chunk_size, on_progress=on_progress)
+
+    def bulk_upsert(self, table, rows: Iterable[Dict], keys: Iterable[str], update: Iterable[str] = None,
+                    chunk_size: int = None, bind: str = None, on_progress=None) -> BulkResult:
+        """Insert rows in chunks, updating rows with the same keys
+
+        Supported on PostgreSQL, MySQL and SQLite.
+        """
+        return self._bulk(bulk_upsert, bind, table, rows, chunk_size, keys=list(keys),
+                          update=None if update is None else list(update), on_progress=on_progress)
+
+    def bulk_delete(self, table, ids: Iterable, column: str = None, chunk_size: int = None, bind: str = None,
+                    on_progress=None) -> BulkResult:
+        """Delete rows by ids in chunks
+        """
+        return self._bulk(bulk_delete, bind, table, ids, chunk_size, column=column, on_progress=on_progress)
+
+    def get_binds(self) -> List[Optional[str]]:
+        """Get names of database binds, where ``None`` means the default database
+        """
+        return [None] + list(self.ampho.app.config.get('SQLALCHEMY_BINDS') or {})
+
+    def upgrade(self, binds: Iterable[Optional[str]] = (None,), revision: str = 'heads', sql: bool = False,
+                parallel: int = 1, cache: bool = None, on_progress=None,
+                x_arg: Iterable[str] = ()) -> List[BindResult]:
+        """Upgrade database binds
+
+        With ``parallel`` greater than ``1`` binds are upgraded concurrently in a pool of worker processes. A failure
+        of one bind does not affect others.
+
+        :param on_progress: a callable receiving a bind name and ``None`` when the bind is started, or a
+            :class:`BindResult` when it's finished.
+        :param x_arg: additional arguments to the migration environment.
+        """
+        global _worker_app
+
+        binds = list(binds)
+        x_arg = list(x_arg)
+        on_progress = on_progress or (lambda bind, result: None)
+        results = {}  # type: Dict[Optional[str], BindResult]
+        _worker_app = self.ampho.app
+
+        with self.migrations_dir(cache) as m_dir:
+            # Offline SQL goes to stdout, so it must not be interleaved
+            if parallel <= 1 or sql or len(binds) < 2:
+                for bind in binds:
+                    on_progress(bind, None)
+                    try:
+                        results[bind] = BindResult(bind, _upgrade_bind(bind, m_dir, revision, sql, x_arg))
+                    except (Exception, SystemExit) as e:
+                        results[bind] = BindResult(bind, error=_error_message(e))
+                    on_progress(bind, results[bind])
+            else:
+                ctx = multiprocessing.get_context('fork')
+                with ProcessPoolExecutor(min(parallel, len(binds)), ctx) as pool:
+                    futures = {}
+                    for bind in binds:
+                        on_progress(bind, None)
+                        futures[pool.submit(_upgrade_bind, bind, m_dir, revision, sql, x_arg)] = bind
+
+                    for future in as_completed(futures):
+                        bind = futures[future]
+                        try:
+                            results[bind] = BindResult(bind, future.result())
+                        except (Exception, SystemExit) as e:
+                            results[bind] = BindResult(bind, error=_error_message(e))
+                        on_progress(bind, results[bind])
+
+        return [results[bind] for bind in binds]
+
     def _make_migrations_struct(self) -> str:
         ignore = ['__pycache__']
         tmp_path = mkdtemp(prefix='ampho-migrate-')
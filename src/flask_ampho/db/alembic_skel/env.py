@@ -22,9 +22,12 @@ logger = logging.getLogger('alembic.env')
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from flask import current_app
-config.set_main_option(
-    'sqlalchemy.url',
-    str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
+
+# Database bind to migrate, the default database if not specified.
+# Ampho passes it as the ``-x bind=NAME`` argument.
+bind = context.get_x_argument(as_dictionary=True).get('bind') or None
+engine = current_app.extensions['migrate'].db.get_engine(current_app, bind)
+config.set_main_option('sqlalchemy.url', str(engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
 # other values from the config, defined by the needs of env.py,
@@ -46,12 +49,32 @@ def run_migrations_offline():
 
     """
     url = config.get_main_option("sqlalchemy.url")
+    x_args = context.get_x_argument(as_dictionary=True)
+
+    # Ampho streams the script to a file or directory passed as the ``-x output=PATH`` argument
+    output = None
+    opts = {}
+    if x_args.get('output'):
+        from flask_ampho.db.sql_output import SqlOutput
+        index = current_app.extensions['ampho'].db.get_revision_index()
+        output = SqlOutput(x_args['output'], x_args.get('split') or None, x_args.get('separator') or None,
+                           lambda rev: index.revisions[rev].package if rev in index else rev.rsplit('_', 1)[0])
+        opts = dict(output_buffer=output, on_version_apply=output.on_version_apply,
+                    transaction_per_migration=bool(output.split))
+        if output.separator and engine.dialect.name == 'mssql':
+            opts['mssql_batch_separator'] = output.separator
+            output.separator = None
+
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True, **opts
     )
 
-    with context.begin_transaction():
-        context.run_migrations()
+    try:
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        if output:
+            output.close()
 
 
 def run_migrations_online():
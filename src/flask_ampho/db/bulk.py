@@ -0,0 +1,199 @@
+"""Ampho Bulk Database Operations
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+from time import perf_counter
+from itertools import islice
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+from flask_ampho.settings import declare
+
+declare('AMPHO_DB_BULK_CHUNK_SIZE', int, 1000, lambda v: v > 0)
+
+# Dialects supporting multi-row VALUES clauses. Other dialects insert chunks using executemany().
+_MULTI_VALUES_DIALECTS = ('postgresql', 'mysql')
+
+# Maximum numbers of bind parameters per statement. SQLite before 3.32 allows 999 parameters.
+_MAX_PARAMS = {
+    'postgresql': 65535,
+    'mysql': 65535,
+    'mssql': 2100,
+    'sqlite': 999,
+}
+_DEFAULT_MAX_PARAMS = 999
+
+
+class BulkResult:
+    """Result of a bulk operation
+
+    ``rows`` is number of processed input items.
+    """
+    __slots__ = ('rows', 'chunks', 'duration')
+
+    def __init__(self):
+        """Init
+        """
+        self.rows = 0
+        self.chunks = 0
+        self.duration = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """Throughput
+        """
+        return self.rows / self.duration if self.duration else 0.0
+
+    def __repr__(self) -> str:
+        return f'<BulkResult rows={self.rows} duration={self.duration:.3f}s rows/s={self.rows_per_second:.0f}>'
+
+
+def as_table(table: Any) -> sa.Table:
+    """Get a table of a model class, or the table itself
+    """
+    return getattr(table, '__table__', table)
+
+
+def chunks(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists without consuming it entirely
+    """
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _per_statement(conn: Connection, params_per_row: int) -> int:
+    """Get maximum number of rows per statement not exceeding the dialect's bind parameters limit
+    """
+    return max(_MAX_PARAMS.get(conn.dialect.name, _DEFAULT_MAX_PARAMS) // max(params_per_row, 1), 1)
+
+
+def _upsert_statement(conn: Connection, table: sa.Table, rows: List[Dict[str, Any]], keys: Sequence[str],
+                      update: Optional[Sequence[str]]):
+    """Build an insert-or-update statement for a chunk of rows
+    """
+    columns = list(rows[0].keys())
+    if update is None:
+        update = [c for c in columns if c not in keys]
+
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(rows)
+        if not update:
+            return stmt.on_conflict_do_nothing(index_elements=keys), None
+        return stmt.on_conflict_do_update(index_elements=keys, set_={c: stmt.excluded[c] for c in update}), None
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table).values(rows)
+        if not update:
+            # Assigning a key to itself is a no-op which suppresses the duplicate key error
+            update = keys[:1]
+        return stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update}), None
+
+    if dialect == 'sqlite':
+        # SQLAlchemy 1.3 has no ON CONFLICT construct for SQLite, while SQLite supports it since 3.24
+        q = conn.dialect.identifier_preparer.quote
+        cols = ', '.join(q(c) for c in columns)
+        params = ', '.join(f':{c}' for c in columns)
+        target = ', '.join(q(c) for c in keys)
+        if update:
+            action = 'UPDATE SET ' + ', '.join(f'{q(c)} = excluded.{q(c)}' for c in update)
+        else:
+            action = 'NOTHING'
+        name = conn.dialect.identifier_preparer.format_table(table)
+        stmt = sa.text(f'INSERT INTO {name} ({cols}) VALUES ({params}) ON CONFLICT ({target}) DO {action}')
+        return stmt, rows
+
+    raise NotImplementedError(f'Upsert is not supported for {dialect}')
+
+
+def _run(engine: Union[Engine, Connection], items: Iterable, chunk_size: int,
+         execute: Callable[[Connection, List], Any], on_progress: Callable[[BulkResult], Any] = None) -> BulkResult:
+    """Execute chunks, each in its own transaction
+    """
+    result = BulkResult()
+    for chunk in chunks(items, chunk_size):
+        started = perf_counter()
+        if isinstance(engine, Connection):
+            with engine.begin():
+                execute(engine, chunk)
+        else:
+            with engine.begin() as conn:
+                execute(conn, chunk)
+        result.duration += perf_counter() - started
+        result.rows += len(chunk)
+        result.chunks += 1
+        if on_progress:
+            on_progress(result)
+
+    return result
+
+
+def bulk_insert(engine: Union[Engine, Connection], table: Any, rows: Iterable[Dict[str, Any]], chunk_size: int = 1000,
+                on_progress: Callable[[BulkResult], Any] = None) -> BulkResult:
+    """Insert rows in chunks
+    """
+    table = as_table(table)
+
+    def execute(conn: Connection, chunk: List[Dict[str, Any]]):
+        if conn.dialect.name in _MULTI_VALUES_DIALECTS:
+            for rows in chunks(chunk, _per_statement(conn, len(chunk[0]))):
+                conn.execute(table.insert().values(rows))
+        else:
+            conn.execute(table.insert(), chunk)
+
+    return _run(engine, rows, chunk_size, execute, on_progress)
+
+
+def bulk_upsert(engine: Union[Engine, Connection], table: Any, rows: Iterable[Dict[str, Any]], keys: Sequence[str],
+                update: Sequence[str] = None, chunk_size: int = 1000,
+                on_progress: Callable[[BulkResult], Any] = None) -> BulkResult:
+    """Insert rows in chunks, updating existing ones
+
+    :param keys: columns of a primary key or an unique constraint identifying existing rows.
+    :param update: columns to update in existing rows. Default is all given columns except keys. If empty, existing
+        rows are left intact.
+    """
+    table = as_table(table)
+    keys = list(keys)
+
+    def execute(conn: Connection, chunk: List[Dict[str, Any]]):
+        # Rows are bound either as multi-row VALUES or using executemany()
+        per_statement = _per_statement(conn, len(chunk[0])) if conn.dialect.name in _MULTI_VALUES_DIALECTS else None
+        for rows in chunks(chunk, per_statement or len(chunk)):
+            stmt, params = _upsert_statement(conn, table, rows, keys, update)
+            if params is None:
+                conn.execute(stmt)
+            else:
+                conn.execute(stmt, params)
+
+    return _run(engine, rows, chunk_size, execute, on_progress)
+
+
+def bulk_delete(engine: Union[Engine, Connection], table: Any, ids: Iterable[Any], column: str = None,
+                chunk_size: int = 1000, on_progress: Callable[[BulkResult], Any] = None) -> BulkResult:
+    """Delete rows by ids in chunks
+
+    :param column: name of the id column. Default is the single-column primary key.
+    """
+    table = as_table(table)
+    if column:
+        col = table.c[column]
+    else:
+        pk = list(table.primary_key.columns)
+        if len(pk) != 1:
+            raise ValueError(f'Table {table.name} has no single-column primary key, specify the id column')
+        col = pk[0]
+
+    def execute(conn: Connection, chunk: List[Any]):
+        for ids_ in chunks(chunk, _per_statement(conn, 1)):
+            conn.execute(table.delete().where(col.in_(ids_)))
+
+    return _run(engine, ids, chunk_size, execute, on_progress)
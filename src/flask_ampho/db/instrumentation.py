@@ -0,0 +1,165 @@
+"""Ampho Query Instrumentation
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import re
+import logging
+from typing import Any, Dict, List, Optional
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from flask import g, has_request_context, request
+from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_bool
+from flask_ampho.stats import Histogram, COUNT_BUCKETS
+
+declare('AMPHO_DB_STATS', as_bool, True)
+declare('AMPHO_DB_SLOW_QUERY', float, 0.5, lambda v: v >= 0)
+declare('AMPHO_DB_N_PLUS_ONE', int, 20, lambda v: v >= 0)
+
+_RE_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_RE_LISTS = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+|\$\d+))*\s*\)')
+_RE_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(statement: str) -> str:
+    """Normalize a statement, so statements differing only in literals or IN-lists lengths are the same
+    """
+    s = _RE_LITERALS.sub('?', statement)
+    s = _RE_LISTS.sub('(...)', s)
+
+    return _RE_SPACES.sub(' ', s).strip()
+
+
+class StatementStats:
+    """Statistics of a statement fingerprint
+    """
+    __slots__ = ('fingerprint', 'latency', 'rows')
+
+    def __init__(self, fp: str):
+        """Init
+        """
+        self.fingerprint = fp
+        self.latency = Histogram()
+        self.rows = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get a summary
+        """
+        r = self.latency.as_dict()
+        r['statement'] = self.fingerprint
+        r['rows'] = self.rows
+
+        return r
+
+
+class QueryStats:
+    """Query statistics collector
+
+    Statement execution is timed using engine events. Statistics are aggregated per statement fingerprint, and
+    fingerprints are computed once per distinct statement text, so the per-query overhead is a couple of dictionary
+    lookups and a histogram update.
+    """
+
+    def __init__(self, ampho: Ampho, max_statements: int = 1000):
+        """Init
+        """
+        self.ampho = ampho
+        self.max_statements = max_statements
+        self.on_slow_query = ampho.signals.signal('slow-query')
+
+        self.statements = {}  # type: Dict[str, StatementStats]
+        self.request_queries = Histogram(COUNT_BUCKETS)
+        self._fingerprints = {}  # type: Dict[str, str]
+
+        ampho.app.teardown_request(self._on_teardown_request)
+
+    def instrument(self, engine: Engine):
+        """Start collecting statistics of an engine
+        """
+        if not event.contains(engine, 'before_cursor_execute', self._before_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _fingerprint(self, statement: str) -> str:
+        fp = self._fingerprints.get(statement)
+        if fp is None:
+            if len(self._fingerprints) >= self.max_statements * 10:
+                self._fingerprints.clear()
+            fp = self._fingerprints[statement] = fingerprint(statement)
+
+        return fp
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._ampho_started = perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_ampho_started', None)
+        if started is None:
+            return
+
+        duration = perf_counter() - started
+        fp = self._fingerprint(statement)
+
+        stats = self.statements.get(fp)
+        if stats is None:
+            if len(self.statements) >= self.max_statements:
+                fp = '<other>'
+                stats = self.statements.get(fp)
+            if stats is None:
+                stats = self.statements[fp] = StatementStats(fp)
+
+        stats.latency.observe(duration)
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+        if has_request_context():
+            counts = g.get('ampho_queries')
+            if counts is None:
+                counts = g.ampho_queries = {}
+            counts[fp] = counts.get(fp, 0) + 1
+
+        settings = self.ampho.settings
+        if settings.db_slow_query and duration >= settings.db_slow_query:
+            logging.warning('Slow query (%.3fs): %s', duration, statement[:1000])
+            self.on_slow_query.send(self.ampho.app, statement=statement, parameters=parameters,
+                                    duration=duration, fingerprint=fp)
+
+    def _on_teardown_request(self, exc: Optional[BaseException] = None):
+        counts = g.pop('ampho_queries', None)
+        if not counts:
+            self.request_queries.observe(0)
+            return
+
+        self.request_queries.observe(sum(counts.values()))
+
+        threshold = self.ampho.settings.db_n_plus_one
+        if threshold:
+            for fp, n in counts.items():
+                if n >= threshold:
+                    logging.warning('Possible N+1 queries: %d executions in %s: %s', n, request.path, fp[:1000])
+
+    @staticmethod
+    def request_query_count() -> int:
+        """Get number of queries made within the current request so far
+        """
+        counts = g.get('ampho_queries') if has_request_context() else None
+
+        return sum(counts.values()) if counts else 0
+
+    def top(self, n: int = 20, key: str = 'sum') -> List[Dict[str, Any]]:
+        """Get summaries of statements with greatest total time or another summary field
+        """
+        r = [s.as_dict() for s in list(self.statements.values())]
+        r.sort(key=lambda x: x[key], reverse=True)
+
+        return r[:n]
+
+    def reset(self):
+        """Reset collected statistics
+        """
+        self.statements = {}
+        self.request_queries = Histogram(COUNT_BUCKETS)
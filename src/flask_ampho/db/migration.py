@@ -0,0 +1,201 @@
+"""Ampho Migration Helpers
+
+Helpers to use in revision scripts:
+
+.. sourcecode:: python
+
+    from flask_ampho.db import migration
+
+    def upgrade():
+        op.add_column('article', sa.Column('slug', sa.String(255)))
+        migration.backfill('article', {'slug': sa.func.lower(sa.column('title'))})
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+import logging
+from typing import Any, Callable, Dict, Optional, Union
+from time import time, sleep
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from uuid import UUID
+from base64 import b64decode, b64encode
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+from flask_ampho.settings import declare
+
+declare('AMPHO_MIGRATION_BATCH_SIZE', int, 1000, lambda v: v > 0)
+declare('AMPHO_MIGRATION_THROTTLE', float, 0.0, lambda v: v >= 0)
+
+checkpoints = sa.Table(
+    'ampho_migration_checkpoints', sa.MetaData(),
+    sa.Column('name', sa.String(255), primary_key=True),
+    sa.Column('last_key', sa.Text, nullable=False),
+    sa.Column('rows', sa.BigInteger, nullable=False, default=0),
+    sa.Column('updated', sa.Float, nullable=False),
+)
+
+BatchFn = Callable[[sa.engine.Connection, Any, Any], int]
+
+# Key types JSON cannot represent, with their tags, encoders and decoders. datetime is a subclass of date, so it goes
+# first.
+_KEY_TYPES = (
+    ('datetime', datetime, datetime.isoformat, datetime.fromisoformat),
+    ('date', date, date.isoformat, date.fromisoformat),
+    ('time', dt_time, dt_time.isoformat, dt_time.fromisoformat),
+    ('uuid', UUID, str, UUID),
+    ('decimal', Decimal, str, Decimal),
+    ('bytes', bytes, lambda v: b64encode(v).decode(), b64decode),
+)
+
+
+def _encode_key(obj: Any) -> Dict[str, str]:
+    for tag, type_, encode, _ in _KEY_TYPES:
+        if isinstance(obj, type_):
+            return {f'${tag}': encode(obj)}
+
+    raise TypeError(f'Key of type {obj.__class__.__name__} cannot be stored in a checkpoint')
+
+
+def _decode_key(d: Dict[str, Any]) -> Any:
+    if len(d) == 1:
+        (k, v), = d.items()
+        for tag, _, _, decode in _KEY_TYPES:
+            if k == f'${tag}':
+                return decode(v)
+
+    return d
+
+
+def dump_key(key: Any) -> str:
+    """Serialize a key, keeping its type
+    """
+    return json.dumps(key, default=_encode_key)
+
+
+def load_key(s: str) -> Any:
+    """Deserialize a key serialized by :func:`dump_key`
+    """
+    return json.loads(s, object_hook=_decode_key)
+
+
+def _settings():
+    return current_app.extensions['ampho'].settings
+
+
+def _as_table(table: Union[str, sa.Table], *columns: str) -> sa.sql.expression.TableClause:
+    if isinstance(table, str):
+        return sa.table(table, *(sa.column(c) for c in columns))
+
+    return table
+
+
+class Checkpoint:
+    """Progress of a batched operation stored in the ``ampho_migration_checkpoints`` table
+
+    The table is created on first use. Besides JSON types, keys may be dates, times, UUIDs, decimals and bytes.
+    """
+
+    def __init__(self, conn: sa.engine.Connection, name: str):
+        """Init
+        """
+        self.conn = conn
+        self.name = name
+        checkpoints.create(conn, checkfirst=True)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Get stored progress
+        """
+        row = self.conn.execute(checkpoints.select().where(checkpoints.c.name == self.name)).first()
+
+        return {'last_key': load_key(row.last_key), 'rows': row.rows} if row else None
+
+    def save(self, last_key: Any, rows: int):
+        """Store progress
+        """
+        t = checkpoints
+        values = {'last_key': dump_key(last_key), 'rows': rows, 'updated': time()}
+        if self.conn.execute(t.update().where(t.c.name == self.name).values(**values)).rowcount == 0:
+            self.conn.execute(t.insert().values(name=self.name, **values))
+
+    def clear(self):
+        """Remove stored progress
+        """
+        self.conn.execute(checkpoints.delete().where(checkpoints.c.name == self.name))
+
+
+def backfill_batches(table: Union[str, sa.Table], fn: BatchFn, key: str = 'id', batch_size: int = None,
+                     throttle: float = None, name: str = None) -> int:
+    """Process a table by primary key ranges, committing after each batch
+
+    ``fn(conn, lower, upper)`` is called for each range of up to ``batch_size`` keys, where ``lower`` is exclusive
+    and ``None`` for the first batch, and ``upper`` is inclusive. It should return number of processed rows.
+
+    Progress is checkpointed under ``name``, so an interrupted run continues from the last processed batch. Because
+    a batch and its checkpoint are committed separately, ``fn`` must be idempotent. The checkpoint is removed after
+    completion. Returns number of processed rows.
+    """
+    batch_size = batch_size or _settings().migration_batch_size
+    throttle = _settings().migration_throttle if throttle is None else throttle
+    t = _as_table(table, key)
+    k = t.c[key]
+    name = name or f'{t.name}:{key}'
+
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        checkpoint = Checkpoint(conn, name)
+        state = checkpoint.load() or {'last_key': None, 'rows': 0}
+        lower, rows = state['last_key'], state['rows']
+        if lower is not None:
+            logging.info(f'Resuming {name} after key {lower!r}, {rows} rows processed')
+
+        while True:
+            q = sa.select([k]).order_by(k)
+            if lower is not None:
+                q = q.where(k > lower)
+            upper = conn.execute(q.offset(batch_size - 1).limit(1)).scalar()
+            if upper is None:
+                q = sa.select([sa.func.max(k)])
+                upper = conn.execute(q.where(k > lower) if lower is not None else q).scalar()
+                if upper is None:
+                    break
+
+            rows += fn(conn, lower, upper) or 0
+            checkpoint.save(upper, rows)
+            lower = upper
+            logging.debug(f'{name}: processed keys up to {upper!r}, {rows} rows')
+
+            if throttle:
+                sleep(throttle)
+
+        checkpoint.clear()
+
+    return rows
+
+
+def backfill(table: Union[str, sa.Table], values: Dict[str, Any], where: Any = None, key: str = 'id',
+             batch_size: int = None, throttle: float = None, name: str = None) -> int:
+    """Update a table in batches
+
+    Instead of a single ``UPDATE`` locking the whole table for the duration of the migration, rows are updated by
+    primary key ranges, each range in its own transaction. See :func:`backfill_batches` for arguments. In offline
+    mode a single ``UPDATE`` statement is emitted. Returns number of updated rows.
+    """
+    t = _as_table(table, key, *values)
+    k = t.c[key]
+
+    if op.get_context().as_sql:
+        q = t.update().values(**values)
+        op.execute(q.where(where) if where is not None else q)
+        return 0
+
+    def update(conn: sa.engine.Connection, lower: Any, upper: Any) -> int:
+        cond = k <= upper if lower is None else sa.and_(k > lower, k <= upper)
+        if where is not None:
+            cond = sa.and_(cond, where)
+        return conn.execute(t.update().where(cond).values(**values)).rowcount
+
+    return backfill_batches(t, update, key, batch_size, throttle, name)
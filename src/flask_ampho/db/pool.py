@@ -0,0 +1,103 @@
+"""Ampho Database Connection Pooling
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+from typing import Any, Dict, Union
+from time import perf_counter
+from sqlalchemy import exc
+from sqlalchemy.engine.url import URL, make_url
+from sqlalchemy.pool import Pool, QueuePool
+from flask_ampho.settings import Settings, declare, as_bool
+from flask_ampho.stats import Histogram
+
+
+def as_pool_size(v: Any) -> int:
+    """Convert a pool size config value, where ``auto`` means number of CPU cores
+    """
+    return (os.cpu_count() or 1) if str(v).lower() == 'auto' else int(v)
+
+
+declare('AMPHO_DB_POOL_SIZE', as_pool_size, None, lambda v: v > 0)
+declare('AMPHO_DB_POOL_MAX_OVERFLOW', int, None, lambda v: v >= -1)
+declare('AMPHO_DB_POOL_TIMEOUT', float, None, lambda v: v > 0)
+declare('AMPHO_DB_POOL_RECYCLE', int, None)
+declare('AMPHO_DB_POOL_PRE_PING', as_bool, None)
+
+
+class TimedQueuePool(QueuePool):
+    """Queue pool measuring time spent waiting for connections
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Init
+        """
+        super().__init__(*args, **kwargs)
+        self.wait_time = Histogram()
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(perf_counter() - started)
+
+    def recreate(self) -> 'TimedQueuePool':
+        """Create a new pool with the same configuration, keeping statistics
+        """
+        pool = super().recreate()
+        pool.wait_time = self.wait_time
+        pool.timeouts = self.timeouts
+
+        return pool
+
+
+def apply_pool_settings(settings: Settings, url: Union[str, URL], engine_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Add pool options from settings to engine options
+
+    Size options are applied only if the engine would use the default queue pool, i. e. not to SQLite databases, which
+    get pools suitable for their file or memory storage from SQLAlchemy.
+    """
+    opts = dict(engine_opts)
+
+    if settings.db_pool_recycle is not None:
+        opts['pool_recycle'] = settings.db_pool_recycle
+    if settings.db_pool_pre_ping is not None:
+        opts['pool_pre_ping'] = settings.db_pool_pre_ping
+
+    if 'poolclass' not in opts and 'pool' not in opts and make_url(url).get_backend_name() != 'sqlite':
+        opts['poolclass'] = TimedQueuePool
+        if settings.db_pool_size is not None:
+            opts['pool_size'] = settings.db_pool_size
+        if settings.db_pool_max_overflow is not None:
+            opts['max_overflow'] = settings.db_pool_max_overflow
+        if settings.db_pool_timeout is not None:
+            opts['pool_timeout'] = settings.db_pool_timeout
+
+    return opts
+
+
+def pool_stats(pool: Pool) -> Dict[str, Any]:
+    """Get pool statistics
+    """
+    r = {'class': pool.__class__.__name__}  # type: Dict[str, Any]
+
+    if isinstance(pool, QueuePool):
+        r.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        r['wait'] = pool.wait_time.as_dict()
+        r['timeouts'] = pool.timeouts
+
+    return r
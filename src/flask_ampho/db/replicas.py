@@ -0,0 +1,159 @@
+"""Ampho Read Replicas Support
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Callable, List, Optional
+from itertools import count
+from functools import wraps
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from flask_ampho.settings import declare, as_list
+
+declare('AMPHO_DB_REPLICAS', as_list, ())
+declare('AMPHO_DB_REPLICA_POLICY', str, 'round_robin', lambda v: v in ('round_robin', 'least_connections'))
+
+_force_primary = ContextVar('ampho_db_force_primary', default=False)
+
+
+@contextmanager
+def primary():
+    """Context manager forcing all queries to go to the primary database
+    """
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def use_primary(f: Callable) -> Callable:
+    """Decorator forcing all queries made by a function to go to the primary database
+    """
+
+    @wraps(f)
+    def deco(*args, **kwargs):
+        with primary():
+            return f(*args, **kwargs)
+
+    return deco
+
+
+class ReplicaRouter:
+    """Replica engines selector
+    """
+
+    def __init__(self, engines: List[Engine], policy: str = 'round_robin'):
+        """Init
+        """
+        self.engines = engines
+        self.policy = policy
+        self._counter = count()
+
+    def choose(self) -> Engine:
+        """Choose a replica engine
+        """
+        engines = self.engines
+        if len(engines) == 1:
+            return engines[0]
+
+        if self.policy == 'least_connections':
+            return min(engines, key=lambda e: e.pool.checkedout() if isinstance(e.pool, QueuePool) else 0)
+
+        return engines[next(self._counter) % len(engines)]
+
+
+def _is_write(clause) -> bool:
+    if isinstance(clause, UpdateBase):
+        return True
+
+    if getattr(clause, '_for_update_arg', None) is not None:
+        return True
+
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip()[:6].upper() == 'SELECT'
+
+    return False
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to replicas
+
+    A replica is chosen on the first read and is used until the session is closed. Flushes, writing statements and
+    textual statements other than ``SELECT`` go to the primary database. After the first write, all queries of the
+    session and of other sessions within the same request go to the primary database as well, so the request reads its
+    own writes. Models with ``__bind_key__`` are not routed.
+    """
+
+    def __init__(self, db: SQLAlchemy, router: ReplicaRouter, **options):
+        """Init
+        """
+        super().__init__(db, **options)
+        self.router = router
+        self.wrote = False
+        self._replica = None  # type: Optional[Engine]
+
+    def mark_wrote(self):
+        """Route further queries to the primary database
+        """
+        self.wrote = True
+        if has_request_context():
+            g.ampho_db_wrote = True
+
+    def _use_primary(self, mapper, clause) -> bool:
+        if self.wrote or self._flushing or _force_primary.get():
+            return True
+
+        if has_request_context() and g.get('ampho_db_wrote'):
+            return True
+
+        if clause is not None and _is_write(clause):
+            self.mark_wrote()
+            return True
+
+        if mapper is not None and getattr(mapper.persist_selectable, 'info', {}).get('bind_key') is not None:
+            return True
+
+        return False
+
+    def get_bind(self, mapper=None, clause=None):
+        """Get an engine for a query
+        """
+        if self._use_primary(mapper, clause):
+            return super().get_bind(mapper, clause)
+
+        if self._replica is None:
+            self._replica = self.router.choose()
+
+        return self._replica
+
+    def close(self):
+        """Close the session
+        """
+        super().close()
+        self.wrote = False
+        self._replica = None
+
+
+def _after_flush(session: RoutingSession, flush_context):
+    session.mark_wrote()
+
+
+def make_routing_session(db: SQLAlchemy, router: ReplicaRouter) -> orm.scoped_session:
+    """Create a scoped session like Flask-SQLAlchemy does, but using :class:`RoutingSession`
+    """
+    factory = orm.sessionmaker(class_=RoutingSession, db=db, router=router, query_cls=db.Query)
+    session = orm.scoped_session(factory, scopefunc=db.session.registry.scopefunc)
+
+    # Listeners of the factory's session class, which is a subclass made by sessionmaker, hide ones of RoutingSession
+    event.listen(session, 'after_flush', _after_flush)
+
+    return session
@@ -0,0 +1,252 @@
+"""Ampho Migration Revisions Index
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import ast
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from os import path
+from hashlib import sha1
+
+_FIELDS = ('revision', 'down_revision', 'branch_labels', 'depends_on')
+
+
+def _as_tuple(v: Any) -> Tuple[str, ...]:
+    if v is None:
+        return ()
+    if isinstance(v, str):
+        return v,
+
+    return tuple(v)
+
+
+def parse_revision_file(file_path: str) -> Optional[Dict[str, Any]]:
+    """Extract revision identifiers from a revision script without importing it
+
+    Returns ``None`` if the file does not define revision identifiers as literals.
+    """
+    with open(file_path, 'rb') as f:
+        tree = ast.parse(f.read(), file_path)
+
+    r = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name) and node.value:
+            name = node.target.id
+        else:
+            continue
+
+        if name in _FIELDS:
+            try:
+                r[name] = ast.literal_eval(node.value)
+            except ValueError:
+                return None
+
+    if not isinstance(r.get('revision'), str):
+        return None
+
+    doc = ast.get_docstring(tree) or ''
+
+    return {
+        'revision': r['revision'],
+        'down_revisions': _as_tuple(r.get('down_revision')),
+        'branch_labels': _as_tuple(r.get('branch_labels')),
+        'depends_on': _as_tuple(r.get('depends_on')),
+        'doc': doc.strip().split('\n')[0],
+    }
+
+
+class Revision:
+    """Indexed revision
+    """
+    __slots__ = ('revision', 'down_revisions', 'branch_labels', 'depends_on', 'doc', 'package', 'path')
+
+    def __init__(self, revision: str, down_revisions: Iterable[str] = (), branch_labels: Iterable[str] = (),
+                 depends_on: Iterable[str] = (), doc: str = '', package: str = '', path: str = ''):
+        """Init
+        """
+        self.revision = revision
+        self.down_revisions = tuple(down_revisions)
+        self.branch_labels = tuple(branch_labels)
+        self.depends_on = tuple(depends_on)
+        self.doc = doc
+        self.package = package
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f'<Revision {self.revision}>'
+
+
+class RevisionIndex:
+    """Index of revisions across all migration packages
+
+    The index is persisted as a JSON file. Entries are re-parsed only for files which size or modification time
+    changed and which content hash differs from the stored one.
+    """
+
+    def __init__(self, revisions: Iterable[Revision]):
+        """Init
+        """
+        self.revisions = {r.revision: r for r in revisions}  # type: Dict[str, Revision]
+
+        self._children = {}  # type: Dict[str, List[str]]
+        for r in self.revisions.values():
+            for down in r.down_revisions:
+                self._children.setdefault(down, []).append(r.revision)
+
+    def __len__(self) -> int:
+        return len(self.revisions)
+
+    def __contains__(self, rev: str) -> bool:
+        return rev in self.revisions
+
+    @classmethod
+    def build(cls, sources: Dict[str, str], index_path: Optional[str] = None) -> 'RevisionIndex':
+        """Build the index from versions directories of packages
+
+        :param sources: versions directories by package names.
+        :param index_path: location of the persisted index. If omitted, all files are parsed.
+        """
+        stored = {}  # type: Dict[str, Dict[str, Any]]
+        if index_path:
+            try:
+                with open(index_path) as f:
+                    stored = json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+
+        entries = {}
+        for pkg_name, dir_path in sources.items():
+            if not path.isdir(dir_path):
+                continue
+
+            for entry in os.scandir(dir_path):
+                if not (entry.is_file() and entry.name.endswith('.py')):
+                    continue
+
+                st = entry.stat()
+                stat_sig = [st.st_size, st.st_mtime_ns]
+                cached = stored.get(entry.path)
+                if cached and cached['stat'] == stat_sig:
+                    entries[entry.path] = cached
+                    continue
+
+                with open(entry.path, 'rb') as f:
+                    digest = sha1(f.read()).hexdigest()
+
+                if cached and cached['hash'] == digest:
+                    cached['stat'] = stat_sig
+                    entries[entry.path] = cached
+                    continue
+
+                try:
+                    rev = parse_revision_file(entry.path)
+                except SyntaxError as e:
+                    logging.warning(f'Cannot parse revision file {entry.path}: {e}')
+                    rev = None
+
+                entries[entry.path] = {'stat': stat_sig, 'hash': digest, 'package': pkg_name, 'rev': rev}
+
+        if index_path and entries != stored:
+            os.makedirs(path.dirname(index_path), 0o755, True)
+            tmp_path = f'{index_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, index_path)
+
+        revisions = []
+        for file_path, e in entries.items():
+            if e['rev']:
+                revisions.append(Revision(package=e['package'], path=file_path, **e['rev']))
+
+        return cls(revisions)
+
+    @property
+    def heads(self) -> List[Revision]:
+        """Get revisions which have no descendants
+        """
+        return [r for r in self.revisions.values() if r.revision not in self._children]
+
+    def get(self, rev: str) -> Optional[Revision]:
+        """Get a revision by its ID or unique ID prefix
+        """
+        r = self.revisions.get(rev)
+        if r is None and rev:
+            found = [r for r in self.revisions.values() if r.revision.startswith(rev)]
+            r = found[0] if len(found) == 1 else None
+
+        return r
+
+    def resolve(self, spec: str) -> Optional[List[Revision]]:
+        """Resolve a simple revision specifier
+
+        Supported specifiers are ``head``, ``heads``, branch labels, which resolve to heads of a branch, and revision
+        IDs. Returns ``None`` for other specifiers.
+        """
+        if spec in ('head', 'heads'):
+            return self.heads
+
+        labeled = [r.revision for r in self.revisions.values() if spec in r.branch_labels]
+        if labeled:
+            branch = self.descendants(labeled)
+            return [r for r in self.heads if r.revision in branch]
+
+        r = self.get(spec)
+
+        return [r] if r else None
+
+    def ancestors(self, revs: Iterable[str]) -> Set[str]:
+        """Get IDs of revisions and all their ancestors, including dependencies
+        """
+        r = set()
+        stack = list(revs)
+        while stack:
+            rev = self.revisions.get(stack.pop())
+            if rev is None or rev.revision in r:
+                continue
+            r.add(rev.revision)
+            stack.extend(rev.down_revisions)
+            stack.extend(rev.depends_on)
+
+        return r
+
+    def descendants(self, revs: Iterable[str]) -> Set[str]:
+        """Get IDs of revisions and all their descendants
+        """
+        r = set()
+        stack = list(revs)
+        while stack:
+            rev = stack.pop()
+            if rev in r:
+                continue
+            r.add(rev)
+            stack.extend(self._children.get(rev, ()))
+
+        return r
+
+    def pending(self, current: Iterable[str]) -> List[Revision]:
+        """Get revisions which are not applied yet, parents first
+        """
+        seen = self.ancestors(current)
+        r = []
+
+        for root in sorted(self.revisions):
+            stack = [(root, False)]
+            while stack:
+                rev, expanded = stack.pop()
+                if expanded:
+                    r.append(self.revisions[rev])
+                    continue
+                if rev in seen or rev not in self.revisions:
+                    continue
+                seen.add(rev)
+                stack.append((rev, True))
+                parents = self.revisions[rev].down_revisions + self.revisions[rev].depends_on
+                stack.extend((p, False) for p in reversed(parents))
+
+        return r
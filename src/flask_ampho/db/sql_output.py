@@ -0,0 +1,127 @@
+"""Ampho Offline SQL Output
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import re
+from typing import Callable, IO, List, Optional
+from os import path
+from shutil import copyfileobj
+from tempfile import mkstemp
+
+SPLIT_MODES = ('package', 'revision')
+
+
+class SqlOutput:
+    """Offline SQL writer
+
+    The writer is passed to Alembic as the output buffer, so generated SQL is written to disk statement by statement
+    instead of being accumulated. Alembic flushes the buffer after each statement.
+
+    Without splitting all statements go to a single file. Otherwise output of each migration step goes to a temporary
+    file first, which is then moved to the ``{revision}.sql`` file or appended to the ``{package}.sql`` file in the
+    output directory. Output after the last step is appended to the last file.
+    """
+
+    def __init__(self, output: str, split: Optional[str] = None, separator: Optional[str] = None,
+                 package_of: Optional[Callable[[str], str]] = None):
+        """Init
+
+        :param output: output file path, or output directory path if ``split`` is set.
+        :param split: ``package`` or ``revision``.
+        :param separator: batch separator written after each statement, i. e. ``GO``.
+        :param package_of: a callable returning package name of a revision.
+        """
+        if split and split not in SPLIT_MODES:
+            raise ValueError(f'Invalid split mode: {split}')
+
+        self.output = output
+        self.split = split
+        self.separator = separator
+        self.package_of = package_of or (lambda rev: rev.rsplit('_', 1)[0])
+        self.files = []  # type: List[str]
+
+        self._file = None  # type: Optional[IO]
+        self._tmp_path = None  # type: Optional[str]
+        self._size = 0
+        self._last_text = ''
+        self._close_on_flush = None  # type: Optional[str]
+
+        if split:
+            os.makedirs(output, 0o755, True)
+            self._new_segment()
+        else:
+            os.makedirs(path.dirname(path.abspath(output)), 0o755, True)
+            self._file = open(output, 'w')
+            self.files.append(output)
+
+    def _new_segment(self):
+        fd, self._tmp_path = mkstemp('.sql', '.ampho-', self.output)
+        self._file = os.fdopen(fd, 'w')
+        self._size = 0
+
+    def _file_name(self, step) -> str:
+        revs = step.up_revision_ids if step.is_upgrade else step.down_revision_ids
+        rev = revs[0] if revs else 'base'
+        name = rev if self.split == 'revision' else self.package_of(rev)
+
+        return re.sub(r'[^\w.@-]', '_', name) + '.sql'
+
+    def _close_segment(self, file_name: str):
+        self._file.close()
+        dst = path.join(self.output, file_name)
+
+        if dst in self.files:
+            with open(dst, 'a') as f_dst, open(self._tmp_path) as f_src:
+                copyfileobj(f_src, f_dst)
+            os.unlink(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, dst)
+            self.files.append(dst)
+
+        self._new_segment()
+
+    def write(self, text: str):
+        """Write a statement
+        """
+        self._file.write(text)
+        self._size += len(text)
+        self._last_text = text
+
+    def flush(self):
+        """Finish a statement
+        """
+        # Alembic writes comments, like '-- Running ...', the same way as statements
+        if self.separator and not self._last_text.lstrip().startswith('--'):
+            self._file.write(f'{self.separator}\n\n')
+
+        # Transaction of a step is committed after the step is reported as applied
+        if self._close_on_flush:
+            file_name, self._close_on_flush = self._close_on_flush, None
+            self._close_segment(file_name)
+
+    def on_version_apply(self, ctx, step, heads, run_args):
+        """Alembic's callback called after each migration step
+        """
+        if not self.split:
+            return
+
+        # Per step transaction is committed after this callback
+        if ctx.impl.transactional_ddl and ctx.opts.get('transaction_per_migration'):
+            self._close_on_flush = self._file_name(step)
+        else:
+            self._close_segment(self._file_name(step))
+
+    def close(self):
+        """Finish writing
+        """
+        self._file.close()
+        if not self.split:
+            return
+
+        if self._size and self.files:
+            with open(self.files[-1], 'a') as f_dst, open(self._tmp_path) as f_src:
+                copyfileobj(f_src, f_dst)
+        os.unlink(self._tmp_path)
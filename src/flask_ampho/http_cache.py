@@ -0,0 +1,180 @@
+"""Ampho HTTP Caching
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Any, Callable, Iterable, Optional, Tuple, Union
+from time import time
+from hashlib import sha1
+from functools import wraps
+from werkzeug.http import http_date, is_hop_by_hop_header
+from flask import Response, current_app, g, request
+from flask_ampho import Ampho
+from flask_ampho.cache import MISSING, Cache, MemoryBackend
+from flask_ampho.settings import declare, as_bool
+
+declare('AMPHO_HTTP_CACHE', as_bool, True)
+declare('AMPHO_HTTP_CACHE_CONTROL', str, 'no-cache')
+declare('AMPHO_HTTP_CACHE_SIZE', int, 1000, lambda v: v > 0)
+declare('AMPHO_HTTP_CACHE_TTL', float, 300.0, lambda v: v > 0)
+
+
+def _is_stored_header(name: str) -> bool:
+    """Check whether a response header may be replayed to other requests
+    """
+    return name.lower() not in ('content-length', 'set-cookie') and not is_hop_by_hop_header(name)
+
+
+def _scope() -> Union[str, None, bool]:
+    """Get an authorization scope of the current request
+
+    Returns ``False`` if the request carries credentials which were not verified yet or which do not identify a user,
+    so it must not be answered from the cache.
+    """
+    auth = g.get('ampho_auth')
+    if auth is not None:
+        if not isinstance(auth, dict):
+            return str(auth)
+
+        user = auth.get('login') or auth.get('sub')
+
+        return str(user) if user else False
+
+    if 'Authorization' in request.headers:
+        return False
+
+    return None
+
+
+class CachedResponse:
+    """Response validators and, optionally, the serialized response
+    """
+    __slots__ = ('etag', 'weak', 'last_modified', 'status', 'headers', 'body')
+
+    def __init__(self, etag: str, weak: bool, last_modified: float, status: int = 200,
+                 headers: Iterable[Tuple[str, str]] = (), body: bytes = None):
+        """Init
+        """
+        self.etag = etag
+        self.weak = weak
+        self.last_modified = last_modified
+        self.status = status
+        self.headers = list(headers)
+        self.body = body
+
+
+class HttpCache:
+    """Conditional requests handling and response caching
+
+    Validators of responses are kept in a bounded in-process cache keyed by endpoint, URL, arguments and
+    authorization scope, so requests with matching ``If-None-Match`` or ``If-Modified-Since`` headers are answered
+    with ``304 Not Modified`` without running handlers.
+    """
+
+    def __init__(self, ampho: Ampho):
+        """Init
+        """
+        self.ampho = ampho
+        settings = ampho.settings
+        self.cache = Cache(MemoryBackend(settings.http_cache_size), settings.http_cache_ttl)
+        self.cache.track(ampho.db.sqlalchemy.session)
+
+    @staticmethod
+    def _key(scope: Optional[str]) -> str:
+        args = sorted(request.args.items(multi=True))
+        view_args = sorted((request.view_args or {}).items())
+
+        return f'{request.endpoint}:{request.path}:{args!r}:{view_args!r}:{scope}'
+
+    def _finalize(self, resp: Response, entry: CachedResponse, scope: Optional[str],
+                  cache_control: Optional[str]) -> Response:
+        resp.set_etag(entry.etag, entry.weak)
+        resp.headers['Last-Modified'] = http_date(entry.last_modified)
+
+        cc = cache_control or self.ampho.settings.http_cache_control
+        if scope is not None and 'private' not in cc and 'public' not in cc:
+            cc = 'private, ' + cc
+        resp.headers['Cache-Control'] = cc
+        if scope is not None:
+            resp.vary.add('Authorization')
+
+        return resp.make_conditional(request)
+
+    def _make_response(self, rv: Any) -> Response:
+        if isinstance(rv, Response):
+            return rv
+
+        code, headers = 200, None
+        if isinstance(rv, tuple):
+            rv, code, headers = (rv + (None, None))[:3]
+
+        return self.ampho.json.response(rv, code or 200, headers)
+
+    def handle(self, f: Callable, args: tuple, kwargs: dict, weak: bool, store: bool, tables: Iterable[str],
+               ttl: Optional[float], cache_control: Optional[str]) -> Response:
+        """Handle a request
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return f(*args, **kwargs)
+
+        scope = _scope()
+        if scope is False:
+            return f(*args, **kwargs)
+
+        key = self._key(scope)
+        entry = self.cache.get(key, tables)  # type: CachedResponse
+        if entry is not MISSING:
+            if entry.body is not None:
+                resp = Response(entry.body, entry.status, entry.headers)
+                return self._finalize(resp, entry, scope, cache_control)
+
+            # Only validators are known, so the handler can be skipped only if the client has the same version
+            probe = self._finalize(Response(status=200), entry, scope, cache_control)
+            if probe.status_code == 304:
+                return probe
+
+        resp = self._make_response(f(*args, **kwargs))
+        if resp.status_code != 200 or resp.is_streamed:
+            return resp
+
+        body = resp.get_data()
+        etag = sha1(body).hexdigest()
+        last_modified = entry.last_modified if entry is not MISSING and entry.etag == etag else time()
+        new_entry = CachedResponse(etag, weak, last_modified)
+        if store:
+            new_entry.status = resp.status_code
+            new_entry.headers = [(k, v) for k, v in resp.headers.items() if _is_stored_header(k)]
+            new_entry.body = body
+        self.cache.set(key, new_entry, tables, ttl)
+
+        return self._finalize(resp, new_entry, scope, cache_control)
+
+
+def conditional(weak: bool = False, store: bool = False, tables: Iterable[str] = (), ttl: float = None,
+                cache_control: str = None) -> Callable:
+    """Decorator adding validators to GET responses and answering conditional requests
+
+    Must be applied after :func:`flask_ampho.security.api.authorize`, so responses are cached per user.
+
+    :param weak: whether to produce weak ETags.
+    :param store: whether to keep serialized responses, so handlers are not run until cached entries expire. Cookies and
+        hop-by-hop headers are not kept.
+    :param tables: database tables which changes invalidate cached entries.
+    :param ttl: cached entries lifetime in seconds. Default is ``AMPHO_HTTP_CACHE_TTL``.
+    :param cache_control: ``Cache-Control`` header value. Default is ``AMPHO_HTTP_CACHE_CONTROL``.
+    """
+    tables = tuple(tables)
+
+    def decorator(f: Callable):
+        @wraps(f)
+        def deco(*args, **kwargs):
+            ampho = current_app.extensions['ampho']  # type: Ampho
+            if not ampho.http_cache:
+                return f(*args, **kwargs)
+
+            return ampho.http_cache.handle(f, args, kwargs, weak, store, tables, ttl, cache_control)
+
+        return deco
+
+    return decorator
@@ -0,0 +1,164 @@
+"""Ampho JSON Codec
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+from typing import Any, Dict, Union
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+from flask import Response, current_app, make_response
+from .error import ConfigurationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+    ujson.dumps(None, default=str)
+except (ImportError, TypeError):
+    # ujson before 5.0 does not support the default argument
+    ujson = None
+
+
+def _default(obj: Any) -> Any:
+    """Encode types unsupported by JSON
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+
+    if isinstance(obj, (UUID, Decimal)):
+        return str(obj)
+
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+
+def _str_decimals(obj: Any) -> Any:
+    """Replace decimals with strings in containers
+    """
+    if isinstance(obj, Decimal):
+        return str(obj)
+
+    if isinstance(obj, dict):
+        return {k: _str_decimals(v) for k, v in obj.items()}
+
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_str_decimals(v) for v in obj]
+
+    return obj
+
+
+class JsonCodec:
+    """Standard library JSON codec
+
+    Dates and times are encoded in ISO 8601 format, UUIDs and decimals as strings.
+    """
+    name = 'json'
+
+    def dumps(self, obj: Any) -> str:
+        """Encode an object
+        """
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        """Encode an object to UTF-8 bytes
+        """
+        return self.dumps(obj).encode()
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        """Decode a document
+        """
+        return json.loads(s)
+
+    def response(self, data: Any, code: int, headers: Dict = None) -> Response:
+        """Make a response, i. e. as a flask-restful representation
+        """
+        resp = make_response(self.dumps_bytes(data), code)
+        resp.headers.extend(headers or {})
+        resp.headers['Content-Type'] = 'application/json'
+
+        return resp
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson codec
+    """
+    name = 'orjson'
+
+    def dumps(self, obj: Any) -> str:
+        """Encode an object
+        """
+        return self.dumps_bytes(obj).decode()
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        """Encode an object to UTF-8 bytes
+        """
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        """Decode a document
+        """
+        return orjson.loads(s)
+
+
+class UjsonCodec(JsonCodec):
+    """ujson codec
+
+    ujson encodes decimals as floats without calling the default function, so decimals are converted beforehand, which
+    requires a walk over the whole object. Therefore the codec is not chosen automatically.
+    """
+    name = 'ujson'
+
+    def dumps(self, obj: Any) -> str:
+        """Encode an object
+        """
+        return ujson.dumps(_str_decimals(obj), default=_default, ensure_ascii=False, escape_forward_slashes=False)
+
+    def loads(self, s: Union[str, bytes]) -> Any:
+        """Decode a document
+        """
+        return ujson.loads(s)
+
+
+_codecs = {}  # type: Dict[str, JsonCodec]
+
+
+def get_codec(name: str = 'auto') -> JsonCodec:
+    """Get a codec by name
+
+    ``auto`` means orjson, if it is installed, or the standard library codec.
+    """
+    codec = _codecs.get(name)
+    if codec:
+        return codec
+
+    if name == 'auto':
+        codec = OrjsonCodec() if orjson else JsonCodec()
+    elif name == 'orjson' and orjson:
+        codec = OrjsonCodec()
+    elif name == 'ujson' and ujson:
+        codec = UjsonCodec()
+    elif name == 'json':
+        codec = JsonCodec()
+    else:
+        raise ConfigurationError(f'JSON backend is not available: {name}')
+
+    _codecs[name] = codec
+
+    return codec
+
+
+def output_json(data: Any, code: int, headers: Dict = None) -> Response:
+    """flask-restful JSON representation using the current application's Ampho codec
+    """
+    ampho = current_app.extensions.get('ampho')
+    codec = ampho.json if ampho else get_codec()
+
+    return codec.response(data, code, headers)
@@ -0,0 +1,394 @@
+"""Ampho Logging Helpers
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import json
+import queue
+import logging
+from typing import Dict, List, Optional, Tuple
+from time import time
+from uuid import uuid4
+from threading import Event, Lock, Thread
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+from flask import g, request, has_request_context
+
+_JSON_SKIP_ATTRS = frozenset(logging.LogRecord(None, 0, '', 0, '', None, None).__dict__) | {'message', 'asctime'}
+
+
+def request_id() -> str:
+    """Get ID of the current request
+
+    The ID is taken from the ``X-Request-ID`` header, if present, or generated.
+    """
+    rid = g.get('ampho_request_id')
+    if rid is None:
+        rid = g.ampho_request_id = request.headers.get('X-Request-ID', '')[:64] or uuid4().hex
+
+    return rid
+
+
+class RequestContextFilter(logging.Filter):
+    """Add request ID, route and authenticated login to log records
+
+    Records emitted outside of a request context get ``None`` values.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Add request attributes to a record
+        """
+        if not hasattr(record, 'request_id'):
+            if has_request_context():
+                auth = g.get('ampho_auth') or {}
+                record.request_id = request_id()
+                record.route = request.url_rule.rule if request.url_rule else request.path
+                record.login = auth.get('login') if isinstance(auth, dict) else None
+            else:
+                record.request_id = record.route = record.login = None
+
+        return True
+
+
+class DedupFilter(logging.Filter):
+    """Collapse identical log messages
+
+    Messages are considered identical if they have the same logger, level and format string. The first message is
+    passed through, and its repetitions within the time window are suppressed. The next message after the window gets
+    the ``repeated`` attribute with number of suppressed messages, and `` (repeated N times)`` suffix.
+
+    If the message does not recur, the count is reported by :meth:`flush`, which is called by a background thread once
+    per window while the filter is started, and by :meth:`stop`.
+    """
+
+    def __init__(self, window: float = 10.0, max_keys: int = 1000):
+        """Init
+        """
+        super().__init__()
+        self.window = window
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self.handler = None  # type: Optional[logging.Handler]
+        self._seen = {}  # type: Dict[Tuple, List]
+        self._lock = Lock()
+        self._thread = None  # type: Optional[Thread]
+        self._stop = Event()
+        self._at_fork_registered = False
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Check whether the record should be logged
+        """
+        if getattr(record, '_ampho_dedup_flushed', False):
+            return True
+
+        msg = record.msg if isinstance(record.msg, str) and record.args else record.getMessage()
+        key = (record.name, record.levelno, msg)
+        now = record.created
+
+        with self._lock:
+            entry = self._seen.get(key)
+
+            # Suppress repetition within the window
+            if entry and now < entry[0] + self.window:
+                entry[1] += 1
+                entry[2] = record
+                self.suppressed += 1
+                return False
+
+            repeated = entry[1] if entry else 0
+            self._seen[key] = [now, 0, None]
+            if len(self._seen) > self.max_keys:
+                self._prune(now)
+
+        if repeated:
+            _mark_repeated(record, repeated)
+
+        return True
+
+    def _prune(self, now: float):
+        for key, (ts, n, _) in list(self._seen.items()):
+            if now >= ts + self.window and not n:
+                del self._seen[key]
+
+    @property
+    def is_running(self) -> bool:
+        """Check whether the flushing thread is running
+        """
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, handler: logging.Handler):
+        """Start flushing counts of suppressed messages to a handler once per window
+        """
+        self.handler = handler
+        if self.is_running:
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='ampho-log-dedup', daemon=True)
+        self._thread.start()
+
+        # Threads do not survive fork, so restart flushing in child processes
+        if not self._at_fork_registered and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._at_fork_registered = True
+
+    def stop(self):
+        """Stop the flushing thread and report all pending counts
+        """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+        self.flush(True)
+
+    def _after_fork(self):
+        if self._thread is not None:
+            self._thread = None
+            self.start(self.handler)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error('Cannot flush suppressed log messages: %s', e)
+
+    def flush(self, force: bool = False) -> int:
+        """Report counts of messages suppressed within expired windows to the handler
+
+        :param force: whether to report counts within unexpired windows as well.
+        :returns: number of reported records.
+        """
+        now = time()
+        records = []
+        with self._lock:
+            for key, entry in list(self._seen.items()):
+                ts, n, last = entry
+                if not n or not (force or now >= ts + self.window):
+                    continue
+
+                record = logging.makeLogRecord(last.__dict__)
+                _mark_repeated(record, n)
+                record._ampho_dedup_flushed = True
+                records.append(record)
+                del self._seen[key]
+
+        if self.handler:
+            for record in records:
+                self.handler.handle(record)
+
+        return len(records)
+
+
+def _mark_repeated(record: logging.LogRecord, repeated: int):
+    record.repeated = repeated
+    record.msg = f'{record.getMessage()} (repeated {repeated} times)'
+    record.args = None
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON lines formatter
+
+    Besides standard fields, output contains request ID, route and login added by :class:`RequestContextFilter`, and
+    other extra record attributes.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format a record
+        """
+        r = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'file': f'{record.filename}:{record.lineno}',
+        }
+
+        for k, v in record.__dict__.items():
+            if k not in _JSON_SKIP_ATTRS and not k.startswith('_'):
+                r[k] = v
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            r['exc'] = record.exc_text
+        if record.stack_info:
+            r['stack'] = self.formatStack(record.stack_info)
+
+        return json.dumps(r, default=str, ensure_ascii=False)
+
+
+class BufferedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Timed rotating file handler which flushes only on demand
+
+    It's intended to be used by :class:`BatchingQueueListener`, which flushes the stream once per batch of records.
+    """
+
+    def flush(self):
+        """Skip flushing after each record
+        """
+        pass
+
+    def force_flush(self):
+        """Flush the stream
+        """
+        super().flush()
+
+    def close(self):
+        """Flush and close the stream
+        """
+        self.force_flush()
+        super().close()
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Bounded queue handler with configurable overflow policy
+
+    Overflow policies:
+
+    * ``block``. Wait for a free place in the queue.
+    * ``drop``. Silently drop records.
+    * ``drop_count``. Drop records and report number of dropped records once the queue has a free place again.
+    """
+
+    def __init__(self, q: queue.Queue, overflow: str = 'drop_count'):
+        """Init
+        """
+        super().__init__(q)
+        self.overflow = overflow
+        self.dropped = 0
+        self._unreported = 0
+        self._lock = Lock()
+
+    def enqueue(self, record: logging.LogRecord):
+        """Put a record into the queue
+        """
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+
+        try:
+            if self._unreported:
+                self._report_dropped()
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+
+    def _report_dropped(self):
+        with self._lock:
+            n, self._unreported = self._unreported, 0
+
+        if n and self.overflow == 'drop_count':
+            msg = f'{n} log records were dropped due to logging queue overflow'
+            record = logging.LogRecord('ampho', logging.WARNING, __file__, 0, msg, None, None)
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                with self._lock:
+                    self._unreported += n
+                raise
+
+    def stats(self) -> Dict[str, int]:
+        """Get queue statistics
+        """
+        return {
+            'queue_size': self.queue.qsize(),
+            'queue_max_size': self.queue.maxsize,
+            'dropped': self.dropped,
+        }
+
+
+class BatchingQueueListener(QueueListener):
+    """Queue listener which writes records in batches
+
+    After each batch of up to ``batch_size`` records, handlers providing ``force_flush()`` are flushed once.
+    """
+
+    def __init__(self, q: queue.Queue, *handlers: logging.Handler, batch_size: int = 100):
+        """Init
+        """
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        """Put the stop sentinel into the queue, waiting for a free place if necessary
+        """
+        self.queue.put(self._sentinel)
+
+    def _flush(self):
+        for handler in self.handlers:
+            flush = getattr(handler, 'force_flush', None)
+            if flush:
+                flush()
+
+    def _monitor(self):
+        q = self.queue
+        stop = False
+
+        while not stop:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                else:
+                    self.handle(record)
+                q.task_done()
+
+            self._flush()
+
+
+class AsyncLogging:
+    """Non-blocking logging pipeline
+
+    Request threads only put records into a bounded queue, while a background listener writes them to the target
+    handler.
+    """
+
+    def __init__(self, handler: logging.Handler, queue_size: int = 10000, overflow: str = 'drop_count',
+                 batch_size: int = 100):
+        """Init
+        """
+        self.handler = handler
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.started = time()
+
+        q = queue.Queue(queue_size)
+        self.queue_handler = AsyncQueueHandler(q, overflow)
+        self.listener = BatchingQueueListener(q, handler, batch_size=batch_size)
+
+    def start(self):
+        """Start the listener
+        """
+        self.listener.start()
+
+    def stop(self):
+        """Write all queued records and stop the listener
+        """
+        if self.listener._thread:
+            self.listener.stop()
+
+    def after_fork(self):
+        """Restart the listener in a child process
+
+        Listener's thread does not survive fork, so the child gets a new queue and a new listener.
+        """
+        q = queue.Queue(self.queue_size)
+        self.queue_handler.queue = q
+        self.listener = BatchingQueueListener(q, self.handler, batch_size=self.batch_size)
+        self.start()
+
+    def stats(self) -> Dict[str, int]:
+        """Get queue statistics
+        """
+        return self.queue_handler.stats()
@@ -0,0 +1,396 @@
+"""Ampho Metrics
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import hmac
+import json
+import atexit
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from time import perf_counter, time
+from uuid import uuid4
+from functools import partial
+from weakref import ref
+from threading import Thread, Event
+from flask import Response, abort, g, request
+from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_bool
+from flask_ampho.stats import Histogram
+
+declare('AMPHO_METRICS', as_bool, True)
+declare('AMPHO_METRICS_PATH', str, '')
+declare('AMPHO_METRICS_TOKEN')
+declare('AMPHO_METRICS_DIR')
+declare('AMPHO_METRICS_SYNC_INTERVAL', float, 5.0, lambda v: v > 0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricFamily:
+    """Metric with its samples
+    """
+    __slots__ = ('name', 'type', 'help', 'samples')
+
+    def __init__(self, name: str, type_: str, help_: str):
+        """Init
+        """
+        self.name = name
+        self.type = type_
+        self.help = help_
+        self.samples = {}  # type: Dict[Tuple[str, Labels], float]
+
+    def add(self, value: float, suffix: str = '', **labels: Any) -> 'MetricFamily':
+        """Add a sample
+        """
+        key = (suffix, tuple((k, str(v)) for k, v in sorted(labels.items())))
+        self.samples[key] = self.samples.get(key, 0) + value
+
+        return self
+
+    def add_histogram(self, hist: Histogram, **labels: Any) -> 'MetricFamily':
+        """Add samples of a histogram
+        """
+        for le, n in zip(hist.buckets + ('+Inf',), hist.cumulative()):
+            self.add(n, '_bucket', le=le, **labels)
+        self.add(hist.sum, '_sum', **labels)
+        self.add(hist.count, '_count', **labels)
+
+        return self
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get a JSON-serializable representation
+        """
+        return {
+            'name': self.name,
+            'type': self.type,
+            'help': self.help,
+            'samples': [[s, list(map(list, labels)), v] for (s, labels), v in self.samples.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'MetricFamily':
+        """Restore from a representation made by :meth:`as_dict`
+        """
+        fam = cls(d['name'], d['type'], d['help'])
+        for suffix, labels, value in d['samples']:
+            fam.samples[(suffix, tuple(map(tuple, labels)))] = value
+
+        return fam
+
+
+def _escape(v: str) -> str:
+    return v.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(v: float) -> str:
+    if isinstance(v, int):
+        return str(v)
+
+    if v == float('inf'):
+        return '+Inf'
+
+    return repr(float(v))
+
+
+def render(families: Iterable[MetricFamily]) -> str:
+    """Render metrics in the Prometheus text format
+    """
+    lines = []
+    for fam in families:
+        lines.append(f'# HELP {fam.name} {fam.help}')
+        lines.append(f'# TYPE {fam.name} {fam.type}')
+        for (suffix, labels), value in fam.samples.items():
+            if labels:
+                labels_str = '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+            else:
+                labels_str = ''
+            lines.append(f'{fam.name}{suffix}{labels_str} {_format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def merge(families: Dict[str, MetricFamily], other: Iterable[MetricFamily], pid: Optional[int] = None):
+    """Merge metrics of another process
+
+    Counters and histograms are summed. Gauges are kept per process using the ``pid`` label.
+    """
+    for fam in other:
+        target = families.get(fam.name)
+        if target is None:
+            target = families[fam.name] = MetricFamily(fam.name, fam.type, fam.help)
+
+        for (suffix, labels), value in fam.samples.items():
+            if fam.type == 'gauge' and pid is not None:
+                labels = labels + (('pid', str(pid)),)
+            key = (suffix, labels)
+            target.samples[key] = target.samples.get(key, 0) + value
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _after_fork(metrics_ref: ref):
+    metrics = metrics_ref()
+    if metrics:
+        metrics.after_fork()
+
+
+class Metrics:
+    """Runtime metrics collector
+
+    Requests are counted and timed per endpoint. Other Ampho parts are asked for their statistics only when metrics
+    are collected. Additional metric families may be provided by receivers of the ``collect-metrics`` signal, which
+    get a list to append :class:`MetricFamily` objects to.
+
+    If a metrics directory is configured, each process periodically writes its metrics to its own file in the
+    directory from a background thread, and collection merges files of all processes, so metrics of pre-forked
+    workers are aggregated. File names contain a random part, so a process reusing the PID of a finished one does not
+    overwrite its metrics.
+    """
+
+    def __init__(self, ampho: Ampho):
+        """Init
+        """
+        self.ampho = ampho
+        self.on_collect = ampho.signals.signal('collect-metrics')
+        self.started = time()
+
+        self.latency = {}  # type: Dict[Tuple[str, str], Histogram]
+        self.responses = {}  # type: Dict[Tuple[str, str, int], int]
+
+        self.dir_path = ampho.settings.metrics_dir  # type: Optional[str]
+        self.sync_interval = ampho.settings.metrics_sync_interval
+        self.token = ampho.settings.metrics_token  # type: Optional[str]
+        self._file_id = f'{os.getpid()}-{uuid4().hex[:8]}'
+        self._thread = None  # type: Optional[Thread]
+        self._stop = Event()
+        if self.dir_path:
+            os.makedirs(self.dir_path, 0o755, True)
+            atexit.register(self.sync)
+            self.start()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=partial(_after_fork, ref(self)))
+
+        app = ampho.app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        if ampho.settings.metrics_path:
+            app.add_url_rule(ampho.settings.metrics_path, 'ampho_metrics', self.view)
+
+    def reset(self):
+        """Reset request metrics, i. e. in a forked process
+        """
+        self.latency = {}
+        self.responses = {}
+        self.started = time()
+        self._file_id = f'{os.getpid()}-{uuid4().hex[:8]}'
+
+    def after_fork(self):
+        """Reset metrics and restart synchronization in a forked process
+        """
+        self.reset()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+    @property
+    def is_running(self) -> bool:
+        """Check whether background synchronization is running
+        """
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self):
+        """Start writing metrics to the metrics directory periodically in a background thread
+        """
+        if self.is_running:
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='ampho-metrics-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop background synchronization
+        """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def _before_request(self):
+        g.ampho_request_started = perf_counter()
+
+    def _after_request(self, response: Response) -> Response:
+        started = g.get('ampho_request_started')
+        if started is None:
+            return response
+
+        duration = perf_counter() - started
+        endpoint = request.endpoint or ''
+        key = (endpoint, request.method)
+
+        hist = self.latency.get(key)
+        if hist is None:
+            hist = self.latency[key] = Histogram()
+        hist.observe(duration)
+
+        r_key = key + (response.status_code,)
+        self.responses[r_key] = self.responses.get(r_key, 0) + 1
+
+        return response
+
+    @property
+    def file_path(self) -> str:
+        """Location of the current process metrics file
+        """
+        return os.path.join(self.dir_path, f'{self._file_id}.json')
+
+    def sync(self):
+        """Write metrics of the current process to the metrics directory
+        """
+        tmp_path = os.path.join(self.dir_path, f'.{self._file_id}.json.tmp')
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump([fam.as_dict() for fam in self.collect_local()], f)
+            os.replace(tmp_path, self.file_path)
+        except OSError as e:
+            logging.warning('Cannot write metrics to %s: %s', self.dir_path, e)
+
+    def collect_local(self) -> List[MetricFamily]:
+        """Collect metrics of the current process
+        """
+        requests = MetricFamily('ampho_http_requests_total', 'counter', 'HTTP responses by endpoint and status.')
+        for (endpoint, method, status), n in list(self.responses.items()):
+            requests.add(n, endpoint=endpoint, method=method, status=status)
+
+        latency = MetricFamily('ampho_http_request_duration_seconds', 'histogram', 'HTTP request latency.')
+        for (endpoint, method), hist in list(self.latency.items()):
+            latency.add_histogram(hist, endpoint=endpoint, method=method)
+
+        families = [requests, latency]
+        families.extend(self._collect_ampho())
+        self.on_collect.send(self.ampho.app, families=families)
+
+        return families
+
+    def _collect_ampho(self) -> List[MetricFamily]:
+        ampho = self.ampho
+        r = [
+            MetricFamily('ampho_process_start_time_seconds', 'gauge', 'Start time of the process.').add(self.started),
+        ]
+
+        security = ampho.security
+        if security:
+            stats = security.token_cache.stats()
+            r.append(MetricFamily('ampho_token_cache_size', 'gauge', 'Verified tokens cached.').add(stats['size']))
+            for k in ('hits', 'misses', 'evictions'):
+                r.append(MetricFamily(f'ampho_token_cache_{k}_total', 'counter', f'Token cache {k}.').add(stats[k]))
+
+        if ampho.async_logging:
+            stats = ampho.async_logging.stats()
+            r.append(MetricFamily('ampho_log_queue_size', 'gauge', 'Log records waiting to be written.')
+                     .add(stats['queue_size']))
+            r.append(MetricFamily('ampho_log_dropped_total', 'counter', 'Log records dropped due to queue overflow.')
+                     .add(stats['dropped']))
+
+        db = ampho.db
+        if db:
+            checked_out = MetricFamily('ampho_db_pool_checked_out', 'gauge', 'Connections in use.')
+            size = MetricFamily('ampho_db_pool_size', 'gauge', 'Connection pool size.')
+            overflow = MetricFamily('ampho_db_pool_overflow', 'gauge', 'Connections above the pool size.')
+            timeouts = MetricFamily('ampho_db_pool_timeouts_total', 'counter', 'Connection checkout timeouts.')
+            wait = MetricFamily('ampho_db_pool_wait_seconds', 'histogram', 'Connection checkout time.')
+            for url, stats in db.pool_stats().items():
+                if 'size' in stats:
+                    checked_out.add(stats['checked_out'], url=url)
+                    size.add(stats['size'], url=url)
+                    overflow.add(stats['overflow'], url=url)
+            for engine in list(db.engines):
+                if hasattr(engine.pool, 'wait_time'):
+                    timeouts.add(engine.pool.timeouts, url=repr(engine.url))
+                    wait.add_histogram(engine.pool.wait_time, url=repr(engine.url))
+            r.extend((checked_out, size, overflow, timeouts, wait))
+
+            if db.query_stats:
+                r.append(MetricFamily('ampho_db_queries_per_request', 'histogram', 'Database queries per request.')
+                         .add_histogram(db.query_stats.request_queries))
+                duration = MetricFamily('ampho_db_query_duration_seconds', 'histogram', 'Database query latency.')
+                hist = Histogram()
+                for s in list(db.query_stats.statements.values()):
+                    hist.merge(s.latency)
+                r.append(duration.add_histogram(hist))
+
+        if ampho.cache:
+            stats = ampho.cache.stats()
+            r.append(MetricFamily('ampho_cache_size', 'gauge', 'Cached values.').add(stats['size']))
+            for k in ('hits', 'misses', 'evictions', 'invalidations'):
+                r.append(MetricFamily(f'ampho_cache_{k}_total', 'counter', f'Cache {k}.').add(stats[k]))
+
+        if ampho.tasks:
+            stats = ampho.tasks.stats()
+            r.append(MetricFamily('ampho_tasks_pending', 'gauge', 'Background tasks queued or running.')
+                     .add(stats['pending']))
+            for k in ('submitted', 'completed', 'failed', 'timed_out', 'rejected', 'cancelled'):
+                r.append(MetricFamily(f'ampho_tasks_{k}_total', 'counter', f'Background tasks {k}.').add(stats[k]))
+
+        return r
+
+    def collect(self) -> List[MetricFamily]:
+        """Collect metrics of all processes
+        """
+        local = self.collect_local()
+        if not self.dir_path:
+            return local
+
+        families = {}  # type: Dict[str, MetricFamily]
+        merge(families, local, os.getpid())
+
+        for entry in os.scandir(self.dir_path):
+            name, ext = os.path.splitext(entry.name)
+            pid = name.partition('-')[0]
+            if ext != '.json' or not pid.isdigit() or name == self._file_id:
+                continue
+
+            try:
+                with open(entry.path) as f:
+                    other = [MetricFamily.from_dict(d) for d in json.load(f)]
+            except (OSError, ValueError) as e:
+                logging.warning('Cannot read metrics from %s: %s', entry.path, e)
+                continue
+
+            # Gauges of finished processes are meaningless, while their counters still count
+            if not _pid_alive(int(pid)):
+                other = [fam for fam in other if fam.type != 'gauge']
+
+            merge(families, other, int(pid))
+
+        return list(families.values())
+
+    def view(self) -> Response:
+        """Metrics endpoint
+
+        If ``AMPHO_METRICS_TOKEN`` is set, requests must have it as a bearer token.
+        """
+        if self.token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            abort(401)
+
+        return Response(render(self.collect()), content_type=CONTENT_TYPE)
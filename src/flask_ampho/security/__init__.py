@@ -6,3 +6,4 @@ __license__ = 'MIT'
 
 from .security import Security
 from .api import authorize
+from .rate_limit import rate_limit
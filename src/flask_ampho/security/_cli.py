@@ -8,12 +8,64 @@ import click
 from flask import current_app
 from jwcrypto.jwk import JWK
 from flask_ampho import Ampho
+from flask_ampho.util import secho_success, secho_warning, secho_error
+from .error import InvalidTokenError
+from .revocation import MemoryBackend
 
 ampho = current_app.extensions['ampho']  # type: Ampho
 
+_KEY_PARAMS = {
+    'oct': {'size': 256},
+    'RSA': {'size': 2048},
+    'EC': {'crv': 'P-256'},
+    'OKP': {'crv': 'Ed25519'},
+}
+
 
 @ampho.cli.command()
-def sec_gen_key():
+@click.option('-t', '--kty', type=click.Choice(list(_KEY_PARAMS)), default='oct', help='Key type')
+@click.option('-s', '--size', type=int, help='Key size in bits, for oct and RSA keys')
+@click.option('-c', '--crv', help='Curve name, for EC and OKP keys')
+@click.option('-k', '--kid', help='Key ID, defaults to the key thumbprint')
+def sec_gen_key(kty: str, size: int, crv: str, kid: str):
     """Generate a JSON web key
     """
-    click.echo(JWK.generate(kty="oct", size=256).export())
+    params = dict(_KEY_PARAMS[kty])
+    if size and 'size' in params:
+        params['size'] = size
+    if crv and 'crv' in params:
+        params['crv'] = crv
+
+    jwk = JWK.generate(kty=kty, **params)
+    if kid or kty != 'oct':
+        jwk = JWK(kid=kid or jwk.thumbprint(), **jwk.export(as_dict=True))
+
+    click.echo(jwk.export())
+
+
+@ampho.cli.command()
+@click.argument('token')
+@click.option('-e', '--exp', type=int, help='Token expiration timestamp, if TOKEN is a token ID')
+def sec_revoke(token: str, exp: int):
+    """Revoke a token or a token ID
+    """
+    security = current_app.extensions['ampho'].security
+    jti = token
+    if token.count('.') == 2:
+        try:
+            claims = security.verify_jwt(token)
+        except InvalidTokenError as e:
+            secho_error(f'Cannot revoke token: {e}')
+            return
+
+        if not claims.get('jti'):
+            secho_error('Token has no ID and cannot be revoked')
+            return
+
+        jti, exp = claims['jti'], claims.get('exp')
+
+    if isinstance(security.revocations.backend, MemoryBackend):
+        secho_warning('Revocation backend is in-process, revoked token will not be seen by running application')
+
+    security.revoke(jti, exp)
+    secho_success(f'Token revoked: {jti}')
@@ -6,17 +6,17 @@ __license__ = 'MIT'
 
 import logging
 from typing import Callable, Optional
-
-from json import loads
-from flask import current_app, request, abort
+from functools import wraps
+from flask import current_app, request, abort, g
 from flask_ampho import Ampho
-from jwcrypto.jwt import JWT
+from .error import InvalidTokenError
 
 
 def authorize(f: Callable):
     """Authorization decorator to use in request handlers
     """
 
+    @wraps(f)
     def deco(*args, **kwargs):
         ampho = current_app.extensions['ampho']  # type: Ampho
         auth = request.headers.get('Authorization')  # type: Optional[str]
@@ -28,12 +28,11 @@ def authorize(f: Callable):
             abort(401)
 
         try:
-            t = JWT(jwt=bearer[1], key=ampho.security.jwk)
-            kwargs['auth'] = loads(t.claims)
-            return f(*args, **kwargs)
-
-        except Exception as e:
-            logging.error(e)
+            kwargs['auth'] = g.ampho_auth = ampho.security.verify_jwt(bearer[1])
+        except InvalidTokenError as e:
+            logging.warning('Invalid token: %s', e)
             abort(401)
 
+        return f(*args, **kwargs)
+
     return deco
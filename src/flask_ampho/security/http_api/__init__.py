@@ -1,19 +1,26 @@
-"""
+"""Ampho Security HTTP API
 """
 __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from flask import current_app
 from flask_restful import Api
 from flask_ampho import Ampho
+from flask_ampho.json_codec import output_json
 from .login import Login
 from .renew import Renew
+from .keys import Keys
+
 
-ampho = current_app.extensions['ampho']  # type: Ampho
+def init_api(ampho: Ampho) -> Api:
+    """Register security HTTP API resources
+    """
+    prefix = ampho.settings.security_rest_prefix
 
-PREFIX = ampho.get_config('AMPHO_SECURITY_REST_PREFIX', '/api/security')
+    api_v1 = Api(ampho.app, f'{prefix}/1')
+    api_v1.representations['application/json'] = output_json
+    api_v1.add_resource(Login, '/login')
+    api_v1.add_resource(Renew, '/renew')
+    api_v1.add_resource(Keys, '/keys')
 
-api_v1 = Api(current_app, f'{PREFIX}/1')
-api_v1.add_resource(Login, '/login')
-api_v1.add_resource(Renew, '/renew')
+    return api_v1
@@ -0,0 +1,21 @@
+"""Keys HTTP API Resource
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from flask import current_app
+from flask_restful import Resource
+from flask_ampho import Ampho
+
+
+class Keys(Resource):
+    """Public keys in the JWKS format
+    """
+
+    def get(self):
+        """GET method handler
+        """
+        ampho = current_app.extensions['ampho']  # type: Ampho
+
+        return ampho.security.keys.export_public()
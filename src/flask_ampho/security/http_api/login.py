@@ -4,33 +4,54 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import logging
 from flask import current_app
-from flask_restful import Resource
+from flask_restful import Resource, abort
 from flask_restful.reqparse import RequestParser
 from flask_ampho import Ampho
-from flask_ampho.security import make_jwt
-
-ampho = current_app.extensions['ampho']  # type: Ampho
+from flask_ampho.auth.error import HashingPoolBusyError, UnsupportedHashError
+from flask_ampho.security.signer import Token
+from flask_ampho.security.rate_limit import rate_limit
 
 p = RequestParser()
-p.add_argument('login')
-p.add_argument('password')
+p.add_argument('login', required=True)
+p.add_argument('password', required=True)
+
+
+def token_response(t: Token) -> dict:
+    """Make a token response body
+    """
+    return {
+        'token': t.serialize(),
+        'ttl': t.validity,
+        'leeway': t.leeway,
+        'starts': t.claims['nbf'],
+        'expires': t.claims['exp'],
+    }
 
 
 class Login(Resource):
     """Login resource
     """
 
+    @rate_limit('login')
     def post(self):
         """POST method handler
         """
+        ampho = current_app.extensions['ampho']  # type: Ampho
         args = p.parse_args()
-        t, claims = make_jwt({'login': args.get('login')})
-
-        return {
-            'token': t.serialize(),
-            'ttl': t.validity,
-            'leeway': t.leeway,
-            'starts': claims['nbf'],
-            'expires': claims['exp'],
-        }
+
+        try:
+            user = ampho.security.users.authenticate(args['login'], args['password'])
+        except HashingPoolBusyError:
+            abort(503, message='Service is busy, try again later')
+        except UnsupportedHashError as e:
+            logging.error('Cannot verify password of user %s: %s', args['login'], e)
+            user = None
+
+        if not user:
+            abort(401, message='Invalid login or password')
+
+        t, _ = ampho.security.make_jwt({'login': user['login']})
+
+        return token_response(t)
@@ -4,16 +4,23 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+from flask import current_app
 from flask_restful import Resource
-from flask_ampho.security import authorize, make_jwt
+from flask_ampho import Ampho
+from flask_ampho.security import authorize, rate_limit
+from .login import token_response
 
 
 class Renew(Resource):
     """Renew HTTP API Recource
     """
 
+    @rate_limit('renew')
     @authorize
     def post(self, auth: dict):
         """POST method handler
         """
-        return make_jwt(auth)
+        ampho = current_app.extensions['ampho']  # type: Ampho
+        t, _ = ampho.security.make_jwt(auth)
+
+        return token_response(t)
@@ -0,0 +1,125 @@
+"""Ampho Security Key Set
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Any, Dict, Iterable, List, Optional
+from collections import OrderedDict
+from jwcrypto.jwk import JWK
+from .error import SecurityError
+
+_KTY_ALGS = {
+    'oct': ['HS256', 'HS384', 'HS512'],
+    'RSA': ['RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512'],
+    'EC': ['ES256', 'ES384', 'ES512'],
+    'OKP': ['EdDSA'],
+}
+
+_CRV_ALGS = {
+    'P-256': 'ES256',
+    'P-384': 'ES384',
+    'P-521': 'ES512',
+}
+
+
+def key_algs(jwk: JWK) -> List[str]:
+    """Get signing algorithms allowed for a key
+    """
+    if jwk.get('alg'):
+        return [jwk.get('alg')]
+
+    return _KTY_ALGS.get(jwk.get('kty'), [])
+
+
+def default_key_alg(jwk: JWK) -> str:
+    """Get default signing algorithm for a key
+    """
+    if jwk.get('alg'):
+        return jwk.get('alg')
+
+    if jwk.get('kty') == 'EC':
+        return _CRV_ALGS.get(jwk.get('crv'), 'ES256')
+
+    algs = _KTY_ALGS.get(jwk.get('kty'))
+    if not algs:
+        raise SecurityError(f"Unsupported key type: {jwk.get('kty')}")
+
+    return algs[0]
+
+
+class KeySet:
+    """Set of keys indexed by key ID
+
+    The active key is used to sign new tokens, all other keys are used only to verify tokens issued earlier.
+    """
+
+    def __init__(self, keys: Iterable[JWK], active_kid: Optional[str] = None):
+        """Init
+        """
+        self._keys = OrderedDict()  # type: Dict[str, JWK]
+        for jwk in keys:
+            self._keys[jwk.get('kid') or jwk.thumbprint()] = jwk
+
+        if not self._keys:
+            raise SecurityError('Key set is empty')
+
+        if active_kid is None:
+            active_kid = next(iter(self._keys))
+        elif active_kid not in self._keys:
+            raise SecurityError(f'Active key is not found in the key set: {active_kid}')
+
+        self.active_kid = active_kid
+
+    @classmethod
+    def from_config(cls, value: Any, active_kid: Optional[str] = None) -> 'KeySet':
+        """Create a key set from a single JWK, a list of JWKs or a JWKS object
+        """
+        if isinstance(value, dict):
+            value = value['keys'] if 'keys' in value else [value]
+
+        if not isinstance(value, list):
+            raise SecurityError('Key must be a JWK object, a list of JWK objects or a JWKS object')
+
+        return cls([v if isinstance(v, JWK) else JWK(**v) for v in value], active_kid)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys.values())
+
+    def __contains__(self, kid: str) -> bool:
+        return kid in self._keys
+
+    @property
+    def active(self) -> JWK:
+        """Active key getter
+        """
+        return self._keys[self.active_kid]
+
+    def get(self, kid: Optional[str]) -> Optional[JWK]:
+        """Get a key by its ID
+
+        If the key ID is omitted, the active key is returned.
+        """
+        if kid is None:
+            return self.active
+
+        return self._keys.get(kid)
+
+    def export_public(self) -> dict:
+        """Export public parts of asymmetric keys as a JWKS object
+        """
+        keys = []
+        for kid, jwk in self._keys.items():
+            if jwk.get('kty') == 'oct':
+                continue
+
+            k = jwk.export_public(as_dict=True)
+            k['kid'] = kid
+            k.setdefault('alg', default_key_alg(jwk))
+            k.setdefault('use', 'sig')
+            keys.append(k)
+
+        return {'keys': keys}
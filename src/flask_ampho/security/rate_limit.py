@@ -0,0 +1,261 @@
+"""Ampho Rate Limiting
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from time import time
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+from flask_ampho import Ampho
+from flask_ampho.error import ConfigurationError
+from flask_ampho.settings import declare
+
+Limit = Tuple[int, float]
+
+declare('AMPHO_SECURITY_RATE_LIMIT_IP', str, '30/60')
+declare('AMPHO_SECURITY_RATE_LIMIT_LOGIN', str, '10/60')
+declare('AMPHO_SECURITY_RATE_LIMIT_STORE', str, 'memory', lambda v: v in ('memory', 'sqlite'))
+declare('AMPHO_SECURITY_RATE_LIMIT_FILE')
+
+
+def parse_limit(value: Optional[str]) -> Optional[Limit]:
+    """Parse a limit definition like ``10/60``, i. e. 10 requests per 60 seconds
+    """
+    if not value:
+        return None
+
+    try:
+        n, period = str(value).split('/')
+        limit = int(n), float(period)
+    except ValueError:
+        raise ConfigurationError(f'Invalid rate limit: {value}')
+
+    if limit[0] <= 0 or limit[1] <= 0:
+        raise ConfigurationError(f'Invalid rate limit: {value}')
+
+    return limit
+
+
+class RateLimitStore:
+    """Base class of token bucket stores
+    """
+
+    def consume(self, key: str, limit: Limit, now: float) -> float:
+        """Take a token from a bucket
+
+        Returns ``0`` if the token was taken, or number of seconds to wait until a token will be available.
+        """
+        raise NotImplementedError()
+
+
+def _refill(state: Optional[Tuple[float, float]], limit: Limit, now: float) -> float:
+    capacity, period = limit
+    if state is None:
+        return float(capacity)
+
+    tokens, ts = state[:2]
+
+    return min(float(capacity), tokens + (now - ts) * capacity / period)
+
+
+def _take(tokens: float, limit: Limit) -> Tuple[float, float]:
+    if tokens >= 1:
+        return tokens - 1, 0.0
+
+    return tokens, (1 - tokens) * limit[1] / limit[0]
+
+
+class MemoryStore(RateLimitStore):
+    """In-process store
+
+    Buckets are kept in least recently used order along with their limits. If there are more than ``max_keys``
+    buckets, the least recently used ones are evicted, which costs the same for every request, so a spray of requests
+    with distinct keys does not turn the limiter into a CPU sink. Buckets which are full again carry no information
+    and are pruned from the least recently used end at most once per ``prune_interval`` seconds.
+    """
+
+    def __init__(self, max_keys: int = 100000, prune_interval: float = 60.0):
+        """Init
+        """
+        self.max_keys = max_keys
+        self.prune_interval = prune_interval
+        self._buckets = OrderedDict()  # type: OrderedDict[str, Tuple[float, float, Limit]]
+        self._lock = threading.Lock()
+        self._pruned = 0.0
+
+    def consume(self, key: str, limit: Limit, now: float) -> float:
+        """Take a token from a bucket
+        """
+        with self._lock:
+            tokens = _refill(self._buckets.pop(key, None), limit, now)
+            tokens, wait = _take(tokens, limit)
+            self._buckets[key] = (tokens, now, limit)
+
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(False)
+
+            if now - self._pruned >= self.prune_interval:
+                self._prune(now)
+
+        return wait
+
+    def _prune(self, now: float):
+        self._pruned = now
+        while self._buckets:
+            key, state = next(iter(self._buckets.items()))
+            if _refill(state, state[2], now) < state[2][0]:
+                break
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SqliteStore(RateLimitStore):
+    """SQLite store shared by all processes on a host
+
+    Each bucket row stores the time it becomes full again. Such buckets carry no information and are deleted by each
+    process at most once per ``prune_interval`` seconds, so a spray of requests with distinct keys does not grow the
+    table without limit.
+    """
+
+    def __init__(self, file_path: str, prune_interval: float = 60.0):
+        """Init
+        """
+        self.file_path = file_path
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._pruned = 0.0
+        os.makedirs(os.path.dirname(file_path), 0o755, True)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Get a connection of the current thread and process
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.file_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(key TEXT PRIMARY KEY, tokens REAL, ts REAL, full_at REAL)')
+
+            # Files created by previous versions lack the column, their rows are pruned at once
+            if 'full_at' not in [r[1] for r in conn.execute('PRAGMA table_info(buckets)')]:
+                conn.execute('ALTER TABLE buckets ADD COLUMN full_at REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)')
+
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def consume(self, key: str, limit: Limit, now: float) -> float:
+        """Take a token from a bucket
+        """
+        capacity, period = limit
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = conn.execute('SELECT tokens, ts FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(state, limit, now)
+            tokens, wait = _take(tokens, limit)
+            full_at = now + (capacity - tokens) * period / capacity
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, ts, full_at) VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, full_at))
+
+            if now - self._pruned >= self.prune_interval:
+                conn.execute('DELETE FROM buckets WHERE full_at IS NULL OR full_at <= ?', (now,))
+                self._pruned = now
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return wait
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM buckets').fetchone()[0]
+
+
+class RateLimiter:
+    """Token bucket rate limiter
+    """
+
+    def __init__(self, store: RateLimitStore, ip_limit: Optional[Limit] = None, login_limit: Optional[Limit] = None):
+        """Init
+        """
+        self.store = store
+        self.ip_limit = ip_limit
+        self.login_limit = login_limit
+
+    def hit(self, scope: str, ip: Optional[str] = None, login: Optional[str] = None) -> float:
+        """Register a request
+
+        Returns ``0`` if the request is allowed, or number of seconds to wait otherwise.
+        """
+        now = time()
+        wait = 0.0
+
+        if ip and self.ip_limit:
+            wait = max(wait, self.store.consume(f'{scope}:ip:{ip}', self.ip_limit, now))
+
+        if login and self.login_limit:
+            wait = max(wait, self.store.consume(f'{scope}:login:{login}', self.login_limit, now))
+
+        return wait
+
+
+def make_rate_limiter(ampho: Ampho) -> RateLimiter:
+    """Create a rate limiter from configuration
+    """
+    settings = ampho.settings
+    if settings.security_rate_limit_store == 'sqlite':
+        default_path = os.path.join(ampho.app.instance_path, 'ampho', 'rate-limit.sqlite')
+        store = SqliteStore(settings.security_rate_limit_file or default_path)
+    else:
+        store = MemoryStore()
+
+    return RateLimiter(
+        store,
+        parse_limit(settings.security_rate_limit_ip),
+        parse_limit(settings.security_rate_limit_login),
+    )
+
+
+def rate_limit(scope: str) -> Callable:
+    """Rate limiting decorator to use in request handlers
+
+    Requests are limited per client IP address and per the ``login`` request argument, if present. Limited requests
+    get the 429-response with the ``Retry-After`` header.
+    """
+
+    def decorator(f: Callable):
+        @wraps(f)
+        def deco(*args, **kwargs):
+            ampho = current_app.extensions['ampho']  # type: Ampho
+            limiter = ampho.security.rate_limiter
+
+            if limiter:
+                login = request.values.get('login')
+                if login is None and request.is_json:
+                    body = request.get_json(silent=True)
+                    login = body.get('login') if isinstance(body, dict) else None
+
+                wait = limiter.hit(scope, request.remote_addr, str(login) if login is not None else None)
+                if wait:
+                    raise TooManyRequests('Too many requests, try again later', retry_after=math.ceil(wait))
+
+            return f(*args, **kwargs)
+
+        return deco
+
+    return decorator
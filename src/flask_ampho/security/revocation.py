@@ -0,0 +1,368 @@
+"""Ampho Token Revocation
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import mmap
+import math
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from time import time
+from hashlib import blake2b
+from threading import Event, Lock, Thread
+from .error import SecurityError
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+Entries = List[Tuple[str, int]]
+
+
+class BloomFilter:
+    """Bloom filter
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """Init
+        """
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.n_bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.n_hashes = max(int(round(self.n_bits / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        d = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], 'little')
+        h2 = int.from_bytes(d[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.n_bits for i in range(self.n_hashes))
+
+    def add(self, item: str):
+        """Add an item
+        """
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+
+class RevocationBackend:
+    """Base class of revocation storage backends
+
+    Backends keep an append-only log of revoked token IDs. Each process pulls log entries added since its last
+    synchronization using an opaque cursor.
+    """
+
+    def add(self, jti: str, exp: int):
+        """Store a revoked token ID
+        """
+        raise NotImplementedError()
+
+    def fetch(self, cursor: Any = None) -> Tuple[Entries, Any]:
+        """Get entries added after the cursor and a new cursor
+
+        A cursor of ``None`` means fetching all stored entries. Entries may be returned more than once.
+        """
+        raise NotImplementedError()
+
+
+class MemoryBackend(RevocationBackend):
+    """In-process revocation backend
+    """
+
+    def __init__(self):
+        """Init
+        """
+        self._entries = []  # type: Entries
+
+    def add(self, jti: str, exp: int):
+        """Store a revoked token ID
+        """
+        self._entries.append((jti, exp))
+
+    def fetch(self, cursor: Any = None) -> Tuple[Entries, Any]:
+        """Get entries added after the cursor and a new cursor
+        """
+        cursor = cursor or 0
+        entries = self._entries[cursor:]
+
+        return entries, cursor + len(entries)
+
+
+class DbBackend(RevocationBackend):
+    """SQLAlchemy table revocation backend
+
+    IDs are assigned before commit, so a row may become visible after rows with greater IDs were already fetched. To
+    not miss such rows, each fetch re-reads ``overlap`` IDs below the cursor, and callers skip known entries.
+    """
+
+    def __init__(self, engine, overlap: int = 1000):
+        """Init
+        """
+        from flask_ampho.auth.tables import revoked_tokens
+        self.engine = engine
+        self.overlap = overlap
+        self.table = revoked_tokens
+
+    def add(self, jti: str, exp: int):
+        """Store a revoked token ID
+        """
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(t.delete().where(t.c.exp < int(time())))
+            if conn.execute(t.select().where(t.c.jti == jti)).first() is None:
+                conn.execute(t.insert().values(jti=jti, exp=exp))
+
+    def fetch(self, cursor: Any = None) -> Tuple[Entries, Any]:
+        """Get entries added after the cursor and a new cursor
+
+        Entries fetched before may be returned again.
+        """
+        t = self.table
+        q = t.select().where(t.c.exp >= int(time())).order_by(t.c.id)
+        if cursor is not None:
+            q = q.where(t.c.id > cursor - self.overlap)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(q).fetchall()
+
+        return [(r.jti, r.exp) for r in rows], max(rows[-1].id, cursor or 0) if rows else cursor
+
+
+class FileBackend(RevocationBackend):
+    """Append-only file revocation backend
+
+    The file is shared by all processes on a host. New entries are appended atomically and read through a memory map
+    starting from the last known offset. When the file grows twice as large as after the previous compaction, it is
+    replaced by a file containing only entries which are not expired yet. Compaction requires ``fcntl``.
+    """
+
+    def __init__(self, file_path: str, compact_size: int = 1048576):
+        """Init
+
+        :param compact_size: minimal file size in bytes to compact the file at.
+        """
+        self.file_path = file_path
+        self.compact_size = compact_size
+        self._compact_at = compact_size
+        os.makedirs(os.path.dirname(file_path), 0o755, True)
+
+    def _open_locked(self) -> int:
+        # The file may be replaced by compaction while waiting for the lock
+        while True:
+            fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            if fcntl is None:
+                return fd
+
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.file_path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def add(self, jti: str, exp: int):
+        """Store a revoked token ID
+        """
+        if not jti or any(c.isspace() for c in jti):
+            raise SecurityError(f'Invalid token ID: {jti!r}')
+
+        fd = self._open_locked()
+        try:
+            os.write(fd, f'{jti} {exp}\n'.encode())
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+
+        if fcntl is not None and size >= self._compact_at:
+            self.compact()
+
+    def compact(self):
+        """Replace the file with a file containing only entries which are not expired
+        """
+        fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_ino != os.stat(self.file_path).st_ino:
+                # Already compacted by another process
+                return
+
+            entries, _ = self.fetch()
+            tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(f'{jti} {exp}\n' for jti, exp in entries)
+                size = f.tell()
+            os.replace(tmp_path, self.file_path)
+        finally:
+            os.close(fd)
+
+        self._compact_at = max(self.compact_size, size * 2)
+
+    def fetch(self, cursor: Any = None) -> Tuple[Entries, Any]:
+        """Get entries added after the cursor and a new cursor
+
+        The cursor is a pair of the file's inode number and read offset, so the file can be replaced by a compacted one.
+        """
+        try:
+            f = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return [], cursor
+
+        with f:
+            st = os.fstat(f.fileno())
+            offset = cursor[1] if cursor and cursor[0] == st.st_ino and cursor[1] <= st.st_size else 0
+            if st.st_size == offset:
+                return [], (st.st_ino, offset)
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                end = m.rfind(b'\n', offset) + 1
+                data = m[offset:end] if end > offset else b''
+
+        now = int(time())
+        entries = []
+        for line in data.split(b'\n'):
+            try:
+                jti, exp = line.decode().split()
+                if int(exp) >= now:
+                    entries.append((jti, int(exp)))
+            except ValueError:
+                continue
+
+        return entries, (st.st_ino, offset + len(data))
+
+
+class RevocationList:
+    """Revoked tokens list
+
+    Token IDs are checked against an in-process Bloom filter first, so checking a non-revoked token costs a single
+    filter probe. The exact set is consulted only on a filter hit. New entries are pulled from the backend by a
+    background thread once per synchronization interval, so checks never wait for the backend. A zero interval means
+    synchronization on every check.
+    """
+
+    def __init__(self, backend: RevocationBackend, capacity: int = 10000, error_rate: float = 0.001,
+                 sync_interval: float = 5.0):
+        """Init
+        """
+        self.backend = backend
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._revoked = {}  # type: Dict[str, int]
+        self._cursor = None
+        self._lock = Lock()
+
+        self._thread = None  # type: Optional[Thread]
+        self._stop = Event()
+        self._at_fork_registered = False
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    @property
+    def is_running(self) -> bool:
+        """Check whether background synchronization is running
+        """
+        return bool(self._thread and self._thread.is_alive())
+
+    def _add(self, jti: str, exp: int):
+        if jti in self._revoked:
+            return
+
+        self._revoked[jti] = exp
+        if len(self._revoked) > self._bloom.capacity:
+            self._rebuild()
+        else:
+            self._bloom.add(jti)
+
+    def _rebuild(self):
+        now = int(time())
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp >= now}
+
+        bloom = BloomFilter(max(self._bloom.capacity, len(self._revoked) * 2), self.error_rate)
+        for jti in self._revoked:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def sync(self):
+        """Pull new entries from the backend
+        """
+        if not self._lock.acquire(False):
+            return
+
+        try:
+            entries, self._cursor = self.backend.fetch(self._cursor)
+            for jti, exp in entries:
+                self._add(jti, exp)
+
+        except Exception as e:
+            logging.warning('Cannot synchronize revoked tokens: %s', e)
+
+        finally:
+            self._lock.release()
+
+    def start(self):
+        """Synchronize and start synchronizing periodically in a background thread
+        """
+        self.sync()
+        if self.is_running or not self.sync_interval:
+            return
+
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='ampho-revocation-sync', daemon=True)
+        self._thread.start()
+
+        # Threads do not survive fork, so restart synchronization in child processes
+        if not self._at_fork_registered and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._at_fork_registered = True
+
+    def stop(self):
+        """Stop background synchronization
+        """
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+
+    def _after_fork(self):
+        if self._thread is not None:
+            self._thread = None
+            self._lock = Lock()
+            self.start()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def revoke(self, jti: str, exp: int):
+        """Revoke a token by its ID
+        """
+        self.backend.add(jti, exp)
+        with self._lock:
+            self._add(jti, exp)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """Check whether a token is revoked
+        """
+        if not self.sync_interval:
+            self.sync()
+
+        if not jti or jti not in self._bloom:
+            return False
+
+        return jti in self._revoked
@@ -4,13 +4,40 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from typing import Tuple, List
+from typing import Tuple, List, Iterable, Optional
+from os import path
 from time import time
+from uuid import uuid4
 from jwcrypto.jwk import JWK
 from jwcrypto.jwt import JWT
+from jwcrypto.common import base64url_decode
 from flask import Flask
 from flask_ampho import Ampho
+from flask_ampho.error import ConfigurationError
+from flask_ampho.settings import declare, as_bool, as_json
 from flask_ampho.util import secho_warning
+from flask_ampho.auth.users import UserStore
+from .error import InvalidTokenError
+from .token_cache import TokenCache
+from .signer import Signer, Token
+from .keys import KeySet, key_algs, default_key_alg
+from .revocation import RevocationList, RevocationBackend, MemoryBackend, DbBackend, FileBackend
+from .rate_limit import RateLimiter, make_rate_limiter
+
+declare('AMPHO_SECURITY_KEY', as_json)
+declare('AMPHO_SECURITY_KEY_ID')
+declare('AMPHO_SECURITY_TOKEN_ALG')
+declare('AMPHO_SECURITY_TOKEN_TTL', int, 900, lambda v: v > 0)
+declare('AMPHO_SECURITY_TOKEN_LEEWAY', int, 60, lambda v: v >= 0)
+declare('AMPHO_SECURITY_TOKEN_CACHE_SIZE', int, 1024, lambda v: v >= 0)
+declare('AMPHO_SECURITY_REST', as_bool, True)
+declare('AMPHO_SECURITY_REST_PREFIX', str, '/api/security')
+declare('AMPHO_SECURITY_REVOCATION_BACKEND', str, 'memory', lambda v: v in ('memory', 'db', 'file'))
+declare('AMPHO_SECURITY_REVOCATION_FILE')
+declare('AMPHO_SECURITY_REVOCATION_CAPACITY', int, 10000, lambda v: v > 0)
+declare('AMPHO_SECURITY_REVOCATION_ERROR_RATE', float, 0.001, lambda v: 0 < v < 1)
+declare('AMPHO_SECURITY_REVOCATION_SYNC_INTERVAL', float, 5.0, lambda v: v >= 0)
+declare('AMPHO_SECURITY_RATE_LIMIT', as_bool, True)
 
 
 class Security:
@@ -20,47 +47,168 @@ class Security:
     def __init__(self, ampho: Ampho):
         """Init
         """
-        self.ampho = ampho
-
-        k = ampho.get_config_json('AMPHO_SECURITY_KEY')
-        if isinstance(k, dict):
-            self.jwk = JWK(**k)
+        settings = ampho.settings
 
-        if not self.jwk:
-            self.jwk = JWK.generate(kty="oct", size=256)
-            secho_warning("AMPHO_SECURITY_KEY is not set, Use 'ampho sec-gen-key' CLI command to generate a key.")
+        self.ampho = ampho
+        self.keys = None  # type: Optional[KeySet]
+        self._signer = None  # type: Optional[Signer]
+        self.token_cache = TokenCache(settings.security_token_cache_size)
+        self.users = UserStore(ampho)
+        self.rate_limiter = None  # type: Optional[RateLimiter]
+        if settings.security_rate_limit:
+            self.rate_limiter = make_rate_limiter(ampho)
+        self.revocations = RevocationList(
+            self._make_revocation_backend(),
+            settings.security_revocation_capacity,
+            settings.security_revocation_error_rate,
+            settings.security_revocation_sync_interval,
+        )
+        if not isinstance(self.revocations.backend, MemoryBackend):
+            self.revocations.start()
 
-        @ampho.db.on_get_migrations_packages.connect_via(ampho.app)
-        def on_db_get_migration_packages(sender: Flask, packages: List[str]):
-            packages.append('flask_ampho.auth')
+        self.load_keys()
+        ampho.on_config_changed.connect(self._on_config_changed)
 
         # Register CLI commands
         with ampho.app.app_context():
             from . import _cli
+            from ..auth import _cli
+
+        # Register HTTP API
+        self.api_v1 = None
+        if settings.security_rest:
+            from .http_api import init_api
+            self.api_v1 = init_api(ampho)
+
+    def _make_revocation_backend(self) -> RevocationBackend:
+        backend = self.ampho.settings.security_revocation_backend
+
+        if backend == 'memory':
+            return MemoryBackend()
+
+        if backend == 'db':
+            return DbBackend(self.ampho.db.sqlalchemy.get_engine(self.ampho.app))
+
+        if backend == 'file':
+            default_path = path.join(self.ampho.app.instance_path, 'ampho', 'revoked-tokens')
+            return FileBackend(self.ampho.settings.security_revocation_file or default_path)
+
+        raise ConfigurationError(f'Unknown AMPHO_SECURITY_REVOCATION_BACKEND: {backend}')
+
+    def _on_config_changed(self, sender: Flask, keys: Optional[Iterable[str]] = None):
+        if keys is None or {'AMPHO_SECURITY_KEY', 'AMPHO_SECURITY_KEY_ID'}.intersection(keys):
+            self.load_keys()
+
+    def load_keys(self):
+        """(Re)load the key set from configuration
+
+        Tokens signed by keys which are still present in the new key set remain valid.
+        """
+        settings = self.ampho.settings
+        k = settings.security_key
+        if k:
+            keys = KeySet.from_config(k, settings.security_key_id)
+        else:
+            keys = KeySet([JWK.generate(kty="oct", size=256)])
+            secho_warning("AMPHO_SECURITY_KEY is not set, Use 'ampho sec-gen-key' CLI command to generate a key.")
+
+        self.keys = keys
+        self._signer = None
+        self.token_cache.clear()
+
+    @property
+    def jwk(self) -> JWK:
+        """Active key getter
+        """
+        return self.keys.active
 
     @property
     def token_ttl(self) -> int:
         """Token TTL getter
         """
-        return self.ampho.get_config_int('AMPHO_SECURITY_TOKEN_TTL', 900)
+        return self.ampho.settings.security_token_ttl
+
+    @property
+    def token_leeway(self) -> int:
+        """Token leeway getter
+        """
+        return self.ampho.settings.security_token_leeway
 
     @property
     def token_alg(self) -> str:
         """Token algorithm getter
         """
-        return self.ampho.get_config('AMPHO_SECURITY_TOKEN_ALG', 'HS256')
+        return self.ampho.settings.security_token_alg or default_key_alg(self.keys.active)
+
+    @property
+    def signer(self) -> Signer:
+        """Token signer getter
+        """
+        alg = self.token_alg
+        signer = self._signer
+        if not signer or signer.alg != alg or signer.kid != self.keys.active_kid:
+            signer = self._signer = Signer(self.keys.active, alg, self.keys.active_kid)
+
+        return signer
 
-    def make_jwt(self, claims: dict) -> Tuple[JWT, dict]:
+    def make_jwt(self, claims: dict) -> Tuple[Token, dict]:
         """Make a signed token
         """
+        return self.make_jwt_many([claims])[0]
+
+    def make_jwt_many(self, claims_list: Iterable[dict]) -> List[Tuple[Token, dict]]:
+        """Make a batch of signed tokens
+        """
+        signer = self.signer
+        ttl = self.token_ttl
+        leeway = self.token_leeway
         now = int(time())
-        claims.update({
-            'nbf': now,
-            'exp': now + self.token_ttl
-        })
 
-        t = JWT(header={'alg': self.token_alg}, claims=claims)
-        t.validity = self.token_ttl
-        t.make_signed_token(key=self.jwk)
+        r = []
+        for claims in claims_list:
+            claims.update({
+                'jti': uuid4().hex,
+                'nbf': now,
+                'exp': now + ttl
+            })
+            r.append((Token(signer.sign(claims), claims, ttl, leeway), claims))
+
+        return r
 
-        return t, claims
+    def verify_jwt(self, token: str) -> dict:
+        """Verify a serialized token and get its claims
+        """
+        claims = self.token_cache.get(token)
+        if claims is None:
+            try:
+                header = self.ampho.json.loads(base64url_decode(token.split('.', 1)[0]))
+                jwk = self.keys.get(header.get('kid'))
+                if not jwk:
+                    raise InvalidTokenError(f"Unknown key ID: {header.get('kid')}")
+
+                jwt = JWT(algs=key_algs(jwk))
+                jwt.leeway = self.token_leeway
+                jwt.deserialize(token, jwk)
+                claims = self.ampho.json.loads(jwt.claims)
+            except InvalidTokenError:
+                raise
+            except Exception as e:
+                raise InvalidTokenError(e)
+
+            if not isinstance(claims, dict):
+                raise InvalidTokenError('Token claims must be an object')
+
+            self.token_cache.put(token, claims)
+
+        if self.revocations.is_revoked(claims.get('jti')):
+            raise InvalidTokenError('Token is revoked')
+
+        return dict(claims)
+
+    def revoke(self, jti: str, exp: Optional[int] = None):
+        """Revoke a token by its ID
+
+        If the token expiration time is unknown, the token is kept revoked for the maximum token lifetime. Expired tokens
+        are accepted within the leeway, so they are kept revoked that much longer.
+        """
+        self.revocations.revoke(jti, (exp or int(time()) + self.token_ttl) + self.token_leeway)
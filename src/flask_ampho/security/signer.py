@@ -0,0 +1,142 @@
+"""Ampho Token Signer
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import hmac
+import hashlib
+from typing import Callable, Optional
+from json import dumps
+from base64 import urlsafe_b64encode
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, ec
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from jwcrypto.jwk import JWK
+from jwcrypto.jws import JWS
+from jwcrypto.common import base64url_decode
+
+_HMAC_DIGESTS = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
+_HASHES = {
+    '256': hashes.SHA256,
+    '384': hashes.SHA384,
+    '512': hashes.SHA512,
+}
+
+
+def b64_encode(data: bytes) -> bytes:
+    """Encode bytes using unpadded URL safe base64
+    """
+    return urlsafe_b64encode(data).rstrip(b'=')
+
+
+def json_encode(data: dict) -> bytes:
+    """Encode a JOSE object using compact JSON
+    """
+    return dumps(data, separators=(',', ':'), sort_keys=True).encode()
+
+
+class Token:
+    """Signed token
+    """
+
+    def __init__(self, token: str, claims: dict, validity: int, leeway: int = 60):
+        """Init
+        """
+        self.token = token
+        self.claims = claims
+        self.validity = validity
+        self.leeway = leeway
+
+    def serialize(self) -> str:
+        """Get compact serialization of the token
+        """
+        return self.token
+
+
+class Signer:
+    """Compact JWS signer built once per key and algorithm
+
+    The protected header segment is encoded once and the signing context is prepared in advance, so issuing a token
+    takes a single payload encoding and a single signature operation. Algorithms which are not supported natively are
+    handled by jwcrypto.
+    """
+
+    def __init__(self, jwk: JWK, alg: str, kid: Optional[str] = None):
+        """Init
+        """
+        self.jwk = jwk
+        self.alg = alg
+        self.kid = kid
+
+        self.header = {'alg': alg}
+        if kid:
+            self.header['kid'] = kid
+
+        self._header_segment = b64_encode(json_encode(self.header))
+        self._sign = self._make_sign_fn()  # type: Optional[Callable[[bytes], bytes]]
+
+    @property
+    def is_native(self) -> bool:
+        """Whether the signer does not rely on jwcrypto
+        """
+        return self._sign is not None
+
+    def _make_sign_fn(self) -> Optional[Callable[[bytes], bytes]]:
+        kty = self.jwk.get('kty')
+        alg = self.alg
+
+        if alg in _HMAC_DIGESTS and kty == 'oct':
+            ctx = hmac.new(base64url_decode(self.jwk.get_op_key('sign')), digestmod=_HMAC_DIGESTS[alg])
+
+            def sign(data: bytes) -> bytes:
+                h = ctx.copy()
+                h.update(data)
+                return h.digest()
+
+            return sign
+
+        if alg[:2] in ('RS', 'PS') and alg[2:] in _HASHES and kty == 'RSA':
+            key = self.jwk.get_op_key('sign')
+            hash_alg = _HASHES[alg[2:]]()
+            if alg.startswith('RS'):
+                pad = padding.PKCS1v15()
+            else:
+                pad = padding.PSS(padding.MGF1(hash_alg), hash_alg.digest_size)
+
+            return lambda data: key.sign(data, pad, hash_alg)
+
+        if alg[:2] == 'ES' and alg[2:] in _HASHES and kty == 'EC':
+            key = self.jwk.get_op_key('sign', self.jwk.get('crv'))
+            sig_alg = ec.ECDSA(_HASHES[alg[2:]]())
+            size = (key.curve.key_size + 7) // 8
+
+            def sign(data: bytes) -> bytes:
+                r, s = decode_dss_signature(key.sign(data, sig_alg))
+                return r.to_bytes(size, 'big') + s.to_bytes(size, 'big')
+
+            return sign
+
+        if alg == 'EdDSA' and kty == 'OKP' and self.jwk.get('crv') in ('Ed25519', 'Ed448'):
+            return self.jwk.get_op_key('sign').sign
+
+        return None
+
+    def sign(self, claims: dict) -> str:
+        """Sign claims and get a compact serialized token
+        """
+        payload = json_encode(claims)
+
+        if self._sign is None:
+            jws = JWS(payload)
+            jws.add_signature(self.jwk, None, json_encode(self.header).decode())
+            return jws.serialize(True)
+
+        signing_input = self._header_segment + b'.' + b64_encode(payload)
+
+        return (signing_input + b'.' + b64_encode(self._sign(signing_input))).decode()
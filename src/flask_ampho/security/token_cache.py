@@ -0,0 +1,91 @@
+"""Ampho Verified Token Cache
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Optional, Dict
+from time import time
+from hashlib import sha256
+from threading import Lock
+from collections import OrderedDict
+
+
+class TokenCache:
+    """Bounded LRU cache of verified token claims
+
+    Entries are keyed by a digest of the raw token and expire at the token's own ``exp`` claim.
+    """
+
+    def __init__(self, size: int = 1024):
+        """Init
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # type: OrderedDict[bytes, tuple]
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Get claims of a previously verified token
+        """
+        if self.size <= 0:
+            return None
+
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] <= time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def put(self, token: str, claims: dict):
+        """Remember claims of a verified token
+        """
+        exp = claims.get('exp')
+        if self.size <= 0 or not isinstance(exp, int) or exp <= time():
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (exp, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get cache statistics
+        """
+        return {
+            'size': len(self._entries),
+            'max_size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
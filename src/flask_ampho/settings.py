@@ -0,0 +1,171 @@
+"""Ampho Settings
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+from .error import ConfigurationError
+
+
+def as_bool(v: Any) -> bool:
+    """Convert a config value to boolean
+    """
+    return str(v).lower() in ('1', 'yes', 'true')
+
+
+def as_json(v: Any) -> Any:
+    """Decode a JSON config value
+    """
+    return json.loads(v) if isinstance(v, str) else v
+
+
+def as_list(v: Any) -> Tuple[str, ...]:
+    """Convert a list or comma-separated string config value to tuple
+    """
+    if isinstance(v, str):
+        v = v.split(',')
+
+    return tuple(filter(bool, map(lambda x: str(x).strip(), v)))
+
+
+class Setting:
+    """Setting declaration
+    """
+    __slots__ = ('key', 'name', 'type', 'default', 'validator')
+
+    def __init__(self, key: str, type_: Callable = str, default: Any = None,
+                 validator: Optional[Callable[[Any], bool]] = None):
+        """Init
+        """
+        self.key = key
+        self.name = (key[6:] if key.startswith('AMPHO_') else key).lower()
+        self.type = type_
+        self.default = default
+        self.validator = validator
+
+    def resolve(self, value: Any) -> Any:
+        """Convert and validate a raw config value
+        """
+        if value is None:
+            return None
+
+        try:
+            value = self.type(value)
+        except (TypeError, ValueError) as e:
+            raise ConfigurationError(f'Invalid value of {self.key}: {e}')
+
+        if self.validator and not self.validator(value):
+            raise ConfigurationError(f'Invalid value of {self.key}: {value!r}')
+
+        return value
+
+
+_registry = OrderedDict()  # type: Dict[str, Setting]
+_version = 0
+_loaders = []  # type: List[Tuple[Tuple[str, ...], Callable[[], Any]]]
+
+
+def declare(key: str, type_: Callable = str, default: Any = None, validator: Optional[Callable[[Any], bool]] = None):
+    """Declare a setting
+
+    Declared settings are resolved once into a :class:`Settings` snapshot.
+    """
+    global _version
+
+    _registry[key] = Setting(key, type_, default, validator)
+    _version += 1
+
+
+def add_loader(loader: Callable[[], Any], prefixes: Iterable[str]):
+    """Register a callable importing modules which declare settings
+
+    Loaders are called once, when a setting which is not declared yet is requested and its name equals to or starts
+    with one of prefixes followed by an underscore, i. e. ``db`` covers ``settings.db_replicas``.
+    """
+    _loaders.append((tuple(prefixes), loader))
+
+
+def _run_loaders(name: str) -> bool:
+    for entry in list(_loaders):
+        prefixes, loader = entry
+        if any(name == p or name.startswith(p + '_') for p in prefixes):
+            _loaders.remove(entry)
+            loader()
+            return True
+
+    return False
+
+
+def version() -> int:
+    """Get version of declarations registry
+    """
+    return _version
+
+
+class Settings:
+    """Frozen settings snapshot
+
+    Values are available as attributes named after setting keys without the ``AMPHO_`` prefix in lower case, i. e.
+    ``AMPHO_SECURITY_TOKEN_TTL`` is available as ``settings.security_token_ttl``.
+    """
+    __slots__ = ('_keys', '_get_config')
+
+    def __getattr__(self, name: str) -> Any:
+        # The setting may be declared by a module which is not imported yet
+        while True:
+            for s in _registry.values():
+                if s.name == name:
+                    return s.resolve(self._get_config(s.key, s.default))
+
+            if not _run_loaders(name):
+                break
+
+        raise AttributeError(f'Unknown setting: {name}')
+
+    def __setattr__(self, key: str, value: Any):
+        raise AttributeError('Settings are read-only')
+
+    def __delattr__(self, key: str):
+        raise AttributeError('Settings are read-only')
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, self._keys[key])
+        except KeyError:
+            raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __repr__(self) -> str:
+        return f'<Settings {self.as_dict()!r}>'
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get settings as a dictionary
+        """
+        return {key: getattr(self, name) for key, name in self._keys.items()}
+
+
+_classes = {}  # type: Dict[Tuple[str, ...], type]
+
+
+def compile_settings(get_config: Callable[[str, Any], Any]) -> Settings:
+    """Resolve all declared settings into a snapshot
+    """
+    declarations = list(_registry.values())
+    names = tuple(s.name for s in declarations)
+
+    cls = _classes.get(names)
+    if cls is None:
+        cls = _classes[names] = type('Settings', (Settings,), {'__slots__': names})
+
+    obj = object.__new__(cls)
+    object.__setattr__(obj, '_keys', {s.key: s.name for s in declarations})
+    object.__setattr__(obj, '_get_config', get_config)
+    for s in declarations:
+        object.__setattr__(obj, s.name, s.resolve(get_config(s.key, s.default)))
+
+    return obj
@@ -0,0 +1,90 @@
+"""Ampho Statistics Primitives
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from typing import Any, Dict, Iterable, List
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """Fixed buckets histogram
+
+    Updates are not locked: under concurrent updates an increment may be rarely lost, which is acceptable for
+    statistics and keeps recording cheap.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        """Init
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """Record a value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: 'Histogram'):
+        """Add values of another histogram with the same buckets
+        """
+        if other.buckets != self.buckets:
+            raise ValueError('Cannot merge histograms with different buckets')
+
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it
+        """
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        acc = 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+
+        return float('inf')
+
+    @property
+    def mean(self) -> float:
+        """Mean value
+        """
+        return self.sum / self.count if self.count else 0.0
+
+    def cumulative(self) -> List[int]:
+        """Get cumulative counts of each bucket, the last one is the total count
+        """
+        r = []
+        acc = 0
+        for n in self.counts:
+            acc += n
+            r.append(acc)
+
+        return r
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get a summary
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.mean,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
@@ -0,0 +1,8 @@
+"""Ampho Tasks
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from .tasks import Tasks
+from .error import TaskError, TaskQueueFullError, TaskTimeoutError
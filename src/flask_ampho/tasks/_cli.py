@@ -0,0 +1,46 @@
+"""Ampho Tasks CLI Commands
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import signal
+import click
+from flask import current_app
+from flask_ampho import Ampho
+from flask_ampho.util import secho_error, secho_success
+
+ampho = current_app.extensions['ampho']  # type: Ampho
+
+
+@ampho.cli.command()
+@click.option('-b', '--burst', is_flag=True, help='Exit when the queue is empty')
+@click.option('-n', '--max-tasks', default=0, help='Exit after processing this number of tasks')
+@click.option('-p', '--poll-interval', type=float, help='Seconds between polls of the empty queue')
+@click.option('-i', '--id', 'worker_id', help='Worker ID, defaults to host:pid')
+def worker(burst: bool, max_tasks: int, poll_interval: float, worker_id: str):
+    """Run tasks from the durable queue
+    """
+    app_ampho = current_app.extensions['ampho']  # type: Ampho
+    if not app_ampho.settings.tasks_db:
+        secho_error('Durable task queue is disabled, set AMPHO_TASKS_DB to enable it')
+        raise SystemExit(1)
+
+    tasks = app_ampho.tasks
+
+    # The current task is completed before exit
+    def _stop(signum, frame):
+        click.echo('Stopping after the current task')
+        tasks.stop_worker()
+
+    prev = {signum: signal.signal(signum, _stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        stats = tasks.run_worker(burst, max_tasks, poll_interval, worker_id)
+    finally:
+        for signum, handler in prev.items():
+            signal.signal(signum, handler)
+
+    secho_success(f'{stats.processed} tasks processed in {stats.duration:.1f}s: {stats.done} done, '
+                  f'{stats.retried} to be retried, {stats.failed} failed')
+    if stats.requeued:
+        click.echo(f'{stats.requeued} stale tasks requeued')
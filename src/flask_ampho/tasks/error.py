@@ -0,0 +1,19 @@
+"""Ampho Tasks Exceptions
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from flask_ampho.error import AmphoError
+
+
+class TaskError(AmphoError):
+    pass
+
+
+class TaskQueueFullError(TaskError):
+    pass
+
+
+class TaskTimeoutError(TaskError):
+    pass
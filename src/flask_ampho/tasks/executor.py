@@ -0,0 +1,266 @@
+"""Ampho Task Executor
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import signal
+import logging
+import threading
+import multiprocessing.pool
+from typing import Any, Callable, Dict, List, Optional
+from time import time
+from queue import Empty, SimpleQueue
+from concurrent.futures import Future, wait
+from flask import Flask
+from .error import TaskError, TaskQueueFullError, TaskTimeoutError
+
+
+def _on_alarm(signum, frame):
+    raise TaskTimeoutError('Task timed out')
+
+
+def call_with_timeout(fn: Callable, args: tuple, kwargs: dict, timeout: Optional[float]) -> Any:
+    """Call a function, interrupting it after a timeout
+
+    The timeout is enforced by ``SIGALRM``, so only in the main thread on POSIX systems. Elsewhere the function is
+    called without a timeout.
+    """
+    if not timeout or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        return fn(*args, **kwargs)
+
+    prev = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, prev)
+
+
+def _run_in_process(fn: Callable, args: tuple, kwargs: dict, deadline: Optional[float]) -> Any:
+    if deadline is None:
+        return fn(*args, **kwargs)
+
+    remaining = deadline - time()
+    if remaining <= 0:
+        raise TaskTimeoutError('Task timed out in the queue')
+
+    return call_with_timeout(fn, args, kwargs, remaining)
+
+
+_settle_lock = threading.Lock()
+
+
+def _settle(future: Future, result: Any = None, exc: BaseException = None):
+    # The future may be already failed by shutdown
+    with _settle_lock:
+        if future.done():
+            return
+        if exc is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exc)
+
+
+class Executor:
+    """Thread and process pools with a bounded number of pending tasks
+
+    Tasks are run by daemon threads owned by the executor, so the interpreter does not wait for queued tasks at exit
+    and :meth:`shutdown` controls how long pending tasks may take. Process tasks are dispatched by their own threads to
+    a pool of forked processes, one task per process at a time, so queued process tasks can be cancelled as well.
+
+    Threads and processes are created on first use. Tasks which wait in the queue longer than their timeout are not
+    run. Running process tasks are interrupted after their timeout, while threads cannot be interrupted, so thread
+    tasks exceeding their timeout are only logged and counted.
+    """
+
+    def __init__(self, app: Flask, threads: int = 4, processes: int = 2, queue_size: int = 1000,
+                 timeout: float = 0.0):
+        """Init
+        """
+        self.app = app
+        self.threads = threads
+        self.processes = processes
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.overran = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._queues = {False: SimpleQueue(), True: SimpleQueue()}
+        self._workers = {False: [], True: []}  # type: Dict[bool, List[threading.Thread]]
+        self._process_pool = None  # type: Optional[multiprocessing.pool.Pool]
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._pending = set()
+        self._in_processes = set()
+        self._shutdown = False
+
+    def _ensure_workers(self, process: bool):
+        workers = self._workers[process]
+        size = self.processes if process else self.threads
+        if len(workers) >= size:
+            return
+
+        with self._lock:
+            if process and self._process_pool is None:
+                self._process_pool = multiprocessing.get_context('fork').Pool(self.processes)
+
+            while len(workers) < size:
+                name = f"ampho-task-{'process' if process else 'thread'}-{len(workers)}"
+                t = threading.Thread(target=self._work, args=(process,), name=name, daemon=True)
+                t.start()
+                workers.append(t)
+
+    def _work(self, process: bool):
+        q = self._queues[process]
+        while True:
+            item = q.get()
+            if item is None:
+                return
+
+            future, fn, args, kwargs, deadline = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                if process:
+                    self._in_processes.add(future)
+                    try:
+                        r = self._process_pool.apply(_run_in_process, (fn, args, kwargs, deadline))
+                    finally:
+                        self._in_processes.discard(future)
+                else:
+                    r = self._run_in_thread(fn, args, kwargs, deadline)
+            except BaseException as e:
+                _settle(future, exc=e)
+            else:
+                _settle(future, r)
+
+    def _run_in_thread(self, fn: Callable, args: tuple, kwargs: dict, deadline: Optional[float]) -> Any:
+        if deadline is not None and time() >= deadline:
+            raise TaskTimeoutError('Task timed out in the queue')
+
+        with self.app.app_context():
+            r = fn(*args, **kwargs)
+
+        if deadline is not None and time() > deadline:
+            self.overran += 1
+            logging.warning('Task %s exceeded its timeout', getattr(fn, '__qualname__', fn))
+
+        return r
+
+    def submit(self, fn: Callable, *args, timeout: float = None, process: bool = False, block: bool = False,
+               **kwargs) -> Future:
+        """Submit a task
+
+        Thread tasks run within the application context. Process tasks run in forked processes and must be picklable
+        along with their arguments and results.
+
+        :param timeout: seconds the task may wait and run. Default is the executor's timeout. ``0`` means no timeout.
+        :param process: whether to run the task in the process pool.
+        :param block: whether to wait for a free place if the queue is full instead of raising
+            :class:`TaskQueueFullError`.
+        """
+        if self._shutdown:
+            raise TaskError('Executor is shut down')
+
+        if not self._slots.acquire(block):
+            self.rejected += 1
+            raise TaskQueueFullError(f'Task queue is full: {self.queue_size} tasks are pending')
+
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time() + timeout if timeout else None
+        try:
+            self._ensure_workers(process)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future = Future()
+        self.submitted += 1
+        self._pending.add(future)
+        future.add_done_callback(self._on_done)
+        self._queues[process].put((future, fn, args, kwargs, deadline))
+
+        return future
+
+    def _on_done(self, future: Future):
+        self._pending.discard(future)
+        self._slots.release()
+
+        if future.cancelled():
+            self.cancelled += 1
+            return
+
+        e = future.exception()
+        if e is None:
+            self.completed += 1
+            return
+
+        self.failed += 1
+        if isinstance(e, TaskTimeoutError):
+            self.timed_out += 1
+        logging.error('Task failed: %s', e, exc_info=e)
+
+    def shutdown(self, timeout: float = None):
+        """Stop accepting tasks and wait for pending ones
+
+        Tasks which are not started within the timeout are cancelled and process tasks still running are terminated.
+        Thread tasks still running are abandoned, they do not delay the interpreter exit.
+        """
+        if self._shutdown:
+            return
+        self._shutdown = True
+
+        pending = list(self._pending)
+        if pending:
+            wait(pending, timeout)
+
+        for process, q in self._queues.items():
+            while True:
+                try:
+                    item = q.get_nowait()
+                except Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+            for _ in self._workers[process]:
+                q.put(None)
+
+        if self._process_pool:
+            self._process_pool.terminate()
+            for future in list(self._in_processes):
+                _settle(future, exc=TaskError('Task is terminated by shutdown'))
+
+        if self._pending:
+            logging.warning('%d background tasks are still running at shutdown', len(self._pending))
+
+    def after_fork(self):
+        """Drop workers in a forked process, since they belong to the parent
+        """
+        self._reset()
+
+    def stats(self) -> Dict[str, int]:
+        """Get statistics
+        """
+        return {
+            'pending': len(self._pending),
+            'queue_size': self.queue_size,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'overran': self.overran,
+            'rejected': self.rejected,
+            'cancelled': self.cancelled,
+        }
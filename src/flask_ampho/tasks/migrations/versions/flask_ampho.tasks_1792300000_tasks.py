@@ -0,0 +1,41 @@
+"""Tasks
+
+Revision ID: flask_ampho.tasks_1792300000
+Revises:
+Create Date: 2026-10-18 09:46:40.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'flask_ampho.tasks_1792300000'
+down_revision = None
+branch_labels = ('flask_ampho.tasks',)
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ampho_tasks',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('name', sa.String(255), nullable=False),
+        sa.Column('payload', sa.Text, nullable=False),
+        sa.Column('status', sa.String(16), nullable=False),
+        sa.Column('attempts', sa.Integer, nullable=False),
+        sa.Column('max_attempts', sa.Integer, nullable=False),
+        sa.Column('run_at', sa.Float, nullable=False),
+        sa.Column('created', sa.Float, nullable=False),
+        sa.Column('started', sa.Float),
+        sa.Column('heartbeat', sa.Float),
+        sa.Column('finished', sa.Float),
+        sa.Column('worker', sa.String(255)),
+        sa.Column('error', sa.Text),
+    )
+    op.create_index('ix_ampho_tasks_status_run_at', 'ampho_tasks', ['status', 'run_at'])
+
+
+def downgrade():
+    op.drop_index('ix_ampho_tasks_status_run_at', 'ampho_tasks')
+    op.drop_table('ampho_tasks')
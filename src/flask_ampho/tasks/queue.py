@@ -0,0 +1,254 @@
+"""Ampho Durable Task Queue
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import logging
+import threading
+import traceback
+from typing import Callable, Dict, Iterator, Optional, Union
+from time import time
+from contextlib import contextmanager
+from socket import gethostname
+from importlib import import_module
+import sqlalchemy as sa
+from flask_ampho.json_codec import JsonCodec
+from .error import TaskError
+from .tables import tasks as t_tasks
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def task_name(fn: Union[Callable, str]) -> str:
+    """Get an importable name of a task function
+    """
+    if isinstance(fn, str):
+        if ':' not in fn:
+            raise TaskError(f"Task name must be in form 'module:function', got '{fn}'")
+        return fn
+
+    name = f'{fn.__module__}:{fn.__qualname__}'
+    if '<' in name:
+        raise TaskError(f'Task function must be importable, got {name}')
+
+    return name
+
+
+def resolve_task(name: str) -> Callable:
+    """Import a task function by its name
+    """
+    module_name, _, qualname = name.partition(':')
+    try:
+        obj = import_module(module_name)
+        for attr in qualname.split('.'):
+            obj = getattr(obj, attr)
+    except (ImportError, AttributeError) as e:
+        raise TaskError(f"Cannot resolve task '{name}': {e}") from e
+
+    return obj
+
+
+class Task:
+    """Claimed task
+    """
+    __slots__ = ('id', 'name', 'args', 'kwargs', 'attempts', 'max_attempts')
+
+    def __init__(self, id_: int, name: str, args: list, kwargs: dict, attempts: int, max_attempts: int):
+        """Init
+        """
+        self.id = id_
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+    def __repr__(self) -> str:
+        return f'<Task {self.id} {self.name} attempt {self.attempts}/{self.max_attempts}>'
+
+
+class TaskQueue:
+    """Task queue stored in the ``ampho_tasks`` table
+
+    Tasks are claimed by a conditional update of their status, so any number of workers may share the table without
+    row locking support from the database. Failed tasks are retried with exponential backoff. Workers periodically
+    update heartbeats of running tasks, so tasks of dead workers can be told apart from long running ones.
+    """
+
+    def __init__(self, engine: sa.engine.Engine, codec: JsonCodec, max_attempts: int = 3, retry_delay: float = 10.0,
+                 worker_id: str = None):
+        """Init
+        """
+        self.engine = engine
+        self.codec = codec
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.worker_id = worker_id or f'{gethostname()}:{os.getpid()}'
+
+    def enqueue(self, fn: Union[Callable, str], *args, delay: float = 0.0, max_attempts: int = None,
+                **kwargs) -> int:
+        """Add a task to the queue
+
+        Arguments must be JSON serializable. Returns the task ID.
+        """
+        now = time()
+        payload = self.codec.dumps({'args': list(args), 'kwargs': kwargs})
+        q = t_tasks.insert().values(
+            name=task_name(fn),
+            payload=payload,
+            status=PENDING,
+            attempts=0,
+            max_attempts=max_attempts or self.max_attempts,
+            run_at=now + delay,
+            created=now,
+        )
+        with self.engine.begin() as conn:
+            return conn.execute(q).inserted_primary_key[0]
+
+    def claim(self) -> Optional[Task]:
+        """Claim the oldest due task
+
+        Returns ``None`` if there are no due tasks.
+        """
+        while True:
+            now = time()
+            with self.engine.begin() as conn:
+                row = conn.execute(
+                    sa.select([t_tasks])
+                    .where(t_tasks.c.status == PENDING)
+                    .where(t_tasks.c.run_at <= now)
+                    .order_by(t_tasks.c.run_at, t_tasks.c.id)
+                    .limit(1)
+                ).first()
+                if row is None:
+                    return None
+
+                claimed = conn.execute(
+                    t_tasks.update()
+                    .where(t_tasks.c.id == row['id'])
+                    .where(t_tasks.c.status == PENDING)
+                    .values(status=RUNNING, attempts=t_tasks.c.attempts + 1, started=now, heartbeat=now,
+                            worker=self.worker_id)
+                ).rowcount
+
+            # Another worker was faster
+            if claimed != 1:
+                continue
+
+            payload = self.codec.loads(row['payload'])
+
+            return Task(row['id'], row['name'], payload.get('args', []), payload.get('kwargs', {}),
+                        row['attempts'] + 1, row['max_attempts'])
+
+    def _update_owned(self, task: Task) -> sa.sql.Update:
+        # The task may be requeued as stale and claimed by another worker meanwhile
+        return (
+            t_tasks.update()
+            .where(t_tasks.c.id == task.id)
+            .where(t_tasks.c.status == RUNNING)
+            .where(t_tasks.c.worker == self.worker_id)
+        )
+
+    def complete(self, task: Task) -> bool:
+        """Mark a task as done
+
+        Returns ``False`` if the task is not owned by this worker anymore.
+        """
+        with self.engine.begin() as conn:
+            updated = conn.execute(self._update_owned(task).values(status=DONE, finished=time(), error=None)).rowcount
+
+        if not updated:
+            logging.warning('%r is not owned by worker %s anymore, its completion is not recorded', task,
+                            self.worker_id)
+
+        return bool(updated)
+
+    def fail(self, task: Task, e: BaseException) -> bool:
+        """Schedule a task for retry or mark it as failed
+
+        Returns ``True`` if the task will be retried. Returns ``False`` if the task is not owned by this worker
+        anymore.
+        """
+        now = time()
+        error = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        retry = task.attempts < task.max_attempts
+        if retry:
+            values = dict(status=PENDING, run_at=now + self.retry_delay * 2 ** (task.attempts - 1), error=error)
+        else:
+            values = dict(status=FAILED, finished=now, error=error)
+
+        with self.engine.begin() as conn:
+            updated = conn.execute(self._update_owned(task).values(**values)).rowcount
+
+        if not updated:
+            logging.warning('%r is not owned by worker %s anymore, its failure is not recorded', task, self.worker_id)
+            return False
+
+        return retry
+
+    def heartbeat(self, task: Task):
+        """Mark a task as still running
+        """
+        with self.engine.begin() as conn:
+            conn.execute(t_tasks.update().where(t_tasks.c.id == task.id).where(t_tasks.c.status == RUNNING)
+                         .values(heartbeat=time()))
+
+    @contextmanager
+    def keep_alive(self, task: Task, interval: float) -> Iterator[None]:
+        """Update the task's heartbeat from a background thread while the block runs
+        """
+        done = threading.Event()
+
+        def _beat():
+            while not done.wait(interval):
+                try:
+                    self.heartbeat(task)
+                except Exception as e:
+                    logging.warning('Cannot update heartbeat of %r: %s', task, e)
+
+        t = threading.Thread(target=_beat, name=f'ampho-task-heartbeat-{task.id}', daemon=True)
+        t.start()
+        try:
+            yield
+        finally:
+            done.set()
+            t.join()
+
+    def requeue_stale(self, older_than: float) -> int:
+        """Return running tasks without heartbeats for given number of seconds to the queue
+
+        Such tasks were claimed by workers which died. Tasks which have no attempts left are marked as failed, since
+        they may be the cause of the deaths. Returns number of requeued tasks.
+        """
+        now = time()
+        stale = sa.and_(t_tasks.c.status == RUNNING, t_tasks.c.heartbeat < now - older_than)
+        with self.engine.begin() as conn:
+            failed = conn.execute(
+                t_tasks.update()
+                .where(stale)
+                .where(t_tasks.c.attempts >= t_tasks.c.max_attempts)
+                .values(status=FAILED, finished=now, error='Worker stopped responding')
+            ).rowcount
+            if failed:
+                logging.error('%d stale tasks have no attempts left and are marked as failed', failed)
+
+            return conn.execute(
+                t_tasks.update()
+                .where(stale)
+                .values(status=PENDING, run_at=now, error='Worker stopped responding')
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Get number of tasks by status
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(sa.select([t_tasks.c.status, sa.func.count()]).group_by(t_tasks.c.status))
+            r = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            r.update({status: n for status, n in rows})
+
+        return r
@@ -0,0 +1,27 @@
+"""Ampho Tasks Tables
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sqlalchemy as sa
+
+metadata = sa.MetaData()
+
+tasks = sa.Table(
+    'ampho_tasks', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String(255), nullable=False),
+    sa.Column('payload', sa.Text, nullable=False),
+    sa.Column('status', sa.String(16), nullable=False),
+    sa.Column('attempts', sa.Integer, nullable=False, default=0),
+    sa.Column('max_attempts', sa.Integer, nullable=False),
+    sa.Column('run_at', sa.Float, nullable=False),
+    sa.Column('created', sa.Float, nullable=False),
+    sa.Column('started', sa.Float),
+    sa.Column('heartbeat', sa.Float),
+    sa.Column('finished', sa.Float),
+    sa.Column('worker', sa.String(255)),
+    sa.Column('error', sa.Text),
+    sa.Index('ix_ampho_tasks_status_run_at', 'status', 'run_at'),
+)
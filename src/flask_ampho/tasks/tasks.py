@@ -0,0 +1,208 @@
+"""Ampho Tasks
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Union
+from time import time
+from functools import partial
+from weakref import ref
+from concurrent.futures import Future
+from blinker import ANY, NamedSignal
+from flask_ampho import Ampho
+from flask_ampho.settings import declare, as_bool
+from .executor import Executor, call_with_timeout
+from .queue import TaskQueue, resolve_task
+
+declare('AMPHO_TASKS_THREADS', int, 4, lambda v: v > 0)
+declare('AMPHO_TASKS_PROCESSES', int, 2, lambda v: v > 0)
+declare('AMPHO_TASKS_QUEUE_SIZE', int, 1000, lambda v: v > 0)
+declare('AMPHO_TASKS_TIMEOUT', float, 0.0, lambda v: v >= 0)
+declare('AMPHO_TASKS_SHUTDOWN_TIMEOUT', float, 30.0, lambda v: v >= 0)
+declare('AMPHO_TASKS_DB', as_bool, False)
+declare('AMPHO_TASKS_POLL_INTERVAL', float, 1.0, lambda v: v > 0)
+declare('AMPHO_TASKS_MAX_ATTEMPTS', int, 3, lambda v: v > 0)
+declare('AMPHO_TASKS_RETRY_DELAY', float, 10.0, lambda v: v >= 0)
+declare('AMPHO_TASKS_STALE_AFTER', float, 3600.0, lambda v: v > 0)
+
+
+def _after_fork(tasks_ref: ref):
+    tasks = tasks_ref()
+    if tasks:
+        tasks.executor.after_fork()
+
+
+class WorkerStats:
+    """Worker run statistics
+    """
+    __slots__ = ('done', 'retried', 'failed', 'requeued', 'duration')
+
+    def __init__(self):
+        """Init
+        """
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self.requeued = 0
+        self.duration = 0.0
+
+    @property
+    def processed(self) -> int:
+        """Number of processed tasks
+        """
+        return self.done + self.retried + self.failed
+
+
+class Tasks:
+    """Background tasks
+
+    In-process tasks are run by the thread or process pool of :attr:`executor` and are lost if the process exits.
+    Tasks which must survive restarts are put into the durable queue stored in the database and are run by
+    ``flask ampho worker`` processes.
+    """
+
+    def __init__(self, ampho: Ampho):
+        """Init
+        """
+        self.ampho = ampho
+        settings = ampho.settings
+        self.executor = Executor(ampho.app, settings.tasks_threads, settings.tasks_processes,
+                                 settings.tasks_queue_size, settings.tasks_timeout)
+
+        self._queue = None  # type: Optional[TaskQueue]
+        self._stop = threading.Event()
+
+        atexit.register(self.shutdown)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=partial(_after_fork, ref(self)))
+
+        # Register CLI commands
+        with ampho.app.app_context():
+            from . import _cli
+
+    def submit(self, fn: Callable, *args, timeout: float = None, process: bool = False, **kwargs) -> Future:
+        """Run a function in background
+
+        See :meth:`Executor.submit`.
+        """
+        return self.executor.submit(fn, *args, timeout=timeout, process=process, **kwargs)
+
+    def connect_async(self, signal: Union[NamedSignal, str], receiver: Callable = None, sender: Any = ANY,
+                      timeout: float = None) -> Callable:
+        """Connect a receiver which runs in the thread pool, off the sending thread
+
+        Can be used as a decorator. The signal's ``send()`` gets futures as receivers' return values. Receivers must
+        not rely on the request context, since the request may be finished before they run.
+
+        :param signal: a signal or a name of an Ampho signal.
+        """
+        if isinstance(signal, str):
+            signal = self.ampho.signals.signal(signal)
+
+        def decorator(fn: Callable) -> Callable:
+            def _receiver(sender_, **kwargs) -> Future:
+                return self.executor.submit(fn, sender_, timeout=timeout, **kwargs)
+
+            # The wrapper is referenced by the signal only, so it must be connected strongly
+            signal.connect(_receiver, sender, False)
+            fn.ampho_async_receiver = _receiver
+
+            return fn
+
+        return decorator(receiver) if receiver else decorator
+
+    @property
+    def queue(self) -> TaskQueue:
+        """Durable task queue
+        """
+        if self._queue is None:
+            settings = self.ampho.settings
+            self._queue = TaskQueue(self.ampho.db.sqlalchemy.engine, self.ampho.json, settings.tasks_max_attempts,
+                                    settings.tasks_retry_delay)
+
+        return self._queue
+
+    def enqueue(self, fn: Union[Callable, str], *args, delay: float = 0.0, max_attempts: int = None,
+                **kwargs) -> int:
+        """Put a task into the durable queue
+
+        See :meth:`TaskQueue.enqueue`.
+        """
+        return self.queue.enqueue(fn, *args, delay=delay, max_attempts=max_attempts, **kwargs)
+
+    def run_worker(self, burst: bool = False, max_tasks: int = 0, poll_interval: float = None,
+                   worker_id: str = None) -> WorkerStats:
+        """Run tasks from the durable queue until stopped
+
+        Tasks are run one by one in the calling thread within the application context. If it is the main thread,
+        tasks exceeding ``AMPHO_TASKS_TIMEOUT`` are interrupted.
+
+        :param burst: whether to exit when the queue is empty.
+        :param max_tasks: number of tasks to process before exit. ``0`` means no limit.
+        """
+        settings = self.ampho.settings
+        poll_interval = poll_interval or settings.tasks_poll_interval
+        queue = self.queue
+        if worker_id:
+            queue.worker_id = worker_id
+
+        stats = WorkerStats()
+        started = time()
+        requeued_at = 0.0
+        self._stop.clear()
+        logging.info('Task worker %s started', queue.worker_id)
+
+        while not self._stop.is_set() and not (max_tasks and stats.processed >= max_tasks):
+            if time() - requeued_at > settings.tasks_stale_after / 10:
+                stats.requeued += queue.requeue_stale(settings.tasks_stale_after)
+                requeued_at = time()
+
+            task = queue.claim()
+            if task is None:
+                if burst:
+                    break
+                self._stop.wait(poll_interval)
+                continue
+
+            try:
+                fn = resolve_task(task.name)
+                with self.ampho.app.app_context(), queue.keep_alive(task, settings.tasks_stale_after / 4):
+                    call_with_timeout(fn, task.args, task.kwargs, settings.tasks_timeout)
+            except Exception as e:
+                if queue.fail(task, e):
+                    stats.retried += 1
+                    logging.warning('%r failed and will be retried: %s', task, e)
+                else:
+                    stats.failed += 1
+                    logging.error('%r failed: %s', task, e, exc_info=e)
+            else:
+                queue.complete(task)
+                stats.done += 1
+
+        stats.duration = time() - started
+        logging.info('Task worker %s stopped, %d tasks processed', queue.worker_id, stats.processed)
+
+        return stats
+
+    def stop_worker(self):
+        """Stop the worker after the current task
+        """
+        self._stop.set()
+
+    def shutdown(self, timeout: float = None):
+        """Wait for in-process tasks and stop the pools
+
+        Default timeout is ``AMPHO_TASKS_SHUTDOWN_TIMEOUT``.
+        """
+        self.stop_worker()
+        self.executor.shutdown(self.ampho.settings.tasks_shutdown_timeout if timeout is None else timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Get statistics of the executor
+        """
+        return self.executor.stats()
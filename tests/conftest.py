@@ -35,6 +35,7 @@ def ampho(tmp_path: PathLike) -> Ampho:
         'AMPHO_LOG_DIR': path.join(tmp_path, 'log'),
         'AMPHO_CONFIG_DIR': path.join(tmp_path, 'config'),
         'AMPHO_SECURITY_KEY': JWK.generate(kty="oct", size=256).export(),
+        'AMPHO_AUTH_HASH_PARAMS': {'iterations': 1000},
     })
 
     yield Ampho(app)
@@ -5,11 +5,16 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import os
+import click
 import pytest
 import json
+from time import sleep
 from socket import gethostname
 from getpass import getuser
 from flask_ampho import Ampho
+from flask_ampho.error import ConfigurationError
+from flask_ampho.settings import declare, add_loader
+from flask_ampho.config_watcher import ConfigWatcher
 from .conftest import rand_int, rand_str
 
 
@@ -87,3 +92,178 @@ def test_load_config_dir(ampho: Ampho):
     ampho.load_config_dir()
     for k, v in values.items():
         assert ampho.get_config(k) == v
+
+
+def test_settings(ampho: Ampho):
+    """Test settings snapshot
+    """
+    k = 'AMPHO_' + rand_str().upper()
+    declare(k, int, 1, lambda v: v > 0)
+    name = k[6:].lower()
+
+    s = ampho.settings
+    assert getattr(s, name) == 1
+    assert s[k] == 1
+    assert ampho.settings is s
+
+    with pytest.raises(AttributeError):
+        setattr(s, name, 2)
+
+    # Snapshot is recompiled only on change notification
+    v = rand_int(1, 1000)
+    ampho.app.config[k] = str(v)
+    assert ampho.settings is s
+    ampho.config_changed([k])
+    assert getattr(ampho.settings, name) == v
+
+    ampho.set_config(k, 0)
+    with pytest.raises(ConfigurationError):
+        assert ampho.settings
+    ampho.set_config(k, 1)
+
+    # Loaders run only for settings having their prefixes
+    prefix = rand_str()
+    loaded = []
+
+    def load():
+        declare(f'AMPHO_{prefix.upper()}_LOADED', int, 1)
+        loaded.append(prefix)
+
+    add_loader(load, [prefix])
+    assert not hasattr(ampho.settings, rand_str())
+    assert not loaded
+    assert getattr(ampho.settings, f'{prefix}_loaded') == 1
+    assert loaded
+
+
+def test_reload_config_dir(ampho: Ampho):
+    """Test reload_config_dir()
+    """
+    os.makedirs(ampho.config_dir, 0o755, True)
+    config_path = os.path.join(ampho.config_dir, 'default.json')
+
+    default_ttl = ampho.app.config.get('AMPHO_SECURITY_TOKEN_TTL')
+    reloaded = []
+    ampho.on_config_reloaded.connect(lambda sender, keys: reloaded.extend(keys), weak=False)
+
+    ttl = rand_int(1, 1000)
+    with open(config_path, 'w') as f:
+        json.dump({'AMPHO_SECURITY_TOKEN_TTL': ttl}, f)
+
+    assert ampho.reload_config_dir() == ['AMPHO_SECURITY_TOKEN_TTL']
+    assert reloaded == ['AMPHO_SECURITY_TOKEN_TTL']
+    assert ampho.settings.security_token_ttl == ttl
+    assert ampho.reload_config_dir() == []
+
+    # Invalid configuration must not be applied
+    with open(config_path, 'w') as f:
+        json.dump({'AMPHO_SECURITY_TOKEN_TTL': -1}, f)
+    assert ampho.reload_config_dir() == []
+    assert ampho.settings.security_token_ttl == ttl
+
+    # Keys removed from files get their previous values back
+    key = f'TEST_{rand_str().upper()}'
+    with open(config_path, 'w') as f:
+        json.dump({key: 1}, f)
+    assert sorted(ampho.reload_config_dir()) == sorted([key, 'AMPHO_SECURITY_TOKEN_TTL'])
+    assert ampho.app.config[key] == 1
+    assert ampho.app.config.get('AMPHO_SECURITY_TOKEN_TTL') == default_ttl
+
+    with open(config_path, 'w') as f:
+        json.dump({}, f)
+    assert ampho.reload_config_dir() == [key]
+    assert key not in ampho.app.config
+
+
+@pytest.mark.parametrize('backend', ['inotify', 'poll'])
+def test_config_watcher(ampho: Ampho, backend: str):
+    """Test ConfigWatcher
+    """
+    os.makedirs(ampho.config_dir, 0o755, True)
+    config_path = os.path.join(ampho.config_dir, 'default.json')
+
+    watcher = ConfigWatcher(ampho, 0.05, backend)
+    watcher.start()
+    try:
+        ttl = rand_int(1, 1000)
+        with open(config_path, 'w') as f:
+            json.dump({'AMPHO_SECURITY_TOKEN_TTL': ttl}, f)
+
+        for _ in range(50):
+            if ampho.settings.security_token_ttl == ttl:
+                break
+            sleep(0.05)
+
+        assert ampho.settings.security_token_ttl == ttl
+    finally:
+        watcher.stop()
+
+
+def test_lazy_subsystems(ampho: Ampho, tmp_path):
+    """Test lazy initialization of subsystems
+    """
+    from flask import Flask
+
+    config = dict(ampho.app.config)
+    config['AMPHO_SUBSYSTEMS'] = 'db,security,metrics'
+    config['AMPHO_LAZY'] = True
+    config['AMPHO_METRICS_PATH'] = '/metrics'
+    app = Flask(__name__, instance_path=os.path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+
+    assert not ampho._subsystems
+    assert ampho.cache is None
+    assert ampho.db is not None
+    assert set(ampho._subsystems) == {'cache', 'db'}
+
+    # The metrics endpoint is registered before the first request is routed
+    assert app.test_client().get('/metrics').status_code == 200
+    assert ampho.http_cache is None
+    assert [p for p, _ in ampho.startup_profile if p in ('db', 'security', 'metrics')] == ['db', 'security', 'metrics']
+
+    result = app.test_cli_runner().invoke(args=['ampho', 'startup-profile', '--child'])
+    assert [p for p, _ in json.loads(result.output)][-3:] == ['db', 'security', 'metrics']
+
+    # Commands are loaded on demand
+    app = Flask(__name__, instance_path=os.path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+    app.test_cli_runner().invoke(args=['ampho', 'db-current', '--help'])
+    assert 'db' in ampho._subsystems
+    assert 'security' not in ampho._subsystems
+    app.test_cli_runner().invoke(args=['ampho', '--help'])
+    assert 'security' in ampho._subsystems
+
+
+def test_eager_subsystems(ampho: Ampho, tmp_path):
+    """Test eager initialization of subsystems
+    """
+    from flask import Flask
+
+    # Applications loaded by servers, which may fork workers afterwards, are initialized eagerly by default
+    app = Flask(__name__, instance_path=os.path.join(tmp_path, 'instance'))
+    app.config.from_mapping(ampho.app.config)
+    ampho = Ampho(app)
+    assert set(ampho._subsystems) == {'db', 'cache', 'security', 'metrics', 'http_cache', 'tasks'}
+
+    # While applications loaded by CLI commands are not
+    app = Flask(__name__, instance_path=os.path.join(tmp_path, 'instance'))
+    app.config.from_mapping(ampho.app.config)
+    with click.Context(click.Command('test')):
+        ampho = Ampho(app)
+    assert not ampho._subsystems
+
+
+def test_parse_import_times():
+    """Test parsing of -X importtime output
+    """
+    from flask_ampho._cli import parse_import_times
+
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       100 |        100 |   json.decoder',
+        'import time:       200 |        300 | json',
+        'import time:        50 |         50 | flask_ampho',
+    ])
+    assert parse_import_times(output) == [('json', 0.0002, 0.0003), ('flask_ampho', 0.00005, 0.00005)]
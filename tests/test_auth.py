@@ -0,0 +1,94 @@
+"""Ampho Auth Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import pytest
+from time import sleep
+from threading import Thread
+from flask_ampho import Ampho
+from flask_ampho.auth.tables import metadata
+from flask_ampho.auth.hashing import hash_password, verify_password, needs_rehash
+from flask_ampho.auth.pool import HashingPool
+from flask_ampho.auth import hashing
+from flask_ampho.auth.error import HashingPoolBusyError, UnsupportedHashError, UserExistsError
+from .conftest import rand_str
+
+
+@pytest.mark.parametrize('scheme, params', [
+    ('pbkdf2_sha256', {'iterations': 1000}),
+    ('scrypt', {'n': 2 ** 10}),
+])
+def test_hashing(scheme: str, params: dict):
+    """Password hashing test
+    """
+    password = rand_str()
+    hashed = hash_password(password, scheme, params)
+
+    assert hashed.startswith(scheme + '$')
+    assert verify_password(password, hashed)
+    assert not verify_password(rand_str(), hashed)
+
+    assert not needs_rehash(hashed, scheme, params)
+    assert needs_rehash(hashed, 'pbkdf2_sha256' if scheme == 'scrypt' else 'scrypt')
+
+
+def test_unsupported_hash(monkeypatch):
+    """Unsupported hash formats test
+    """
+    with pytest.raises(UnsupportedHashError):
+        verify_password(rand_str(), 'md5$' + rand_str())
+
+    # Corrupt hashes are unsupported as well
+    for hashed in ('pbkdf2_sha256$many$c2FsdA==$aGFzaA==', 'pbkdf2_sha256$1000$!!!$aGFzaA==',
+                   'scrypt$16384$8$1$c2FsdA==$not base64', 'scrypt$3$8$1$c2FsdA==$aGFzaA=='):
+        with pytest.raises(UnsupportedHashError):
+            verify_password(rand_str(), hashed)
+    for hashed in ('pbkdf2_sha256', 'pbkdf2_sha256$many$c2FsdA==$aGFzaA=='):
+        with pytest.raises(UnsupportedHashError):
+            needs_rehash(hashed)
+
+    monkeypatch.setattr(hashing, 'argon2', None)
+    with pytest.raises(UnsupportedHashError):
+        verify_password(rand_str(), '$argon2id$v=19$m=102400,t=2,p=8$c2FsdA$aGFzaA')
+
+
+def test_hashing_pool():
+    """HashingPool test
+    """
+    pool = HashingPool(1, 0.05)
+    assert pool.run(sum, [1, 2]) == 3
+
+    t = Thread(target=pool.run, args=(sleep, 0.5))
+    t.start()
+    sleep(0.1)
+
+    with pytest.raises(HashingPoolBusyError):
+        pool.run(sum, [1, 2])
+
+    t.join()
+    pool.shutdown()
+
+
+def test_user_store(ampho: Ampho):
+    """UserStore test
+    """
+    users = ampho.security.users
+    metadata.create_all(users.engine)
+
+    login = rand_str()
+    password = rand_str()
+    assert users.create(login, password)['login'] == login
+    with pytest.raises(UserExistsError):
+        users.create(login, password)
+
+    assert users.authenticate(login, password)['login'] == login
+    assert users.authenticate(login, rand_str()) is None
+    assert users.authenticate(rand_str(), password) is None
+
+    # Outdated hash must be replaced on successful login
+    ampho.set_config('AMPHO_AUTH_HASH_PARAMS', {'iterations': 2000})
+    assert users.authenticate(login, password)
+    assert users.get(login)['password'].startswith('pbkdf2_sha256$2000$')
+    assert users.authenticate(login, password)
@@ -0,0 +1,168 @@
+"""Ampho Cache Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from os import path
+from time import sleep
+from flask_ampho import Ampho
+from flask_ampho.cache import MISSING, Cache, MemoryBackend, SqliteBackend
+
+
+def test_memory_backend():
+    """Test LRU eviction and expiration
+    """
+    backend = MemoryBackend(2)
+    backend.set('a', 1, 60)
+    backend.set('b', 2, 60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, 60)
+    assert backend.get('b') is MISSING
+    assert backend.get('a') == 1
+    assert backend.evictions == 1
+
+    backend.set('d', 4, 0.01)
+    sleep(0.02)
+    assert backend.get('d') is MISSING
+
+
+def test_sqlite_backend(tmp_path):
+    """Test sharing of values and generations between backend instances
+    """
+    file_path = path.join(tmp_path, 'cache', 'cache.sqlite')
+    cache1 = Cache(SqliteBackend(file_path))
+    cache2 = Cache(SqliteBackend(file_path))
+
+    cache1.set('k', {'v': [1, 2]}, ('t',))
+    assert cache2.get('k', ('t',)) == {'v': [1, 2]}
+
+    cache2.invalidate('t')
+    assert cache1.get('k', ('t',)) is MISSING
+
+    backend = SqliteBackend(path.join(tmp_path, 'small.sqlite'), 2, 1)
+    for i in range(4):
+        backend.set(str(i), i, 60)
+    assert len(backend) == 2
+    assert backend.evictions == 2
+    assert backend.get('3') == 3
+
+
+def test_cached(ampho: Ampho):
+    """Test the decorator
+    """
+    calls = []
+
+    @ampho.cache.cached(tables=('t',))
+    def f(x: int) -> int:
+        calls.append(x)
+        return x * 2
+
+    assert f(1) == 2
+    assert f(1) == 2
+    assert f(2) == 4
+    assert calls == [1, 2]
+
+    f.cache_clear()
+    assert f(1) == 2
+    assert calls == [1, 2, 1]
+
+    stats = ampho.cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 3
+    assert stats['invalidations'] == 1
+
+
+def test_query_invalidation(ampho: Ampho):
+    """Test invalidation of query results after commits
+    """
+    sqlalchemy = ampho.db.sqlalchemy
+
+    class Article(sqlalchemy.Model):
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+        title = sqlalchemy.Column(sqlalchemy.String(64))
+
+    with ampho.app.app_context():
+        sqlalchemy.create_all()
+        session = sqlalchemy.session
+
+        session.add(Article(title='first'))
+        session.commit()
+
+        titles = lambda: [a.title for a in ampho.cache.query(Article.query.order_by(Article.id))]
+        assert titles() == ['first']
+        assert titles() == ['first']
+        assert ampho.cache.hits == 1
+
+        # Uncommitted and rolled back changes do not invalidate
+        session.add(Article(title='second'))
+        session.flush()
+        session.rollback()
+        assert titles() == ['first']
+        assert ampho.cache.hits == 2
+
+        session.add(Article(title='second'))
+        session.commit()
+        assert titles() == ['first', 'second']
+
+        assert ampho.cache.query(Article.query.filter_by(title='second'), method='count') == 1
+        Article.query.filter_by(title='second').one().title = 'third'
+        session.commit()
+        assert ampho.cache.query(Article.query.filter_by(title='second'), method='count') == 0
+
+
+def test_bulk_invalidation(ampho: Ampho):
+    """Test invalidation of query results after bulk queries and statements executed by the session
+    """
+    sqlalchemy = ampho.db.sqlalchemy
+
+    class Note(sqlalchemy.Model):
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+        text = sqlalchemy.Column(sqlalchemy.String(64))
+
+    with ampho.app.app_context():
+        sqlalchemy.create_all()
+        session = sqlalchemy.session
+        session.add(Note(text='first'))
+        session.commit()
+
+        texts = lambda: [n.text for n in ampho.cache.query(Note.query.order_by(Note.id))]
+        assert texts() == ['first']
+
+        Note.query.filter_by(text='first').update({'text': 'second'}, synchronize_session=False)
+        session.commit()
+        assert texts() == ['second']
+
+        session.execute(Note.__table__.insert().values(text='third'))
+        session.commit()
+        assert texts() == ['second', 'third']
+
+        session.execute(Note.__table__.update().where(Note.text == 'third').values(text='fourth'))
+        session.commit()
+        assert texts() == ['second', 'fourth']
+
+        Note.query.filter_by(text='second').delete(synchronize_session=False)
+        session.commit()
+        assert texts() == ['fourth']
+
+
+def test_several_caches(ampho: Ampho):
+    """Test invalidation of caches tracking the same session
+    """
+    sqlalchemy = ampho.db.sqlalchemy
+
+    class Tag(sqlalchemy.Model):
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+
+    other = Cache(MemoryBackend(10))
+    other.track(sqlalchemy.session)
+
+    with ampho.app.app_context():
+        sqlalchemy.create_all()
+        for cache in (ampho.cache, other):
+            cache.set('count', 0, ['tag'])
+
+        sqlalchemy.session.add(Tag())
+        sqlalchemy.session.commit()
+        for cache in (ampho.cache, other):
+            assert cache.get('count', ['tag']) is MISSING
@@ -0,0 +1,223 @@
+"""Ampho Database Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import pytest
+import sqlalchemy as sa
+from os import path
+from flask_ampho import Ampho
+
+
+def test_migrations_dir(ampho: Ampho):
+    """Test cached migrations structure
+    """
+    with ampho.db.migrations_dir() as m_dir:
+        assert path.isfile(path.join(m_dir, 'env.py'))
+        versions = sorted(os.listdir(path.join(m_dir, 'versions')))
+        assert 'flask_ampho.auth_1597500000_revoked_tokens.py' in versions
+        manifest_mtime = os.stat(path.join(ampho.db.migrations_cache_dir, 'manifest.json')).st_mtime_ns
+
+    # Unchanged structure is reused as is
+    with ampho.db.migrations_dir() as m_dir_2:
+        assert m_dir_2 == m_dir
+        assert sorted(os.listdir(path.join(m_dir, 'versions'))) == versions
+        assert os.stat(path.join(ampho.db.migrations_cache_dir, 'manifest.json')).st_mtime_ns == manifest_mtime
+
+    # Temporary structure is removed on exit
+    with ampho.db.migrations_dir(False) as tmp_dir:
+        assert tmp_dir != m_dir
+        assert 'flask_ampho.auth_1597500000_revoked_tokens.py' in os.listdir(path.join(tmp_dir, 'versions'))
+    assert not path.exists(tmp_dir)
+
+
+def test_dir_signature(tmp_path):
+    """Test detection of changed migration files
+    """
+    from flask_ampho.db._db import _dir_signature
+
+    file_path = path.join(tmp_path, 'rev.py')
+    with open(file_path, 'w') as f:
+        f.write('a = 1')
+    st = os.stat(file_path)
+    digest, files = _dir_signature(str(tmp_path))
+    assert files == ['rev.py']
+
+    # Same size and modification time
+    with open(file_path, 'w') as f:
+        f.write('a = 2')
+    os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert _dir_signature(str(tmp_path))[0] != digest
+
+
+def test_db_up(ampho: Ampho, tmp_path):
+    """Test db-up command
+    """
+    ampho.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path.join(tmp_path, "db.sqlite")}'
+    runner = ampho.app.test_cli_runner()
+
+    from flask_ampho.db._cli import db_up
+    result = runner.invoke(db_up)
+    assert result.exit_code == 0, result.output
+
+    with ampho.app.app_context():
+        tables = ampho.db.sqlalchemy.engine.table_names()
+    assert 'ampho_users' in tables
+    assert 'ampho_revoked_tokens' in tables
+
+
+def test_revision_index(ampho: Ampho):
+    """Test revisions index
+    """
+    index = ampho.db.get_revision_index()
+    r = index.get('flask_ampho.auth_1597600000')
+    assert r.down_revisions == ('flask_ampho.auth_1597500000',)
+    assert r.package == 'flask_ampho.auth'
+    assert [h.revision for h in index.heads] == [r.revision]
+    assert [h.revision for h in index.resolve('flask_ampho.auth')] == [r.revision]
+    assert index.resolve('flask_ampho.auth@-1') is None
+
+    # Persisted index is reused
+    index_path = path.join(ampho.db.migrations_cache_dir, 'index.json')
+    mtime = os.stat(index_path).st_mtime_ns
+    assert len(ampho.db.get_revision_index()) == len(index)
+    assert os.stat(index_path).st_mtime_ns == mtime
+
+
+def test_db_pending(ampho: Ampho, tmp_path):
+    """Test pending revisions check
+    """
+    ampho.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path.join(tmp_path, "db.sqlite")}'
+    runner = ampho.app.test_cli_runner()
+
+    from flask_ampho.db._cli import db_up, db_pending, db_current
+    result = runner.invoke(db_pending)
+    assert result.exit_code == 1
+    assert 'flask_ampho.auth_1597500000' in result.output
+
+    runner.invoke(db_up)
+    result = runner.invoke(db_pending)
+    assert result.exit_code == 0
+    assert result.output == ''
+
+    result = runner.invoke(db_current)
+    assert result.output.strip() == 'flask_ampho.auth_1597600000 (head)'
+
+
+def test_db_up_binds(ampho: Ampho, tmp_path):
+    """Test upgrading of multiple binds
+    """
+    ampho.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path.join(tmp_path, "default.sqlite")}'
+    ampho.app.config['SQLALCHEMY_BINDS'] = {
+        'one': f'sqlite:///{path.join(tmp_path, "one.sqlite")}',
+        'two': f'sqlite:///{path.join(tmp_path, "two.sqlite")}',
+        'broken': f'sqlite:///{path.join(tmp_path, "no", "such", "dir.sqlite")}',
+    }
+    runner = ampho.app.test_cli_runner()
+
+    from flask_ampho.db._cli import db_up
+    result = runner.invoke(db_up, ['-b', 'one', '-b', 'two', '-b', 'broken', '-p', '3'])
+    assert result.exit_code == 1
+    assert '2 of 3 binds upgraded' in result.output
+    assert '[broken] failed' in result.output
+
+    with ampho.app.app_context():
+        for bind in ('one', 'two'):
+            assert ampho.db.get_current_revisions(ampho.db.sqlalchemy.get_engine(bind=bind)) == [
+                'flask_ampho.auth_1597600000']
+        assert ampho.db.get_current_revisions() == []
+
+    result = runner.invoke(db_up, ['-b', 'unknown'])
+    assert result.exit_code == 2
+
+    # Parallelism applies to binds only
+    result = runner.invoke(db_up, ['-p', '2'])
+    assert result.exit_code == 2
+    assert '--bind or --all-binds' in result.output
+
+
+def test_db_up_output(ampho: Ampho, tmp_path):
+    """Test writing offline SQL to files
+    """
+    runner = ampho.app.test_cli_runner()
+    from flask_ampho.db._cli import db_up
+
+    out_file = path.join(tmp_path, 'out.sql')
+    result = runner.invoke(db_up, ['-o', out_file, '--batch-separator', '/'])
+    assert result.exit_code == 0, result.output
+    with open(out_file) as f:
+        sql = f.read()
+    assert 'CREATE TABLE ampho_users' in sql
+    assert 'CREATE TABLE ampho_revoked_tokens' in sql
+    assert '\n/\n' in sql
+
+    out_dir = path.join(tmp_path, 'revisions')
+    result = runner.invoke(db_up, ['-o', out_dir, '--split', 'revision'])
+    assert result.exit_code == 0, result.output
+    assert sorted(os.listdir(out_dir)) == ['flask_ampho.auth_1597500000.sql', 'flask_ampho.auth_1597600000.sql']
+    with open(path.join(out_dir, 'flask_ampho.auth_1597600000.sql')) as f:
+        sql = f.read()
+    assert 'CREATE TABLE ampho_users' in sql
+    assert 'ampho_revoked_tokens' not in sql
+    with open(path.join(out_dir, 'flask_ampho.auth_1597500000.sql')) as f:
+        assert 'CREATE TABLE alembic_version' in f.read()
+
+    out_dir = path.join(tmp_path, 'packages')
+    result = runner.invoke(db_up, ['-o', out_dir, '--split', 'package'])
+    assert result.exit_code == 0, result.output
+    assert os.listdir(out_dir) == ['flask_ampho.auth.sql']
+
+
+def test_checkpoint_keys():
+    """Test round trip of checkpoint keys
+    """
+    from uuid import uuid4
+    from decimal import Decimal
+    from datetime import date, datetime, time, timezone
+    from flask_ampho.db.migration import dump_key, load_key
+
+    for key in (None, 1, 'a', uuid4(), Decimal('1.10'), b'\x00\xff', date(2020, 1, 2), time(3, 4, 5),
+                datetime(2020, 1, 2, 3, 4, 5, 6), datetime(2020, 1, 2, tzinfo=timezone.utc)):
+        loaded = load_key(dump_key(key))
+        assert loaded == key
+        assert type(loaded) is type(key)
+
+
+def test_backfill(ampho: Ampho, tmp_path):
+    """Test batched table update
+    """
+    from alembic.runtime.migration import MigrationContext
+    from alembic.operations import Operations
+    from flask_ampho.db import migration
+
+    engine = sa.create_engine(f'sqlite:///{path.join(tmp_path, "db.sqlite")}')
+    engine.execute('CREATE TABLE article (id INTEGER PRIMARY KEY, a INTEGER, b INTEGER)')
+    for i in range(1, 26):
+        engine.execute('INSERT INTO article VALUES (?, ?, 0)', i, i)
+
+    def run(**kwargs) -> int:
+        with ampho.app.app_context(), engine.connect() as conn:
+            ctx = MigrationContext.configure(conn)
+            with Operations.context(ctx), ctx.begin_transaction():
+                return migration.backfill('article', {'b': sa.column('a') * 2}, **kwargs)
+
+    # Interrupted run
+    def fail(conn, lower, upper):
+        if lower is not None:
+            raise RuntimeError()
+        return conn.execute('UPDATE article SET b = a WHERE id <= ?', upper).rowcount
+
+    with ampho.app.app_context(), engine.connect() as conn:
+        ctx = MigrationContext.configure(conn)
+        with Operations.context(ctx), ctx.begin_transaction():
+            with pytest.raises(RuntimeError):
+                migration.backfill_batches('article', fail, batch_size=10, name='article:id')
+
+    # Resumed run skips the first batch
+    assert run(batch_size=10) == 25
+    assert engine.execute('SELECT SUM(b) FROM article').scalar() == sum(range(1, 11)) + 2 * sum(range(11, 26))
+    assert engine.execute('SELECT COUNT(*) FROM ampho_migration_checkpoints').scalar() == 0
+
+    assert run(where=sa.column('a') > 20, batch_size=7) == 5
@@ -0,0 +1,96 @@
+"""Ampho Bulk Database Operations Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import pytest
+import sqlalchemy as sa
+from flask_ampho import Ampho
+from flask_ampho.cache import MISSING
+from flask_ampho.db.bulk import _per_statement, chunks
+
+metadata = sa.MetaData()
+items = sa.Table(
+    'bulk_items', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('name', sa.String(64)),
+    sa.Column('qty', sa.Integer),
+)
+
+
+def test_chunks():
+    """Test lazy chunking
+    """
+    assert list(chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunks([], 2)) == []
+
+
+def test_per_statement():
+    """Test limiting rows per statement by number of bind parameters
+    """
+    class Conn:
+        def __init__(self, name: str):
+            self.dialect = type('Dialect', (), {'name': name})
+
+    assert _per_statement(Conn('postgresql'), 100) == 655
+    assert _per_statement(Conn('sqlite'), 1) == 999
+    assert _per_statement(Conn('unknown'), 2000) == 1
+
+
+def test_bulk_invalidates_caches(ampho: Ampho):
+    """Test that bulk operations invalidate cached values depending on the table
+    """
+    db = ampho.db
+    engine = db.sqlalchemy.get_engine(ampho.app)
+    metadata.create_all(engine)
+
+    def count():
+        return engine.execute(sa.select([sa.func.count()]).select_from(items)).scalar()
+
+    assert ampho.cache.get_or_set('count', count, ['bulk_items']) == 0
+    db.bulk_insert(items, [{'id': 1, 'name': 'a', 'qty': 1}])
+    assert ampho.cache.get_or_set('count', count, ['bulk_items']) == 1
+
+    ampho.http_cache.cache.set('resp', 'cached', ['bulk_items'])
+    db.bulk_delete(items, [1])
+    assert ampho.cache.get_or_set('count', count, ['bulk_items']) == 0
+    assert ampho.http_cache.cache.get('resp', ['bulk_items']) is MISSING
+
+
+def test_bulk(ampho: Ampho):
+    """Test insert, upsert and delete
+    """
+    db = ampho.db
+    engine = db.sqlalchemy.get_engine(ampho.app)
+    metadata.create_all(engine)
+
+    progress = []
+    rows = ({'id': i, 'name': f'item{i}', 'qty': i} for i in range(1, 251))
+    result = db.bulk_insert(items, rows, chunk_size=100, on_progress=lambda r: progress.append(r.rows))
+    assert result.rows == 250
+    assert result.chunks == 3
+    assert result.rows_per_second > 0
+    assert progress == [100, 200, 250]
+    assert engine.execute(sa.select([sa.func.count()]).select_from(items)).scalar() == 250
+
+    # Update quantities only
+    rows = ({'id': i, 'name': 'changed', 'qty': i * 10} for i in range(241, 261))
+    db.bulk_upsert(items, rows, ['id'], ['qty'], chunk_size=7)
+    assert engine.execute(sa.select([sa.func.count()]).select_from(items)).scalar() == 260
+    assert tuple(engine.execute(sa.select([items.c.name, items.c.qty]).where(items.c.id == 245)).first()) == \
+        ('item245', 2450)
+    assert tuple(engine.execute(sa.select([items.c.name, items.c.qty]).where(items.c.id == 255)).first()) == \
+        ('changed', 2550)
+
+    # Keep existing rows
+    db.bulk_upsert(items, [{'id': 1, 'name': 'x', 'qty': 0}, {'id': 1000, 'name': 'x', 'qty': 0}], ['id'], [])
+    assert engine.execute(sa.select([items.c.qty]).where(items.c.id == 1)).scalar() == 1
+    assert engine.execute(sa.select([items.c.qty]).where(items.c.id == 1000)).scalar() == 0
+
+    result = db.bulk_delete(items, range(1, 101), chunk_size=30)
+    assert result.chunks == 4
+    assert engine.execute(sa.select([sa.func.count()]).select_from(items)).scalar() == 161
+
+    with pytest.raises(ValueError):
+        db.bulk_delete(sa.Table('no_pk', metadata, sa.Column('a', sa.Integer)), [1])
@@ -0,0 +1,117 @@
+"""Ampho Database Replicas Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import sqlalchemy as sa
+from os import path
+from flask import Flask
+from flask_ampho import Ampho
+from flask_ampho.db import primary, use_primary
+from flask_ampho.db.replicas import ReplicaRouter
+
+
+def _make_db(file_path: str, value: str) -> str:
+    url = f'sqlite:///{file_path}'
+    engine = sa.create_engine(url)
+    engine.execute('CREATE TABLE t (v TEXT)')
+    engine.execute('INSERT INTO t VALUES (?)', value)
+
+    return url
+
+
+def test_replicas(ampho: Ampho, tmp_path):
+    """Test routing of queries to replicas
+    """
+    config = dict(ampho.app.config)
+    config['SQLALCHEMY_DATABASE_URI'] = _make_db(path.join(tmp_path, 'primary.sqlite'), 'primary')
+    config['AMPHO_DB_REPLICAS'] = [
+        _make_db(path.join(tmp_path, 'replica1.sqlite'), 'replica1'),
+        _make_db(path.join(tmp_path, 'replica2.sqlite'), 'replica2'),
+    ]
+    # The cache listens to session events as well
+    config['AMPHO_LAZY'] = False
+    app = Flask(__name__, instance_path=path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+    session = ampho.db.sqlalchemy.session
+
+    def read() -> str:
+        return session.execute(sa.text('SELECT v FROM t')).scalar()
+
+    with app.test_request_context('/'):
+        # A replica is chosen once per session, round robin
+        first = read()
+        assert read() == first
+        session.remove()
+        assert {first, read()} == {'replica1', 'replica2'}
+
+        with primary():
+            assert read() == 'primary'
+
+        assert use_primary(read)() == 'primary'
+
+    # Read your writes
+    with app.test_request_context('/'):
+        assert read().startswith('replica')
+        session.execute(sa.text("UPDATE t SET v = 'updated'"))
+        session.commit()
+        assert read() == 'updated'
+        session.remove()
+        assert read() == 'updated'
+
+    with app.test_request_context('/'):
+        assert read().startswith('replica')
+
+        # Locking reads
+        for_update = sa.select([sa.column('v')]).select_from(sa.table('t')).with_for_update()
+        assert session.execute(for_update).scalar() == 'updated'
+        session.remove()
+
+    # Flushes of models
+    class Item(ampho.db.sqlalchemy.Model):
+        __tablename__ = 't'
+        v = sa.Column(sa.Text, primary_key=True)
+
+    with app.test_request_context('/'):
+        assert session.query(Item.v).first()[0].startswith('replica')
+        session.add(Item(v='added'))
+        session.commit()
+        assert session.query(Item.v).filter_by(v='added').count() == 1
+        session.remove()
+
+    with app.test_request_context('/'):
+        assert session.query(Item.v).filter_by(v='added').count() == 0
+
+
+def test_least_connections():
+    """Test choosing the replica with the least checked out connections
+    """
+    engines = [sa.create_engine('sqlite://', poolclass=sa.pool.QueuePool) for _ in range(2)]
+    router = ReplicaRouter(engines, 'least_connections')
+
+    with engines[0].connect():
+        assert router.choose() is engines[1]
+        with engines[1].connect(), engines[1].connect():
+            assert router.choose() is engines[0]
+
+
+def test_replica_stats(ampho: Ampho, tmp_path):
+    """Test that replica engines are configured and instrumented like the primary one
+    """
+    config = dict(ampho.app.config)
+    config['SQLALCHEMY_DATABASE_URI'] = _make_db(path.join(tmp_path, 'primary.sqlite'), 'primary')
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
+    config['AMPHO_DB_REPLICAS'] = [_make_db(path.join(tmp_path, 'replica.sqlite'), 'replica')]
+    config['AMPHO_DB_STATS'] = True
+    app = Flask(__name__, instance_path=path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+    replica = ampho.db.replicas.engines[0]
+    assert replica.pool._pre_ping
+
+    with app.test_request_context('/'):
+        assert ampho.db.sqlalchemy.session.execute(sa.text('SELECT v FROM t')).scalar() == 'replica'
+
+    assert [s['statement'] for s in ampho.db.query_stats.top()] == ['SELECT v FROM t']
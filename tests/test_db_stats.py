@@ -0,0 +1,110 @@
+"""Ampho Database Statistics Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import sqlalchemy as sa
+from os import path
+from sqlalchemy.pool import NullPool
+from flask_ampho import Ampho
+from flask_ampho.db.instrumentation import fingerprint
+from flask_ampho.db.pool import TimedQueuePool, apply_pool_settings, pool_stats
+from flask_ampho.stats import Histogram
+
+
+def test_histogram():
+    """Test Histogram
+    """
+    h = Histogram((1, 2, 5))
+    for v in (0.5, 1.5, 1.5, 3, 10):
+        h.observe(v)
+
+    assert h.count == 5
+    assert h.sum == 16.5
+    assert h.cumulative() == [1, 3, 4, 5]
+    assert h.quantile(0.5) == 2
+    assert h.quantile(1) == float('inf')
+
+    other = Histogram((1, 2, 5))
+    other.observe(1)
+    h.merge(other)
+    assert h.counts[0] == 2
+
+
+def test_fingerprint():
+    """Test statements normalization
+    """
+    assert fingerprint("SELECT * FROM t WHERE a = 'x' AND b = 10") == 'SELECT * FROM t WHERE a = ? AND b = ?'
+    assert fingerprint('SELECT * FROM t1 WHERE id IN (?, ?, ?)') == fingerprint('SELECT * FROM t1 WHERE id IN (?)')
+    assert fingerprint('SELECT * FROM t WHERE id IN (%(id_1)s,\n %(id_2)s)') == 'SELECT * FROM t WHERE id IN (...)'
+
+
+def test_query_stats(ampho: Ampho):
+    """Test query statistics collection
+    """
+    slow = []
+    ampho.signals.signal('slow-query').connect(lambda sender, **kw: slow.append(kw), weak=False)
+    stats = ampho.db.query_stats
+
+    with ampho.app.test_request_context('/'):
+        engine = ampho.db.sqlalchemy.engine
+        for i in range(3):
+            engine.execute(f'SELECT {i}')
+        assert stats.request_query_count() == 3
+
+    assert stats.request_queries.count == 1
+    top = stats.top()
+    assert top[0]['statement'] == 'SELECT ?'
+    assert top[0]['count'] == 3
+    assert not slow
+
+    # Every query is slow with zero threshold
+    ampho.set_config('AMPHO_DB_SLOW_QUERY', 0.000001)
+    with ampho.app.app_context():
+        ampho.db.sqlalchemy.engine.execute('SELECT 1')
+    assert slow[0]['fingerprint'] == 'SELECT ?'
+    assert slow[0]['duration'] > 0
+
+    stats.reset()
+    assert not stats.top()
+
+
+def test_pool(ampho: Ampho, tmp_path):
+    """Test pool configuration and statistics
+    """
+    ampho.set_config('AMPHO_DB_POOL_SIZE', 'auto')
+    ampho.set_config('AMPHO_DB_POOL_MAX_OVERFLOW', 0)
+    ampho.set_config('AMPHO_DB_POOL_PRE_PING', 'yes')
+
+    opts = apply_pool_settings(ampho.settings, 'postgresql://localhost/test', {})
+    assert opts['poolclass'] is TimedQueuePool
+    assert opts['pool_size'] == os.cpu_count()
+    assert opts['max_overflow'] == 0
+    assert opts['pool_pre_ping'] is True
+
+    # Pool size is not applied to engines with an explicit pool class
+    opts = apply_pool_settings(ampho.settings, 'postgresql://localhost/test', {'poolclass': NullPool})
+    assert 'pool_size' not in opts
+    assert opts['pool_pre_ping'] is True
+
+    # Nor to SQLite databases
+    for url in ('sqlite://', f'sqlite:///{path.join(tmp_path, "db.sqlite")}', 'sqlite+pysqlite:///db.sqlite'):
+        opts = apply_pool_settings(ampho.settings, url, {})
+        assert 'poolclass' not in opts
+        assert 'pool_size' not in opts
+
+    engine = sa.create_engine(f'sqlite:///{path.join(tmp_path, "db.sqlite")}', poolclass=TimedQueuePool,
+                              pool_size=2, max_overflow=0)
+    with engine.connect():
+        stats = pool_stats(engine.pool)
+        assert stats['checked_out'] == 1
+        assert stats['size'] == 2
+    assert pool_stats(engine.pool)['wait']['count'] == 1
+
+    with ampho.app.app_context():
+        ampho.db.sqlalchemy.engine.execute('SELECT 1')
+    stats = ampho.db.pool_stats()
+    assert list(stats.values())[0]['class'] == 'StaticPool'
+    ampho.db.dispose_engines()
@@ -0,0 +1,153 @@
+"""Ampho HTTP Caching Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+from flask import make_response
+from flask_restful import Api, Resource
+from flask_ampho import Ampho
+from flask_ampho.http_cache import conditional
+from flask_ampho.security import authorize
+from .conftest import rand_str
+
+calls = []
+
+
+class Article(Resource):
+    @conditional(cache_control='max-age=60')
+    def get(self, article_id: int):
+        calls.append(article_id)
+        return {'id': article_id, 'version': len(calls) // 10}
+
+
+class StoredArticle(Resource):
+    @conditional(weak=True, store=True, tables=('article',))
+    def get(self):
+        calls.append('stored')
+        resp = make_response({'title': 'stored'})
+        resp.set_cookie('session', rand_str())
+        resp.headers['Connection'] = 'close'
+        return resp
+
+
+class Profile(Resource):
+    @authorize
+    @conditional()
+    def get(self, auth: dict):
+        calls.append(auth.get('login'))
+        return {'login': auth.get('login')}
+
+
+def _api(ampho: Ampho) -> Api:
+    api = Api(ampho.app, '/' + rand_str())
+    api.add_resource(Article, '/article/<int:article_id>')
+    api.add_resource(StoredArticle, '/stored')
+    api.add_resource(Profile, '/profile')
+    calls.clear()
+
+    return api
+
+
+def test_conditional(ampho: Ampho):
+    """Test validators and 304 responses
+    """
+    api = _api(ampho)
+    cli = ampho.app.test_client()
+
+    resp = cli.get(f'{api.prefix}/article/1')
+    assert resp.status_code == 200
+    assert resp.get_json() == {'id': 1, 'version': 0}
+    assert resp.headers['Cache-Control'] == 'max-age=60'
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-Modified']
+    assert not etag.startswith('W/')
+
+    # Answered without running the handler
+    resp = cli.get(f'{api.prefix}/article/1', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    resp = cli.get(f'{api.prefix}/article/1', headers={'If-Modified-Since': last_modified})
+    assert resp.status_code == 304
+    assert calls == [1]
+
+    # Another resource
+    resp = cli.get(f'{api.prefix}/article/2', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert calls == [1, 2]
+
+
+def test_stored(ampho: Ampho):
+    """Test stored responses
+    """
+    api = _api(ampho)
+    cli = ampho.app.test_client()
+
+    resp = cli.get(f'{api.prefix}/stored')
+    assert resp.headers['ETag'].startswith('W/')
+    assert 'Set-Cookie' in resp.headers
+
+    # Cookies and hop-by-hop headers are not replayed
+    resp = cli.get(f'{api.prefix}/stored')
+    assert resp.get_json() == {'title': 'stored'}
+    assert 'Set-Cookie' not in resp.headers
+    assert 'Connection' not in resp.headers
+    assert calls == ['stored']
+
+    ampho.http_cache.cache.invalidate('article')
+    assert cli.get(f'{api.prefix}/stored').get_json() == {'title': 'stored'}
+    assert calls == ['stored', 'stored']
+
+
+def test_invalidation(ampho: Ampho):
+    """Test invalidation of stored responses after commits changing their tables
+    """
+    api = _api(ampho)
+    cli = ampho.app.test_client()
+    sqlalchemy = ampho.db.sqlalchemy
+
+    class Article(sqlalchemy.Model):
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+
+    with ampho.app.app_context():
+        sqlalchemy.create_all()
+
+        cli.get(f'{api.prefix}/stored')
+        cli.get(f'{api.prefix}/stored')
+        assert calls == ['stored']
+
+        # Uncommitted changes do not invalidate
+        sqlalchemy.session.add(Article())
+        sqlalchemy.session.flush()
+        cli.get(f'{api.prefix}/stored')
+        assert calls == ['stored']
+
+        sqlalchemy.session.commit()
+        cli.get(f'{api.prefix}/stored')
+        assert calls == ['stored', 'stored']
+
+
+def test_scope(ampho: Ampho):
+    """Test caching per user
+    """
+    api = _api(ampho)
+    cli = ampho.app.test_client()
+
+    token1 = ampho.security.make_jwt({'login': 'user1'})[0].serialize()
+    token2 = ampho.security.make_jwt({'login': 'user2'})[0].serialize()
+    resp = cli.get(f'{api.prefix}/profile', headers={'Authorization': f'Bearer {token1}'})
+    assert resp.headers['Cache-Control'] == 'private, no-cache'
+    etag = resp.headers['ETag']
+    resp = cli.get(f'{api.prefix}/profile', headers={'Authorization': f'Bearer {token1}', 'If-None-Match': etag})
+    assert resp.status_code == 304
+    resp = cli.get(f'{api.prefix}/profile', headers={'Authorization': f'Bearer {token2}', 'If-None-Match': etag})
+    assert resp.get_json() == {'login': 'user2'}
+    assert calls == ['user1', 'user2']
+
+    # Tokens not identifying users are not answered from the cache
+    calls.clear()
+    token = ampho.security.make_jwt({})[0].serialize()
+    for _ in range(2):
+        resp = cli.get(f'{api.prefix}/profile', headers={'Authorization': f'Bearer {token}'})
+        assert resp.status_code == 200
+        assert 'ETag' not in resp.headers
+    assert calls == [None, None]
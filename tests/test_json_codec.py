@@ -0,0 +1,58 @@
+"""Ampho JSON Codec Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import pytest
+from datetime import datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+from flask_ampho import Ampho
+from flask_ampho.error import ConfigurationError
+from flask_ampho.json_codec import get_codec, orjson, ujson
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'ujson'])
+def test_codec(name: str):
+    """Test encoding of extra types
+    """
+    if (name == 'orjson' and not orjson) or (name == 'ujson' and not ujson):
+        pytest.skip(f'{name} is not installed')
+
+    codec = get_codec(name)
+    uid = UUID('12345678-1234-5678-1234-567812345678')
+    data = {
+        'dt': datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        'uid': uid,
+        'text': 'привет/мир',
+    }
+
+    assert codec.loads(codec.dumps(data)) == {
+        'dt': '2020-01-02T03:04:05+00:00',
+        'uid': str(uid),
+        'text': 'привет/мир',
+    }
+    assert codec.loads(codec.dumps_bytes([1, 2])) == [1, 2]
+    assert codec.loads(codec.dumps(Decimal('1.10'))) == '1.10'
+    assert codec.loads(codec.dumps({'a': [(Decimal('0.1'), 1)]})) == {'a': [['0.1', 1]]}
+
+
+def test_ampho_codec(ampho: Ampho):
+    """Test codec selection and usage
+    """
+    assert ampho.json.name == ('orjson' if orjson else 'json')
+
+    ampho.set_config('AMPHO_JSON_BACKEND', 'json')
+    assert ampho.json.name == 'json'
+
+    ampho.set_config('AMPHO_TEST_JSON', '{"a": [1]}')
+    assert ampho.get_config_json('AMPHO_TEST_JSON') == {'a': [1]}
+
+    resp = ampho.app.test_client().get(f'{ampho.settings.security_rest_prefix}/1/keys')
+    assert resp.content_type == 'application/json'
+    assert 'keys' in resp.get_json()
+
+    if not ujson:
+        with pytest.raises(ConfigurationError):
+            get_codec('ujson')
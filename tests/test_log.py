@@ -0,0 +1,177 @@
+"""Ampho Logging Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import json
+import queue
+import logging
+from os import path
+from time import sleep
+from flask import Flask, g
+from flask_ampho import Ampho
+from flask_ampho.log import AsyncQueueHandler, BatchingQueueListener, DedupFilter, JsonFormatter, \
+    RequestContextFilter
+from .conftest import rand_str
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.flushes = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+    def force_flush(self):
+        self.flushes += 1
+
+
+def _record(msg: str) -> logging.LogRecord:
+    return logging.LogRecord('test', logging.INFO, __file__, 0, msg, None, None)
+
+
+def test_async_logging(ampho: Ampho, tmp_path):
+    """Test async logging mode
+    """
+    config = dict(ampho.app.config)
+    config['AMPHO_LOG_ASYNC'] = True
+    app = Flask(__name__, instance_path=path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+    assert ampho.async_logging
+
+    msg = rand_str()
+    logging.warning(msg)
+    log_path = ampho.log_handler.baseFilename
+    ampho.shutdown_logging()
+
+    assert ampho.async_logging is None
+    with open(log_path) as f:
+        assert msg in f.read()
+
+
+def test_queue_handler_overflow():
+    """Test overflow policies of the queue handler
+    """
+    handler = AsyncQueueHandler(queue.Queue(2), 'drop_count')
+    for i in range(5):
+        handler.emit(_record(str(i)))
+    assert handler.dropped == 3
+    assert handler.stats()['queue_size'] == 2
+
+    # Number of dropped records is reported as soon as the queue has a free place
+    handler.queue.get_nowait()
+    handler.queue.get_nowait()
+    handler.emit(_record('next'))
+    messages = [handler.queue.get_nowait().getMessage() for _ in range(2)]
+    assert '3 log records were dropped' in messages[0]
+    assert messages[1] == 'next'
+
+    handler = AsyncQueueHandler(queue.Queue(1), 'drop')
+    for i in range(3):
+        handler.emit(_record(str(i)))
+    handler.queue.get_nowait()
+    handler.emit(_record('next'))
+    assert handler.queue.get_nowait().getMessage() == 'next'
+    assert handler.dropped == 2
+
+
+def test_batching_listener():
+    """Test batched writes of the queue listener
+    """
+    q = queue.Queue()
+    target = _ListHandler()
+    for i in range(10):
+        q.put(_record(str(i)))
+
+    listener = BatchingQueueListener(q, target, batch_size=4)
+    listener.start()
+    listener.stop()
+
+    assert [r.getMessage() for r in target.records] == [str(i) for i in range(10)]
+    assert target.flushes <= 4
+
+
+def test_dedup_filter():
+    """Test collapsing of identical messages
+    """
+    f = DedupFilter(10.0)
+    records = [_record('Invalid token: %s') for _ in range(5)]
+    for i, r in enumerate(records):
+        r.args = (i,)
+        r.created = 100.0 + i
+
+    assert [f.filter(r) for r in records] == [True, False, False, False, False]
+    assert f.suppressed == 4
+
+    # Other messages are not affected
+    assert f.filter(_record(rand_str()))
+
+    # The first message after the window reports number of repetitions
+    r = _record('Invalid token: %s')
+    r.args = ('x',)
+    r.created = 111.0
+    assert f.filter(r)
+    assert r.repeated == 4
+    assert r.getMessage() == 'Invalid token: x (repeated 4 times)'
+
+
+def test_dedup_filter_flush():
+    """Test reporting of suppressed messages which do not recur
+    """
+    target = _ListHandler()
+    f = DedupFilter(0.1)
+    target.addFilter(f)
+    f.start(target)
+    assert f.is_running
+
+    for i in range(3):
+        target.handle(_record('Slow query'))
+    target.handle(_record('Cache miss'))
+    target.handle(_record('Cache miss'))
+    assert [r.getMessage() for r in target.records] == ['Slow query', 'Cache miss']
+
+    # Counts are reported once the window expires
+    for _ in range(50):
+        if len(target.records) == 4:
+            break
+        sleep(0.05)
+    messages = sorted(r.getMessage() for r in target.records[2:])
+    assert messages == ['Cache miss (repeated 1 times)', 'Slow query (repeated 2 times)']
+    assert sorted(r.repeated for r in target.records[2:]) == [1, 2]
+
+    # Pending counts are reported on stop
+    f.window = 60.0
+    target.handle(_record('Cache miss'))
+    target.handle(_record('Cache miss'))
+    assert len(target.records) == 5
+    f.stop()
+    assert not f.is_running
+    assert target.records[-1].getMessage() == 'Cache miss (repeated 1 times)'
+
+
+def test_json_formatter(ampho: Ampho):
+    """Test JSON formatter and request context filter
+    """
+    formatter = JsonFormatter()
+    context_filter = RequestContextFilter()
+
+    r = _record('outside')
+    context_filter.filter(r)
+    data = json.loads(formatter.format(r))
+    assert data['message'] == 'outside'
+    assert data['level'] == 'INFO'
+    assert data['request_id'] is None
+
+    with ampho.app.test_request_context('/foo', headers={'X-Request-ID': 'abc'}):
+        g.ampho_auth = {'login': 'john'}
+        r = _record('inside')
+        context_filter.filter(r)
+        data = json.loads(formatter.format(r))
+
+    assert data['request_id'] == 'abc'
+    assert data['route'] == '/foo'
+    assert data['login'] == 'john'
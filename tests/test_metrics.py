@@ -0,0 +1,100 @@
+"""Ampho Metrics Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import json
+from os import path
+from time import sleep
+from flask import Flask
+from flask_ampho import Ampho
+from flask_ampho.metrics import MetricFamily, render
+from flask_ampho.stats import Histogram
+
+
+def test_render():
+    """Test the text format
+    """
+    hist = Histogram((0.1, 1))
+    hist.observe(0.05)
+    hist.observe(5)
+    fam = MetricFamily('t_seconds', 'histogram', 'Test.').add_histogram(hist, path='/a"b')
+
+    assert render([fam]) == '\n'.join([
+        '# HELP t_seconds Test.',
+        '# TYPE t_seconds histogram',
+        't_seconds_bucket{le="0.1",path="/a\\"b"} 1',
+        't_seconds_bucket{le="1",path="/a\\"b"} 1',
+        't_seconds_bucket{le="+Inf",path="/a\\"b"} 2',
+        't_seconds_sum{path="/a\\"b"} 5.05',
+        't_seconds_count{path="/a\\"b"} 2',
+    ]) + '\n'
+
+
+def test_metrics(ampho: Ampho, tmp_path):
+    """Test request metrics and the endpoint
+    """
+    # The endpoint is not registered by default
+    assert ampho.app.test_client().get('/metrics').status_code == 404
+
+    config = dict(ampho.app.config)
+    config['AMPHO_METRICS_PATH'] = '/metrics'
+    config['AMPHO_METRICS_TOKEN'] = 'secret'
+    app = Flask(__name__, instance_path=path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    Ampho(app)
+    app.add_url_rule('/hello', 'hello', lambda: 'hello')
+
+    client = app.test_client()
+    client.get('/hello')
+    client.get('/hello')
+    client.get('/not-found')
+
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    body = client.get('/metrics', headers={'Authorization': 'Bearer secret'}).data.decode()
+    assert 'ampho_http_requests_total{endpoint="hello",method="GET",status="200"} 2' in body
+    assert 'ampho_http_requests_total{endpoint="",method="GET",status="404"} 1' in body
+    assert 'ampho_http_request_duration_seconds_count{endpoint="hello",method="GET"} 2' in body
+    assert 'ampho_token_cache_hits_total 0' in body
+    assert 'ampho_cache_hits_total 0' in body
+
+
+def test_multiprocess(ampho: Ampho, tmp_path):
+    """Test aggregation of metrics of several processes
+    """
+    dir_path = path.join(tmp_path, 'metrics')
+    config = dict(ampho.app.config)
+    config['AMPHO_METRICS_DIR'] = dir_path
+    config['AMPHO_METRICS_SYNC_INTERVAL'] = 0.05
+    app = Flask(__name__, instance_path=path.join(tmp_path, 'instance'))
+    app.config.from_mapping(config)
+    ampho = Ampho(app)
+    app.add_url_rule('/hello', 'hello', lambda: 'hello')
+    app.test_client().get('/hello')
+    assert ampho.metrics.is_running
+
+    # A finished worker
+    other = MetricFamily('ampho_http_requests_total', 'counter', '').add(3, endpoint='hello', method='GET', status=200)
+    gauge = MetricFamily('ampho_cache_size', 'gauge', '').add(10)
+    with open(path.join(dir_path, '999999999.json'), 'w') as f:
+        json.dump([other.as_dict(), gauge.as_dict()], f)
+
+    families = {fam.name: fam for fam in ampho.metrics.collect()}
+    requests = families['ampho_http_requests_total'].samples
+    assert requests[('', (('endpoint', 'hello'), ('method', 'GET'), ('status', '200')))] == 4
+    assert len(families['ampho_cache_size'].samples) == 1
+
+    # Metrics are written in background, to a file not clashing with ones of finished processes using the same PID
+    for _ in range(100):
+        if path.isfile(ampho.metrics.file_path):
+            break
+        sleep(0.05)
+    assert path.basename(ampho.metrics.file_path).startswith(f'{os.getpid()}-')
+    with open(ampho.metrics.file_path) as f:
+        assert any(d['name'] == 'ampho_http_requests_total' for d in json.load(f))
+
+    ampho.metrics.stop()
+    assert not ampho.metrics.is_running
@@ -4,8 +4,21 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
-from time import time
+import json
+import pytest
+from os import path, PathLike
+from time import sleep, time
+from threading import current_thread
+from sqlalchemy import create_engine
+from jwcrypto.jwk import JWK
+from jwcrypto.jwt import JWT
+from jwcrypto.common import base64url_decode
 from flask_ampho import Ampho
+from flask_ampho.security.error import InvalidTokenError
+from flask_ampho.security.token_cache import TokenCache
+from flask_ampho.security.signer import Signer
+from flask_ampho.security.revocation import BloomFilter, RevocationList, FileBackend, DbBackend
+from flask_ampho.auth.tables import metadata
 from .conftest import rand_int, rand_str
 
 
@@ -13,7 +26,7 @@ def test_make_jwt(ampho: Ampho):
     """make_jwt() test
     """
     ttl = rand_int(1, 1000)
-    ampho.app.config['AMPHO_SECURITY_TOKEN_TTL'] = ttl
+    ampho.set_config('AMPHO_SECURITY_TOKEN_TTL', ttl)
 
     k = rand_str()
     v = rand_str()
@@ -24,3 +37,248 @@ def test_make_jwt(ampho: Ampho):
     assert claims['nbf'] == now
     assert claims['exp'] == now + ttl
     assert claims[k] == v
+
+
+def test_verify_jwt(ampho: Ampho):
+    """verify_jwt() test
+    """
+    k = rand_str()
+    v = rand_str()
+    jwt, _ = ampho.security.make_jwt({k: v})
+    token = jwt.serialize()
+
+    cache = ampho.security.token_cache
+    hits, misses = cache.hits, cache.misses
+
+    assert ampho.security.verify_jwt(token)[k] == v
+    assert cache.misses == misses + 1
+
+    # Claims must be served from cache and must not be shared between callers
+    claims = ampho.security.verify_jwt(token)
+    assert claims[k] == v
+    assert cache.hits == hits + 1
+    claims[k] = rand_str()
+    assert ampho.security.verify_jwt(token)[k] == v
+
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(token[:-2])
+
+
+def test_token_leeway(ampho: Ampho):
+    """Test the configurable clock skew tolerance
+    """
+    ampho.set_config('AMPHO_SECURITY_TOKEN_LEEWAY', 5)
+    jwt, _ = ampho.security.make_jwt({})
+    assert jwt.leeway == 5
+
+    now = int(time())
+    signer = ampho.security.signer
+    assert ampho.security.verify_jwt(signer.sign({'nbf': now + 3, 'exp': now + 100}))
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(signer.sign({'nbf': now + 30, 'exp': now + 100}))
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(signer.sign({'nbf': now - 100, 'exp': now - 30}))
+
+
+def test_token_cache():
+    """TokenCache test
+    """
+    cache = TokenCache(2)
+    exp = int(time()) + 100
+
+    cache.put('a', {'exp': exp})
+    cache.put('b', {'exp': exp})
+    assert cache.get('a') == {'exp': exp}
+
+    # Least recently used entry must be evicted
+    cache.put('c', {'exp': exp})
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+
+    # Expired tokens must never be cached
+    cache.put('d', {'exp': int(time()) - 1})
+    assert cache.get('d') is None
+
+
+def test_make_jwt_many(ampho: Ampho):
+    """make_jwt_many() test
+    """
+    logins = [rand_str() for _ in range(5)]
+    tokens = ampho.security.make_jwt_many([{'login': login} for login in logins])
+
+    assert len(tokens) == len(logins)
+    for login, (t, claims) in zip(logins, tokens):
+        assert claims['login'] == login
+        assert ampho.security.verify_jwt(t.serialize()) == claims
+
+
+@pytest.mark.parametrize('alg, key_args', [
+    ('HS256', {'kty': 'oct', 'size': 256}),
+    ('HS512', {'kty': 'oct', 'size': 512}),
+    ('RS256', {'kty': 'RSA', 'size': 2048}),
+    ('PS256', {'kty': 'RSA', 'size': 2048}),
+    ('ES256', {'kty': 'EC', 'crv': 'P-256'}),
+    ('ES384', {'kty': 'EC', 'crv': 'P-384'}),
+    ('EdDSA', {'kty': 'OKP', 'crv': 'Ed25519'}),
+])
+def test_signer(alg: str, key_args: dict):
+    """Signer test
+    """
+    key = JWK.generate(**key_args)
+    signer = Signer(key, alg, rand_str())
+    claims = {rand_str(): rand_str()}
+
+    assert signer.is_native
+    t = JWT(jwt=signer.sign(claims), key=key)
+    assert json.loads(t.claims) == claims
+    assert json.loads(t.header) == signer.header
+
+
+def test_key_rotation(ampho: Ampho):
+    """Key rotation test
+    """
+    old_key = JWK.generate(kty='oct', size=256, kid='old')
+    new_key = JWK.generate(kty='EC', crv='P-256', kid='new')
+
+    ampho.set_config('AMPHO_SECURITY_KEY', {'keys': [old_key.export(as_dict=True)]})
+    old_t, _ = ampho.security.make_jwt({})
+    assert json.loads(base64url_decode(old_t.serialize().split('.')[0])) == {'alg': 'HS256', 'kid': 'old'}
+
+    # New key becomes active while the old one is still accepted
+    ampho.set_config('AMPHO_SECURITY_KEY', [new_key.export(as_dict=True), old_key.export(as_dict=True)])
+    new_t, _ = ampho.security.make_jwt({})
+    assert json.loads(base64url_decode(new_t.serialize().split('.')[0])) == {'alg': 'ES256', 'kid': 'new'}
+    assert ampho.security.verify_jwt(old_t.serialize())
+    assert ampho.security.verify_jwt(new_t.serialize())
+
+    # Tokens signed by a removed key are rejected
+    ampho.set_config('AMPHO_SECURITY_KEY', new_key.export())
+    assert ampho.security.verify_jwt(new_t.serialize())
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(old_t.serialize())
+
+
+def test_bloom_filter():
+    """BloomFilter test
+    """
+    items = [rand_str(16) for _ in range(1000)]
+    bloom = BloomFilter(len(items), 0.01)
+    for item in items:
+        bloom.add(item)
+
+    assert all(item in bloom for item in items)
+    assert sum(rand_str(17) in bloom for _ in range(1000)) < 50
+
+
+def test_revoke(ampho: Ampho):
+    """revoke() test
+    """
+    t1, claims = ampho.security.make_jwt({})
+    t2, _ = ampho.security.make_jwt({})
+    assert ampho.security.verify_jwt(t1.serialize())
+
+    ampho.security.revoke(claims['jti'], claims['exp'])
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(t1.serialize())
+    assert ampho.security.verify_jwt(t2.serialize())
+
+    # Revocations are kept while tokens may be accepted within the leeway
+    ampho.set_config('AMPHO_SECURITY_TOKEN_LEEWAY', 30)
+    jti = rand_str()
+    ampho.security.revoke(jti, claims['exp'])
+    entries, _ = ampho.security.revocations.backend.fetch()
+    assert (jti, claims['exp'] + 30) in entries
+
+
+@pytest.mark.parametrize('backend', ['file', 'db'])
+def test_revocation_backends(backend: str, tmp_path: PathLike):
+    """Revocation backends test
+    """
+    if backend == 'file':
+        def make_backend():
+            return FileBackend(path.join(tmp_path, 'revoked'))
+    else:
+        engine = create_engine(f"sqlite:///{path.join(tmp_path, 'revoked.db')}")
+        metadata.create_all(engine)
+
+        def make_backend():
+            return DbBackend(engine)
+
+    exp = int(time()) + 100
+    worker_1 = RevocationList(make_backend(), sync_interval=0)
+    worker_2 = RevocationList(make_backend(), sync_interval=0)
+
+    jti = rand_str()
+    assert not worker_2.is_revoked(jti)
+    worker_1.revoke(jti, exp)
+    assert worker_1.is_revoked(jti)
+    assert worker_2.is_revoked(jti)
+
+    # Expired entries must not be loaded
+    expired = rand_str()
+    worker_1.revoke(expired, int(time()) - 1)
+    worker_3 = RevocationList(make_backend())
+    worker_3.sync()
+    assert not worker_3.is_revoked(expired)
+
+    # Checks do not query the backend, which is synchronized in background
+    worker_4 = RevocationList(make_backend(), sync_interval=0.05)
+    worker_4.start()
+    fetch = worker_4.backend.fetch
+    threads = set()
+
+    def _fetch(cursor=None):
+        threads.add(current_thread().name)
+        return fetch(cursor)
+
+    worker_4.backend.fetch = _fetch
+    jti = rand_str()
+    worker_1.revoke(jti, exp)
+    for _ in range(100):
+        if worker_4.is_revoked(jti):
+            break
+        sleep(0.02)
+    assert worker_4.is_revoked(jti)
+    assert threads == {'ampho-revocation-sync'}
+    worker_4.stop()
+
+
+def test_revocation_db_late_commit(tmp_path: PathLike):
+    """Test that rows committed after rows with greater IDs are not missed
+    """
+    engine = create_engine(f"sqlite:///{path.join(tmp_path, 'revoked.db')}")
+    metadata.create_all(engine)
+    backend = DbBackend(engine)
+    table = backend.table
+    exp = int(time()) + 100
+
+    engine.execute(table.insert().values(id=10, jti='committed-first', exp=exp))
+    worker = RevocationList(backend, sync_interval=0)
+    assert worker.is_revoked('committed-first')
+
+    # The row got its ID earlier, but is committed after the other one is fetched
+    engine.execute(table.insert().values(id=5, jti='committed-late', exp=exp))
+    assert worker.is_revoked('committed-late')
+    assert len(worker) == 2
+
+
+def test_revocation_file_compaction(tmp_path: PathLike):
+    """Revocation file compaction test
+    """
+    file_path = path.join(tmp_path, 'revoked')
+    backend = FileBackend(file_path, compact_size=100)
+    reader = RevocationList(FileBackend(file_path), sync_interval=0)
+
+    for i in range(10):
+        backend.add(f'expired-{i}', int(time()) - 1)
+    backend.add('valid', int(time()) + 100)
+    assert reader.is_revoked('valid')
+
+    with open(file_path) as f:
+        assert f.read().split() == ['valid', str(int(time()) + 100)]
+
+    # Readers notice the replaced file
+    backend.add('new', int(time()) + 100)
+    assert reader.is_revoked('new')
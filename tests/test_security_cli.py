@@ -5,14 +5,17 @@ __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
 import json
+import pytest
 from jwcrypto.jwk import JWKTypesRegistry
 from flask_ampho import Ampho
+from flask_ampho.security.error import InvalidTokenError
 
 
 def test_sec_gen_key(ampho: Ampho):
     """make_jwt() test
     """
     runner = ampho.app.test_cli_runner()
+    ampho.init_subsystems()
 
     from flask_ampho.security._cli import sec_gen_key
     result = runner.invoke(sec_gen_key)
@@ -22,3 +25,17 @@ def test_sec_gen_key(ampho: Ampho):
     assert isinstance(res_json, dict)
     assert 'k' in res_json
     assert res_json.get('kty') in JWKTypesRegistry
+
+
+def test_sec_revoke(ampho: Ampho):
+    """sec_revoke() test
+    """
+    runner = ampho.app.test_cli_runner()
+    t, _ = ampho.security.make_jwt({})
+
+    from flask_ampho.security._cli import sec_revoke
+    result = runner.invoke(sec_revoke, [t.serialize()])
+
+    assert result.exit_code == 0
+    with pytest.raises(InvalidTokenError):
+        ampho.security.verify_jwt(t.serialize())
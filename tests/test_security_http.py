@@ -4,10 +4,16 @@ __author__ = 'Alexander Shepetko'
 __email__ = 'a@shepetko.com'
 __license__ = 'MIT'
 
+import pytest
+from os import path, PathLike
 from werkzeug import Response
+from jwcrypto.jwk import JWK
+from jwcrypto.jwt import JWT
 from flask_restful import Api, Resource
 from flask_ampho import Ampho
 from flask_ampho.security import authorize
+from flask_ampho.auth.tables import metadata
+from flask_ampho.security.rate_limit import RateLimiter, MemoryStore, SqliteStore
 from .conftest import rand_str
 
 
@@ -32,3 +38,134 @@ def test_authorize(ampho: Ampho):
     # Unauthorized response
     resp = cli.get(res_url)  # type: Response
     assert resp.status_code == 401
+
+
+def test_login_renew(ampho: Ampho):
+    """Login and renew resources test
+    """
+    prefix = ampho.get_config('AMPHO_SECURITY_REST_PREFIX', '/api/security') + '/1'
+    cli = ampho.app.test_client()
+
+    login = rand_str()
+    password = rand_str()
+    metadata.create_all(ampho.security.users.engine)
+    ampho.security.users.create(login, password)
+
+    resp = cli.post(f'{prefix}/login', json={'login': login, 'password': rand_str()})  # type: Response
+    assert resp.status_code == 401
+    resp = cli.post(f'{prefix}/login', json={'login': rand_str(), 'password': password})
+    assert resp.status_code == 401
+
+    resp = cli.post(f'{prefix}/login', json={'login': login, 'password': password})
+    assert resp.status_code == 200
+    token = resp.get_json()['token']
+    assert ampho.security.verify_jwt(token)['login'] == login
+
+    resp = cli.post(f'{prefix}/renew', headers={'Authorization': f'Bearer {token}'})
+    assert resp.status_code == 200
+    assert ampho.security.verify_jwt(resp.get_json()['token'])['login'] == login
+
+    resp = cli.post(f'{prefix}/renew', headers={'Authorization': f'Bearer {token[:-2]}'})
+    assert resp.status_code == 401
+
+    # Hashes of unknown formats and corrupt hashes fail authentication
+    users = ampho.security.users
+    for hashed in ('md5$' + rand_str(), 'pbkdf2_sha256$many$c2FsdA==$aGFzaA=='):
+        with users.engine.begin() as conn:
+            conn.execute(users.table.update().where(users.table.c.login == login).values(password=hashed))
+        resp = cli.post(f'{prefix}/login', json={'login': login, 'password': password})
+        assert resp.status_code == 401
+
+
+def test_keys(ampho: Ampho):
+    """Keys resource test
+    """
+    prefix = ampho.get_config('AMPHO_SECURITY_REST_PREFIX', '/api/security') + '/1'
+    cli = ampho.app.test_client()
+
+    # Symmetric keys must never be exposed
+    assert cli.get(f'{prefix}/keys').get_json() == {'keys': []}
+
+    key = JWK.generate(kty='RSA', size=2048, kid=rand_str())
+    ampho.set_config('AMPHO_SECURITY_KEY', key.export())
+
+    keys = cli.get(f'{prefix}/keys').get_json()['keys']
+    assert len(keys) == 1
+    assert keys[0]['kid'] == key.get('kid')
+    assert keys[0]['alg'] == 'RS256'
+    assert 'd' not in keys[0]
+
+    t, _ = ampho.security.make_jwt({})
+    assert JWT(jwt=t.serialize(), key=JWK(**keys[0]))
+
+
+def test_rate_limit(ampho: Ampho):
+    """Login rate limiting test
+    """
+    prefix = ampho.get_config('AMPHO_SECURITY_REST_PREFIX', '/api/security') + '/1'
+    metadata.create_all(ampho.security.users.engine)
+    ampho.security.rate_limiter = RateLimiter(MemoryStore(), (10, 60), (2, 60))
+    cli = ampho.app.test_client()
+
+    login = rand_str()
+    for _ in range(2):
+        assert cli.post(f'{prefix}/login', json={'login': login, 'password': rand_str()}).status_code == 401
+
+    resp = cli.post(f'{prefix}/login', json={'login': login, 'password': rand_str()})  # type: Response
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) == 30
+
+    # Other logins are limited only per IP
+    assert cli.post(f'{prefix}/login', json={'login': rand_str(), 'password': rand_str()}).status_code == 401
+
+
+@pytest.mark.parametrize('store', ['memory', 'sqlite'])
+def test_rate_limit_stores(store: str, tmp_path: PathLike):
+    """Rate limiter stores test
+    """
+    if store == 'memory':
+        s = MemoryStore()
+    else:
+        s = SqliteStore(path.join(tmp_path, 'rate-limit.sqlite'))
+
+    limit = (2, 10)
+    assert s.consume('k', limit, 100) == 0
+    assert s.consume('k', limit, 100) == 0
+    assert s.consume('k', limit, 100) == 5
+    assert s.consume('k', limit, 105) == 0
+    assert s.consume('k', limit, 105) == 5
+
+
+def test_sqlite_store_pruning(tmp_path: PathLike):
+    """SQLite rate limit store pruning test
+    """
+    s = SqliteStore(path.join(tmp_path, 'rate-limit.sqlite'), prune_interval=10)
+
+    for key in ('a', 'b', 'c'):
+        s.consume(key, (5, 10), 100)
+    s.consume('ip', (100, 10000), 101)
+    assert len(s) == 4
+
+    # Full buckets are pruned according to their own limits, so the IP bucket is kept
+    assert s.consume('login', (1, 60), 111) == 0
+    assert len(s) == 2
+    assert s.consume('ip', (100, 10000), 112) == 0
+    assert s.consume('login', (1, 60), 112) == 59
+
+
+def test_memory_store_pruning():
+    """Memory rate limit store eviction and pruning test
+    """
+    s = MemoryStore(max_keys=3, prune_interval=10)
+
+    # Least recently used buckets are evicted
+    for key in ('a', 'b', 'c', 'd'):
+        s.consume(key, (5, 10), 100)
+    s.consume('ip', (100, 10000), 101)
+    assert len(s) == 3
+
+    # Full buckets are pruned according to their own limits, so the IP bucket is kept
+    assert s.consume('login', (1, 60), 111) == 0
+    assert len(s) == 2
+    assert s.consume('ip', (100, 10000), 112) == 0
+    assert s.consume('login', (1, 60), 112) == 59
@@ -0,0 +1,199 @@
+"""Ampho Tasks Tests
+"""
+__author__ = 'Alexander Shepetko'
+__email__ = 'a@shepetko.com'
+__license__ = 'MIT'
+
+import os
+import sys
+import pytest
+import threading
+import subprocess
+from time import perf_counter, sleep
+from flask import current_app
+from flask_ampho import Ampho
+from flask_ampho.tasks import TaskQueueFullError, TaskTimeoutError
+from flask_ampho.tasks.executor import Executor
+from flask_ampho.tasks.queue import TaskQueue
+from flask_ampho.tasks.tables import metadata
+
+calls = []
+attempts = {}
+
+_EXIT_SCRIPT = '''
+import sys, atexit, time
+from os import path
+from flask import Flask
+from flask_ampho import Ampho
+
+app = Flask('app', instance_path=path.join(sys.argv[1], 'instance'))
+app.config.from_mapping({
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'AMPHO_LOG_DIR': path.join(sys.argv[1], 'log'),
+    'AMPHO_CONFIG_DIR': path.join(sys.argv[1], 'config'),
+    'AMPHO_TASKS_THREADS': 1,
+    'AMPHO_TASKS_SHUTDOWN_TIMEOUT': 0.2,
+    'AMPHO_LAZY': True,
+})
+ampho = Ampho(app)
+
+# Registered before the tasks subsystem is initialized, so it runs after its shutdown
+futures = []
+atexit.register(lambda: print(sum(f.cancelled() for f in futures)))
+
+futures.extend(ampho.tasks.submit(time.sleep, 1) for _ in range(5))
+'''
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+def flaky(n: int):
+    attempts[n] = attempts.get(n, 0) + 1
+    if attempts[n] < n:
+        raise RuntimeError('flaky')
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+def test_executor(ampho: Ampho):
+    """Test thread and process pools, bounded queue and timeouts
+    """
+    executor = Executor(ampho.app, threads=1, processes=1, queue_size=2)
+
+    # Thread tasks run within the application context
+    assert executor.submit(lambda: current_app.name).result(5) == ampho.app.name
+    assert executor.submit(get_pid, process=True).result(30) != os.getpid()
+    assert executor.submit(sleep, 5, process=True, timeout=0.2).exception(30).__class__ is TaskTimeoutError
+
+    # The only thread is busy and one more task waits for it
+    release = threading.Event()
+    executor.submit(release.wait, 5)
+    waiting = executor.submit(record, 'late', timeout=0.1)
+    with pytest.raises(TaskQueueFullError):
+        executor.submit(record)
+    sleep(0.2)
+    release.set()
+    assert isinstance(waiting.exception(5), TaskTimeoutError)
+
+    executor.shutdown(5)
+    stats = executor.stats()
+    assert stats['pending'] == 0
+    assert stats['rejected'] == 1
+    assert stats['timed_out'] == 2
+    assert stats['completed'] == 3
+
+
+def test_exit(tmp_path):
+    """Test that queued tasks do not delay exit longer than the shutdown timeout
+    """
+    script = os.path.join(tmp_path, 'exit.py')
+    with open(script, 'w') as f:
+        f.write(_EXIT_SCRIPT)
+
+    started = perf_counter()
+    proc = subprocess.run([sys.executable, script, str(tmp_path)], stdout=subprocess.PIPE, timeout=30,
+                          universal_newlines=True)
+    assert proc.returncode == 0
+    assert proc.stdout.strip() == '4'
+    assert perf_counter() - started < 3
+
+
+def test_connect_async(ampho: Ampho):
+    """Test receivers running in background
+    """
+    calls.clear()
+    on_event = ampho.signals.signal('test-event')
+    main_thread = threading.get_ident()
+
+    @ampho.tasks.connect_async('test-event')
+    def on_test_event(sender, **kwargs):
+        calls.append((sender.name, kwargs, threading.get_ident() != main_thread))
+
+    ((_, future),) = on_event.send(ampho.app, value=1)
+    future.result(5)
+    assert calls == [(ampho.app.name, {'value': 1}, True)]
+
+
+def test_durable_queue(ampho: Ampho):
+    """Test the durable queue and the worker
+    """
+    calls.clear()
+    attempts.clear()
+    ampho.set_config('AMPHO_TASKS_RETRY_DELAY', 0)
+    metadata.create_all(ampho.db.sqlalchemy.engine)
+    tasks = ampho.tasks
+
+    tasks.enqueue(record, 1, key='value')
+    tasks.enqueue('tests.test_tasks:flaky', 2)
+    tasks.enqueue(flaky, 10, max_attempts=2)
+    tasks.enqueue(record, 'later', delay=60)
+    with pytest.raises(Exception):
+        tasks.enqueue(lambda: None)
+
+    stats = tasks.run_worker(burst=True)
+    assert (stats.done, stats.retried, stats.failed) == (2, 2, 1)
+    assert calls[0] == ((1,), {'key': 'value'})
+    assert tasks.queue.counts() == {'pending': 1, 'running': 0, 'done': 2, 'failed': 1}
+
+
+def test_stale_tasks(ampho: Ampho):
+    """Test recovery of tasks claimed by dead workers
+    """
+    metadata.create_all(ampho.db.sqlalchemy.engine)
+    queue = ampho.tasks.queue
+
+    # Tasks of dead workers are returned to the queue
+    queue.enqueue(record, 'stale')
+    task = queue.claim()
+    assert task.attempts == 1
+    assert queue.requeue_stale(-1) == 1
+    assert ampho.tasks.run_worker(burst=True, max_tasks=1).done == 1
+
+    # Tasks of alive workers are not
+    queue.enqueue(record, 'alive')
+    task = queue.claim()
+    with queue.keep_alive(task, 0.05):
+        sleep(0.2)
+        assert queue.requeue_stale(0.1) == 0
+    assert queue.complete(task)
+
+    # Late results of tasks claimed by other workers are not recorded
+    queue.enqueue(record, 'requeued')
+    task = queue.claim()
+    assert queue.requeue_stale(-1) == 1
+    other = TaskQueue(queue.engine, queue.codec, worker_id='other')
+    assert other.claim().id == task.id
+    assert not queue.complete(task)
+    assert not queue.fail(task, RuntimeError('late'))
+    assert other.complete(task)
+
+    # Tasks killing their workers are not retried forever
+    queue.enqueue(record, 'killer', max_attempts=1)
+    queue.claim()
+    assert queue.requeue_stale(-1) == 0
+    assert queue.claim() is None
+    assert queue.counts() == {'pending': 0, 'running': 0, 'done': 3, 'failed': 1}
+
+
+def test_worker_cli(ampho: Ampho):
+    """Test the worker command
+    """
+    runner = ampho.app.test_cli_runner()
+    ampho.init_subsystems()
+
+    from flask_ampho.tasks._cli import worker
+    result = runner.invoke(worker, ['--burst'])
+    assert result.exit_code == 1
+
+    ampho.set_config('AMPHO_TASKS_DB', True)
+    assert 'flask_ampho.tasks' in ampho.db.get_migration_packages()
+    metadata.create_all(ampho.db.sqlalchemy.engine)
+    ampho.tasks.enqueue(record, 'cli')
+    result = runner.invoke(worker, ['--burst'])
+    assert result.exit_code == 0, result.output
+    assert '1 tasks processed' in result.output